@@ -0,0 +1,229 @@
+#! usr/bin/env python
+
+""" bench_diff times the two phases of a Table Differ run, building the 'diff_table'
+    (DiffWriter.create_diff_table) and reporting on it (BasicReport.generate_report),
+    on synthetic table pairs generated inside each database.
+    Row count, column count, key arity, change rate and NULL density can be varied,
+    and every timing is emitted as json so regressions show up as numbers.
+
+    Run from the repository root:
+        python -m benchmarks.bench_diff --rows 10000 1000000 --engines sqlite duckdb
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+
+from modules.create_diff_table import DiffWriter
+from modules.reporting import BasicReport
+
+TABLE_INITIAL = 'bench_initial'
+TABLE_SECONDARY = 'bench_secondary'
+TABLE_DIFF = 'bench_diff'
+
+
+def get_cli_args(cli_args=None):
+    parser = argparse.ArgumentParser(description="Benchmarks Table Differ on synthetic table pairs")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000],
+                        help="row counts of the initial table to benchmark")
+    parser.add_argument("--cols", type=int, default=5,
+                        help="number of compared columns")
+    parser.add_argument("--key-arity", type=int, default=1,
+                        help="number of key columns")
+    parser.add_argument("--change-rate", type=float, default=0.01,
+                        help="fraction of keys that are modified, removed or added")
+    parser.add_argument("--null-density", type=float, default=0.1,
+                        help="fraction of compared values that are NULL")
+    parser.add_argument("--engines", nargs="+", default=["sqlite", "duckdb", "postgres"],
+                        choices=["sqlite", "duckdb", "postgres"],
+                        help="engines to benchmark, those not available here are skipped")
+    parser.add_argument("--pg-dsn",
+                        help="psycopg2 connection string of a scratch postgres database")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="number of timed runs per configuration")
+    parser.add_argument("--output",
+                        help="json file the results are written to, default stdout")
+    return parser.parse_args(cli_args)
+
+
+def get_sequence(db_type: str, last_id: int) -> str:
+    """ Returns a FROM item producing the ids 1 to last_id
+    """
+    if db_type == 'sqlite':
+        return f"""(WITH RECURSIVE seq(id) AS (SELECT 1 UNION ALL SELECT id + 1 FROM seq WHERE id < {last_id})
+                    SELECT id FROM seq) s"""
+    elif db_type == 'duckdb':
+        return f"(SELECT range AS id FROM range(1, {last_id + 1})) s"
+    return f"(SELECT generate_series(1, {last_id})::bigint AS id) s"
+
+
+def get_random(seed: int) -> str:
+    """ Returns a deterministic pseudo random expression of id in [0, 1000003)
+    """
+    return f"(((id + {seed * 7919}) * 2654435761) % 1000003)"
+
+
+def build_tables(conn, db_type: str, rows: int, cols: int, key_arity: int,
+                 change_rate: float, null_density: float):
+    """ Creates the initial table with ids 1 to rows and a secondary table in which
+        about change_rate of the keys were modified, removed or added, a third each
+    """
+    changed = f"{get_random(99)} < {int(change_rate * 1000003)}"
+    removed = f"({changed} AND id % 3 = 1)"
+    modified = f"({changed} AND id % 3 <> 1)"
+    added_cnt = int(rows * change_rate / 3)
+
+    key_exprs = ['id AS k0'] + [f"id % {7 + num} AS k{num}" for num in range(1, key_arity)]
+    value_exprs = [f"CASE WHEN {get_random(num)} < {int(null_density * 1000003)} THEN NULL "
+                   f"ELSE {get_random(num + 1000)} END" for num in range(cols)]
+    initial_cols = key_exprs + [f"{expr} AS c{num}" for num, expr in enumerate(value_exprs)]
+    secondary_cols = key_exprs + [f"CASE WHEN {modified} THEN COALESCE({value_exprs[0]}, 0) + 1 "
+                                  f"ELSE {value_exprs[0]} END AS c0"]
+    secondary_cols += [f"{expr} AS c{num}" for num, expr in enumerate(value_exprs) if num]
+
+    cur = conn.cursor()
+    for table_name in (TABLE_INITIAL, TABLE_SECONDARY, TABLE_DIFF):
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cur.execute(f"CREATE TABLE {TABLE_INITIAL} AS SELECT {', '.join(initial_cols)} "
+                f"FROM {get_sequence(db_type, rows)}")
+    cur.execute(f"CREATE TABLE {TABLE_SECONDARY} AS SELECT {', '.join(secondary_cols)} "
+                f"FROM {get_sequence(db_type, rows + added_cnt)} WHERE id > {rows} OR NOT {removed}")
+    conn.commit()
+
+
+def get_args(db_type: str, schema_name: str, cols: int, key_arity: int) -> dict:
+    return {
+        "database": {"db_type": db_type},
+        "table_info": {
+            "table_initial": TABLE_INITIAL,
+            "table_secondary": TABLE_SECONDARY,
+            "table_diff": TABLE_DIFF,
+            "schema_name": schema_name,
+            "key_cols": [f"k{num}" for num in range(key_arity)],
+            "comp_cols": [f"c{num}" for num in range(cols)],
+            "ignore_cols": [],
+            "initial_table_alias": "initial",
+            "secondary_table_alias": "secondary",
+            "except_rows": None},
+        "system": {}}
+
+
+def time_run(conn, db_type: str, schema_name: str, cols: int, key_arity: int) -> dict:
+    """ Times the diff and report phases of one run, keeping their console output quiet
+    """
+    args = get_args(db_type, schema_name, cols, key_arity)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        DiffWriter(args, conn).create_diff_table()
+        diff_seconds = time.perf_counter() - start
+
+        report = BasicReport(conn, schema_name, TABLE_INITIAL, TABLE_SECONDARY, TABLE_DIFF,
+                             args["table_info"]["comp_cols"], [],
+                             key_cols=args["table_info"]["key_cols"],
+                             db_type=db_type)
+        start = time.perf_counter()
+        report.generate_report()
+        report_seconds = time.perf_counter() - start
+    return {'diff_seconds': round(diff_seconds, 4),
+            'report_seconds': round(report_seconds, 4),
+            'diff_row_cnt': report.results['diff_table_row_cnt']}
+
+
+@contextlib.contextmanager
+def connect(db_type: str, pg_dsn: str|None):
+    """ Yields (conn, schema_name) for a scratch database of db_type, or
+        (None, reason) when the engine is not available here
+    """
+    if db_type == 'sqlite':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, 'bench.db'))
+            try:
+                yield conn, 'main'
+            finally:
+                conn.close()
+    elif db_type == 'duckdb':
+        try:
+            import duckdb
+        except ImportError:
+            yield None, 'duckdb is not installed'
+            return
+        conn = duckdb.connect()
+        try:
+            yield conn, 'main'
+        finally:
+            conn.close()
+    else:
+        if not pg_dsn:
+            yield None, 'no --pg-dsn given'
+            return
+        try:
+            import psycopg2
+            conn = psycopg2.connect(pg_dsn)
+        except Exception as e:
+            yield None, str(e)
+            return
+        try:
+            yield conn, 'public'
+        finally:
+            # a failed run leaves its transaction aborted, the tables are dropped after it
+            try:
+                conn.rollback()
+                for table_name in (TABLE_INITIAL, TABLE_SECONDARY, TABLE_DIFF):
+                    conn.cursor().execute(f"DROP TABLE IF EXISTS {table_name}")
+                conn.commit()
+            finally:
+                conn.close()
+
+
+def run_benchmarks(args) -> dict:
+    results = {'environment': {'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'sqlite': sqlite3.sqlite_version},
+               'params': {'cols': args.cols,
+                          'key_arity': args.key_arity,
+                          'change_rate': args.change_rate,
+                          'null_density': args.null_density,
+                          'repeat': args.repeat},
+               'runs': [],
+               'skipped': {}}
+    for db_type in args.engines:
+        with connect(db_type, args.pg_dsn) as (conn, schema_name):
+            if conn is None:
+                results['skipped'][db_type] = schema_name
+                continue
+            for rows in args.rows:
+                start = time.perf_counter()
+                build_tables(conn, db_type, rows, args.cols, args.key_arity,
+                             args.change_rate, args.null_density)
+                load_seconds = time.perf_counter() - start
+                for attempt in range(args.repeat):
+                    run = {'engine': db_type,
+                           'rows': rows,
+                           'attempt': attempt,
+                           'load_seconds': round(load_seconds, 4)}
+                    run.update(time_run(conn, db_type, schema_name, args.cols, args.key_arity))
+                    results['runs'].append(run)
+                    print(f"{db_type} rows={rows} attempt={attempt}: "
+                          f"diff {run['diff_seconds']}s, report {run['report_seconds']}s", file=sys.stderr)
+    return results
+
+
+def main(cli_args=None):
+    args = get_cli_args(cli_args)
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as outbuf:
+            json.dump(results, outbuf, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
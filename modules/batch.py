@@ -0,0 +1,142 @@
+#! usr/bin/env python
+
+""" batch diffs every table pair listed under 'pairs' in one config within a
+    single run. The schema of every table is looked up in one batched catalog
+    query per schema and shared by all pairs, and the pairs are diffed on a
+    bounded pool of connections. The Basic Report counts of all pairs are
+    gathered into one consolidated report.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rich.console import Console
+from rich.table import Table
+
+from modules import db_utils
+from modules import dialects
+from modules.create_diff_table import DiffWriter
+from modules.reporting import BasicReport
+
+
+class BatchRunner:
+    """Diffs and reports on many table pairs with shared connections and metadata
+    """
+
+    def __init__(self, args, connect):
+        self.args = args
+        self.connect = connect
+        self.db_type = self.args["database"]["db_type"]
+        self.pairs = self.args["pairs"]
+        self.workers = self.args["system"].get("workers") or 1
+        self.results = []
+
+    def _get_worker_cnt(self) -> int:
+        if self.workers > 1 and not dialects.get_dialect(self.db_type).concurrent_writers:
+            logging.warning(f"[bold red]{self.db_type} allows a single writer, diffing pairs sequentially[/]")
+            return 1
+        return min(self.workers, len(self.pairs))
+
+    def _get_metadata(self, conn) -> dict:
+        """ Returns the DBFacts metadata of every table of every pair, fetched with
+            one catalog query per schema
+        """
+        db_facts = db_utils.DBFacts(conn,
+                                    cache_dir=self.args["system"].get("metadata_cache_dir"),
+                                    cache_ttl=self.args["system"].get("metadata_cache_ttl") or 0)
+        tables_by_schema = {}
+        for pair in self.pairs:
+            tables = tables_by_schema.setdefault(pair["schema_name"], [])
+            tables.extend([pair["table_initial"], pair["table_secondary"]])
+        for schema_name, table_names in tables_by_schema.items():
+            db_facts.get_table_metadata(schema_name, self.db_type, sorted(set(table_names)))
+        return db_facts.metadata
+
+    def _run_pair(self, pool, metadata: dict, pair: dict) -> dict:
+        conn = pool.get()
+        try:
+            return diff_pair(self.args, conn, pair, metadata)
+        finally:
+            pool.put(conn)
+
+    def run(self) -> list[dict]:
+        worker_cnt = self._get_worker_cnt()
+        pool = db_utils.ConnectionPool(self.connect, worker_cnt)
+        try:
+            conn = pool.get()
+            metadata = self._get_metadata(conn)
+            pool.put(conn)
+            if worker_cnt == 1:
+                # sqlite connections may only be used by the thread that opened them
+                self.results = [self._run_pair(pool, metadata, pair) for pair in self.pairs]
+            else:
+                with ThreadPoolExecutor(max_workers=worker_cnt) as executor:
+                    self.results = list(executor.map(lambda pair: self._run_pair(pool, metadata, pair),
+                                                     self.pairs))
+        finally:
+            pool.close_all()
+        return self.results
+
+    def write_report(self):
+        report_table = Table(title=f"Batch Report ({len(self.results)} table pairs)")
+        report_table.add_column("initial table", style="red", no_wrap=True)
+        report_table.add_column("secondary table", style="red", no_wrap=True)
+        for measure in ("only initial", "only secondary", "modified", "unchanged", "seconds", "status"):
+            report_table.add_column(measure, style="cyan", no_wrap=True)
+        for result in self.results:
+            report_table.add_row(result['table_initial'],
+                                 result['table_secondary'],
+                                 str(result.get('only_initial_row_cnt', '')),
+                                 str(result.get('only_secondary_row_cnt', '')),
+                                 str(result.get('modified_row_cnt', '')),
+                                 str(result.get('unchanged_row_cnt', '')),
+                                 str(result['seconds']),
+                                 result['status'])
+        console = Console()    # rich text output formatting for CLI tables
+        console.print(report_table)
+
+
+def diff_pair(args: dict, conn, pair: dict, metadata: dict|None = None) -> dict:
+    """ Builds the diff table of one table pair (a table_info dict) on conn and
+        returns its Basic Report counts, with the status and duration of the run.
+        Failures are logged and returned rather than raised.
+    """
+    # the pair already has its own connection, so its diff is not partitioned again
+    pair_args = {**args,
+                 "table_info": pair,
+                 "system": {**args["system"], "workers": 1, "diff_target": "initial"}}
+    db_type = args["database"]["db_type"]
+    result = {'table_initial': pair["table_initial"],
+              'table_secondary': pair["table_secondary"],
+              'table_diff': pair["table_diff"]}
+    start = time.perf_counter()
+    try:
+        writer = DiffWriter(pair_args, conn, metadata=metadata)
+        writer.create_diff_table()
+        report = BasicReport(conn,
+                             pair["schema_name"],
+                             pair["table_initial"],
+                             pair["table_secondary"],
+                             pair["table_diff"],
+                             pair["comp_cols"],
+                             pair["ignore_cols"],
+                             key_cols=pair["key_cols"],
+                             initial_table_alias=pair["initial_table_alias"],
+                             secondary_table_alias=pair["secondary_table_alias"],
+                             db_type=db_type,
+                             sample_pct=writer.sample_pct,
+                             sample_predicate=writer.sample_predicate)
+        if writer.cached_results is not None:
+            report.results = writer.cached_results
+        else:
+            report.get_counts()
+            writer.store_results(report.results)
+        result.update(report.results)
+        result['status'] = 'ok'
+    except Exception as e:
+        logging.error(f"[bold red]Diff of {pair['table_initial']} and {pair['table_secondary']} failed:[/] {e}")
+        conn.rollback()
+        result['status'] = f'failed: {e}'
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
@@ -0,0 +1,126 @@
+#! usr/bin/env python
+
+""" checksum_bisect narrows a diff down to the key ranges that actually differ.
+    Rather than joining both tables in full, the key space of the leading key
+    column is split into buckets and an aggregate checksum (row count plus the
+    sum of per-row hashes) is computed for every bucket inside the database.
+    Only buckets whose checksums disagree are split again, until the ranges are
+    narrow enough to be handed back to DiffWriter for a row by row join.
+    Rows with a NULL leading key fall in no bucket, so they get a range of
+    their own, (None, None), which is always diffed in full.
+"""
+
+import logging
+
+
+class ChecksumBisector:
+    """Finds the ranges of the leading key column that contain differences
+    between two tables. Requires an integer leading key column.
+    """
+
+    def __init__(self,
+                 cur,
+                 clauses,
+                 initial_table_ref: str,
+                 secondary_table_ref: str,
+                 fanout: int = 16,
+                 leaf_width: int = 10000):
+
+        self.cur = cur
+        self.clauses = clauses
+        self.initial_table_ref = initial_table_ref
+        self.secondary_table_ref = secondary_table_ref
+        self.fanout = fanout
+        self.leaf_width = leaf_width
+        self.key_col = clauses.key_cols[0]
+
+        if fanout < 2:
+            raise ValueError('bisect fanout must be at least 2')
+        if leaf_width < 1:
+            raise ValueError('bisect leaf width must be at least 1')
+
+    def get_key_bounds(self) -> tuple[int, int]|None:
+        """ Returns the lowest and highest key found in either table, or None
+            if both tables are empty.
+        """
+        lows, highs = [], []
+        for table_ref in (self.initial_table_ref, self.secondary_table_ref):
+            query = f"""SELECT MIN({self.key_col}), MAX({self.key_col}) FROM {table_ref}"""
+            self.cur.execute(query)
+            low, high = self.cur.fetchall()[0]
+            if low is None:
+                continue
+            if not isinstance(low, int) or not isinstance(high, int):
+                raise ValueError(f'leading key column {self.key_col} is not an integer column')
+            lows.append(low)
+            highs.append(high)
+        if not lows:
+            return None
+        return min(lows), max(highs)
+
+    def has_null_keys(self) -> bool:
+        """ Returns True when either table has rows with a NULL leading key
+        """
+        for table_ref in (self.initial_table_ref, self.secondary_table_ref):
+            self.cur.execute(f"SELECT 1 FROM {table_ref} WHERE {self.key_col} IS NULL LIMIT 1")
+            if self.cur.fetchall():
+                return True
+        return False
+
+    def _get_bucket_checksums(self,
+                              table_ref: str,
+                              low: int,
+                              high: int,
+                              step: int) -> dict[int, tuple]:
+        query = f"""
+                SELECT ({self.key_col} - {low}) / {step} AS bucket,
+                       {self.clauses.get_checksum()}
+                FROM {table_ref}
+                WHERE {self.clauses.get_key_range(low, high)}
+                GROUP BY ({self.key_col} - {low}) / {step}
+                """
+        logging.debug(f"[bold red] Checksum Query[/]: {query}")
+        self.cur.execute(query)
+        return {bucket: (row_cnt, row_sum) for bucket, row_cnt, row_sum in self.cur.fetchall()}
+
+    def _split_range(self,
+                     low: int,
+                     high: int) -> list[tuple[int, int]]:
+        """ Returns the sub ranges of [low, high] whose checksums differ
+        """
+        step = -(-(high - low + 1) // self.fanout)
+        initial_sums = self._get_bucket_checksums(self.initial_table_ref, low, high, step)
+        secondary_sums = self._get_bucket_checksums(self.secondary_table_ref, low, high, step)
+
+        sub_ranges = []
+        for bucket in sorted(set(initial_sums) | set(secondary_sums)):
+            if initial_sums.get(bucket) != secondary_sums.get(bucket):
+                sub_low = low + bucket * step
+                sub_ranges.append((sub_low, min(high, sub_low + step - 1)))
+        return sub_ranges
+
+    def find_ranges(self) -> list[tuple[int, int]|tuple[None, None]]:
+        """ Returns the sorted, merged key ranges that need a row level diff,
+            led by (None, None) when there are NULL leading keys to diff
+        """
+        null_ranges = [(None, None)] if self.has_null_keys() else []
+        bounds = self.get_key_bounds()
+        if bounds is None:
+            return null_ranges
+
+        pending = [bounds]
+        leaves = []
+        while pending:
+            low, high = pending.pop()
+            if high - low + 1 <= self.leaf_width:
+                leaves.append((low, high))
+            else:
+                pending.extend(self._split_range(low, high))
+
+        merged = []
+        for low, high in sorted(leaves):
+            if merged and merged[-1][1] + 1 >= low:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+            else:
+                merged.append((low, high))
+        return null_ranges + merged
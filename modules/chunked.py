@@ -0,0 +1,165 @@
+#! usr/bin/env python
+
+""" chunked builds a 'diff_table' in ordered chunks of the key space instead of
+    one CREATE TABLE ... AS SELECT. Each chunk covers at most chunk_size keys of
+    either table, is selected with row-value key comparisons so both sides seek
+    on their key index, and is committed together with a checkpoint in a small
+    progress table. A run that is interrupted (ex.: a dropped connection) picks
+    up after the last committed chunk when it is started again with the same
+    parameters, and no transaction ever spans more than one chunk.
+    Resuming needs the chunks already committed to survive a crash, so a chunked
+    build refuses --fast and its TEMP or UNLOGGED diff table.
+"""
+
+import hashlib
+import json
+import logging
+
+from modules import db_utils
+
+
+class ChunkedBuilder:
+    """Builds the diff table of a DiffWriter chunk by chunk, resuming from its checkpoint
+    """
+
+    def __init__(self, writer, clauses, chunk_size: int):
+        if writer.fast:
+            raise ValueError('a chunked build keeps a durable diff table to resume from, '
+                             '--chunk-size cannot be combined with --fast')
+        self.writer = writer
+        self.clauses = clauses
+        self.chunk_size = chunk_size
+        self.cur = writer.cur
+        self.key_cols = clauses.key_cols
+        self.key_list = ', '.join(self.key_cols)
+        self.progress_table = f"{writer.table_diff}__progress"
+        self.progress_ref = writer._table_ref(self.progress_table)
+        self.marker = db_utils.param_marker(writer.db_type)
+
+    def _get_params_hash(self) -> str:
+        """ Returns a fingerprint of the parameters that shape the diff table, a
+            checkpoint left by a run with other parameters is not resumed
+        """
+        params = '|'.join([self.writer.table_initial,
+                           self.writer.table_secondary,
+                           self.key_list,
+                           ','.join(self.clauses.get_usable_cols()),
+                           str(self.writer.sample_pct or ''),
+                           self.writer.except_keys.get_fingerprint() if self.writer.except_keys else ''])
+        return hashlib.md5(params.encode('UTF-8')).hexdigest()
+
+    def _get_checkpoint(self) -> tuple[int, tuple|None]|None:
+        """ Returns (chunks done, last key done) of an unfinished build with the
+            same parameters, None when the build starts over
+        """
+        db_facts = db_utils.DBFacts(self.writer.conn)
+        for table_name in (self.writer.table_diff, self.progress_table):
+            if not db_facts.get_cols(self.writer.schema_name, self.writer.db_type, table_name):
+                return None
+        self.cur.execute(f"SELECT params_hash, chunk_cnt, last_key, done FROM {self.progress_ref}")
+        results = self.cur.fetchall()
+        if not results or results[0][0] != self._get_params_hash() or not results[0][1] or results[0][3]:
+            return None
+        last_key = results[0][2]
+        return results[0][1], None if last_key is None else tuple(json.loads(last_key))
+
+    def _start(self):
+        """ Creates the empty diff table and a checkpoint before the first chunk
+        """
+        self.cur.execute(self.writer._assemble_drop_query())
+        self.cur.execute(self.writer._assemble_create_query(self.clauses, '1 = 0'))
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.progress_ref}")
+        self.cur.execute(f"""
+                CREATE TABLE {self.progress_ref} (
+                    params_hash VARCHAR(32),
+                    chunk_cnt INT,
+                    last_key TEXT,
+                    done INT)
+                """)
+        self.cur.execute(f"INSERT INTO {self.progress_ref} VALUES ({self.marker}, 0, NULL, 0)",
+                         (self._get_params_hash(),))
+        self.writer.conn.commit()
+
+    def _key_compare(self, operator: str, key: tuple) -> str:
+        """ Returns a row-value comparison of the key columns with key (> or <=),
+            spelled out column by column for backends without row values
+        """
+        values = [db_utils.sql_literal(value) for value in key]
+        if self.writer.dialect.row_values:
+            return f"({self.key_list}) {operator} ({', '.join(values)})"
+        strict = operator[0]
+        terms = []
+        for position, (col, value) in enumerate(zip(self.key_cols, values)):
+            equal = [f"{prev_col} = {prev_value}" for prev_col, prev_value in zip(self.key_cols, values[:position])]
+            terms.append(' AND '.join(equal + [f"{col} {strict} {value}"]))
+        if operator.endswith('='):
+            terms.append(' AND '.join([f"{col} = {value}" for col, value in zip(self.key_cols, values)]))
+        return '(' + ' OR '.join([f"({term})" for term in terms]) + ')'
+
+    def _get_bound(self, last_key: tuple|None) -> tuple|None:
+        """ Returns the highest key of the next chunk: the chunk_size-th key after
+            last_key in whichever table reaches it first, None once neither table
+            has chunk_size keys left
+        """
+        not_null = ' AND '.join([f"{key} IS NOT NULL" for key in self.key_cols])
+        after = '' if last_key is None else f"AND {self._key_compare('>', last_key)}"
+        bounds = []
+        for table_name in (self.writer.table_initial, self.writer.table_secondary):
+            self.cur.execute(f"""
+                    SELECT {self.key_list}
+                    FROM {self.writer._table_ref(table_name)}
+                    WHERE {not_null}
+                        {after}
+                    ORDER BY {self.key_list}
+                    LIMIT 1 OFFSET {self.chunk_size - 1}
+                    """)
+            results = self.cur.fetchall()
+            if results:
+                bounds.append(tuple(results[0]))
+        return min(bounds) if bounds else None
+
+    def _get_chunk_predicate(self, last_key: tuple|None, bound: tuple|None) -> str:
+        predicates = [f"{key} IS NOT NULL" for key in self.key_cols]
+        if last_key is not None:
+            predicates.append(self._key_compare('>', last_key))
+        if bound is not None:
+            predicates.append(self._key_compare('<=', bound))
+        return ' AND '.join(predicates)
+
+    def _write_chunk(self, predicate: str, chunk_cnt: int, last_key: tuple|None, done: bool):
+        """ Inserts the diff rows of one chunk and moves the checkpoint past it,
+            in one transaction
+        """
+        insert_query = self.writer._assemble_insert_query(self.clauses, predicate)
+        logging.debug(f"[bold red] Chunk Query[/]: {insert_query}")
+        self.cur.execute(insert_query)
+        self.cur.execute(f"""
+                UPDATE {self.progress_ref}
+                SET chunk_cnt = {self.marker}, last_key = {self.marker}, done = {self.marker}
+                """, (chunk_cnt, None if last_key is None else json.dumps(last_key, default=str), int(done)))
+        self.writer.conn.commit()
+
+    def build(self):
+        checkpoint = self._get_checkpoint()
+        if checkpoint is None:
+            self._start()
+            # rows with a NULL key never match, and no key range holds them
+            null_keys = ' OR '.join([f"{key} IS NULL" for key in self.key_cols])
+            self._write_chunk(null_keys, 1, None, False)
+            chunk_cnt, last_key = 1, None
+        else:
+            chunk_cnt, last_key = checkpoint
+            print(f'Resuming diff table build after chunk {chunk_cnt}')
+
+        while True:
+            bound = self._get_bound(last_key)
+            chunk_cnt += 1
+            self._write_chunk(self._get_chunk_predicate(last_key, bound), chunk_cnt, bound, bound is None)
+            logging.info(f"[bold red]Diff chunk {chunk_cnt} committed, up to key:[/] {bound}")
+            if bound is None:
+                break
+            last_key = bound
+
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.progress_ref}")
+        self.writer.conn.commit()
+        print('Diff Table Created')
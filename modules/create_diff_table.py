@@ -12,10 +12,23 @@
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint as pp
 
 from modules import db_utils
+from modules import dialects
+from modules import diff_sinks
+from modules.checksum_bisect import ChecksumBisector
+from modules.chunked import ChunkedBuilder
+from modules.exclusions import ExceptKeys
+from modules.incremental import IncrementalUpdater
+from modules.partitions import KeyPartitioner
+from modules.result_cache import ResultCache
 
+# number of compared columns tracked per changed-column bitmask, kept below 64
+# so every mask fits in a signed 64-bit integer
+MASK_WIDTH = 63
+SAMPLE_BUCKETS = 10000
 
 
 class QueryClauses:
@@ -29,7 +42,8 @@ class QueryClauses:
                  compare_cols: list[str],
                  ignore_cols: list[str],
                  initial_table_alias: str,
-                 secondary_table_alias: str):
+                 secondary_table_alias: str,
+                 db_type: str = 'sqlite'):
 
         self.table_cols = table_cols
         self.key_cols = key_cols
@@ -37,27 +51,33 @@ class QueryClauses:
         self.ignore_cols = ignore_cols
         self.initial_table_alias = initial_table_alias
         self.secondary_table_alias = secondary_table_alias
+        self.db_type = db_type
+        self.dialect = dialects.get_dialect(db_type)
 
         if not compare_cols and not ignore_cols:
             raise ValueError('Must have either compare_cols or ignore_cols')
 
-    def get_select(self) -> str:
-        """ Returns select clause
+    def get_usable_cols(self) -> list[str]:
+        """ Returns the sorted non-key columns that are compared between the tables
         """
-        string = ""
-        for key in self.key_cols:
-            string += f"    a.{key} {self.initial_table_alias}_{key}, \n"
-            string += f"    a.{key} {self.secondary_table_alias}_{key}, \n"
-
         if self.compare_cols:
             usable_cols = sorted(list(set(self.compare_cols) - set(self.key_cols)))
         else:
             usable_cols = list(set(self.table_cols) - set(self.ignore_cols))
             usable_cols = sorted(list(set(usable_cols) - set(self.key_cols)))
+        return usable_cols
+
+    def get_select(self) -> str:
+        """ Returns select clause
+        """
+        string = ""
+        for key in self.key_cols:
+            string += f"    a.{key} {self.initial_table_alias}_{key}, \n"
+            string += f"    b.{key} {self.secondary_table_alias}_{key}, \n"
 
-        for col in usable_cols:
+        for col in self.get_usable_cols():
             string += f"    a.{col} {self.initial_table_alias}_{col}, \n"
-            string += f"    a.{col} {self.secondary_table_alias}_{col}, \n"
+            string += f"    b.{col} {self.secondary_table_alias}_{col}, \n"
         string = string.rstrip().rstrip(',')
         return string
 
@@ -65,40 +85,149 @@ class QueryClauses:
         string = ""
         return ' AND '.join([f' a.{x} = b.{x} ' for x in self.key_cols])
 
+    def get_row_hash(self, alias: str|None = None) -> str:
+        """ Returns an expression that hashes the key and compared columns of a row
+            into a signed 64-bit integer. Key columns are part of the hash so that
+            a row moving to a different key within a range still changes its checksum.
+        """
+        return self._get_hash(self.key_cols + self.get_usable_cols(), alias)
+
+    def get_sample(self, sample_pct: float) -> str:
+        """ Returns a predicate keeping a deterministic sample_pct percent of the keys.
+            The sample depends only on the key columns, so both tables keep the
+            same keys and a row that changed between them is sampled on both sides.
+        """
+        threshold = round(sample_pct * SAMPLE_BUCKETS / 100)
+        bucket = f"((({self._get_hash(self.key_cols)}) % {SAMPLE_BUCKETS}) + {SAMPLE_BUCKETS}) % {SAMPLE_BUCKETS}"
+        return f"{bucket} < {threshold}"
+
+    def _get_hash(self, cols: list[str], alias: str|None = None) -> str:
+        if alias:
+            cols = [f"{alias}.{col}" for col in cols]
+        return self.dialect.row_hash(cols)
+
+    def get_checksum(self) -> str:
+        """ Returns the aggregate checksum select list for a range of rows.
+            Only the upper 32 bits of each row hash are summed so that SQLite's
+            integer SUM cannot overflow on very large ranges.
+        """
+        return f"COUNT(*) AS row_cnt, SUM({self.get_row_hash()} >> 32) AS row_sum"
+
+    def get_key_range(self, low: int|None, high: int|None) -> str:
+        """ Returns a predicate restricting the leading key column to [low, high],
+            or to NULL when both are None
+        """
+        if low is None and high is None:
+            return f"{self.key_cols[0]} IS NULL"
+        return f"{self.key_cols[0]} BETWEEN {int(low)} AND {int(high)}"
+
+    def get_distinct(self, left: str, right: str) -> str:
+        """ Returns a null-safe predicate that is true when left and right differ,
+            treating two NULLs as equal and a NULL against a value as a change
+        """
+        return self.dialect.distinct(left, right)
+
+    def get_except(self, alias: str, except_table: str) -> str:
+        """ Returns an anti-join predicate dropping the rows of alias whose key was
+            loaded into the excluded keys table
+        """
+        key_match = ' AND '.join([f"x.{key} = {alias}.{key}" for key in self.key_cols])
+        return f"NOT EXISTS (SELECT 1 FROM {except_table} x WHERE {key_match})"
+
+    def get_changed(self, col: str) -> str:
+        """ Returns a predicate that is true when col differs between the tables
+        """
+        return f"({self.get_distinct(f'a.{col}', f'b.{col}')})"
+
+    def get_any_changed(self) -> str:
+        """ Returns a predicate that is true when any usable column differs
+        """
+        return ' OR '.join([self.get_changed(col) for col in self.get_usable_cols()]) or '1 = 0'
+
+    def get_mask_cols(self) -> list[str]:
+        """ Returns the names of the changed-column bitmask columns. Bit n of mask m
+            is set when the (m * MASK_WIDTH + n)th usable column changed.
+        """
+        mask_cnt = -(-len(self.get_usable_cols()) // MASK_WIDTH)
+        return [f"changed_mask_{mask_num}" for mask_num in range(mask_cnt)]
+
+    def get_change_cols(self) -> str:
+        """ Returns the change_type column (added, removed, modified) followed by
+            the changed-column bitmasks
+        """
+        usable_cols = self.get_usable_cols()
+        key = self.key_cols[0]
+        string = (f"    CASE WHEN a.{key} IS NULL THEN 'added' \n"
+                  f"         WHEN b.{key} IS NULL THEN 'removed' \n"
+                  f"         ELSE 'modified' END change_type")
+        for mask_num, mask_col in enumerate(self.get_mask_cols()):
+            mask_cols = usable_cols[mask_num * MASK_WIDTH:(mask_num + 1) * MASK_WIDTH]
+            bits = ' + '.join([f"CASE WHEN {self.get_changed(col)} THEN {1 << bit} ELSE 0 END"
+                               for bit, col in enumerate(mask_cols)])
+            string += (f", \n    CASE WHEN a.{key} IS NULL OR b.{key} IS NULL THEN 0 "
+                       f"ELSE {bits} END {mask_col}")
+        return string
+
 
 class DiffWriter:
     """Tables controls the actual creation of the __diff_table__ based on
     what type of database the connection is secured with. Unfortunately the
     queries will have to be different depending on each databases unique
     quirks (ex.: sqlite not supporting FULL OUTER JOIN)
+    Only rows that actually differ between the tables are written.
     """
 
-    def __init__(self, args, conn):
+    def __init__(self, args, conn, connect=None, metadata=None):
         self.args = args
         self.conn = conn
+        self.connect = connect
+        self.metadata = metadata or {}    # DBFacts.metadata already fetched, ex.: for a whole batch
         self.tables = ["A", "B"]
         self.db_type = self.args["database"]["db_type"]
         self.table_initial = self.args["table_info"]["table_initial"]
         self.table_secondary = self.args["table_info"]["table_secondary"]
         self.table_diff = self.args["table_info"]["table_diff"]
         self.schema_name = self.args["table_info"]["schema_name"]
-        self.key_cols = self.args["table_info"]["key_columns"]
-        self.compare_cols = self.args["table_info"]["comp_columns"]
-        self.ignore_cols = self.args["table_info"]["ignore_columns"]
+        self.key_cols = self.args["table_info"]["key_cols"]
+        self.compare_cols = self.args["table_info"]["comp_cols"] or []
+        self.ignore_cols = self.args["table_info"]["ignore_cols"] or []
         self.initial_table_alias = self.args["table_info"]["initial_table_alias"]
         self.secondary_table_alias = self.args["table_info"]["secondary_table_alias"]
+        self.workers = self.args["system"].get("workers") or 1
+        self.fast = self.args["system"].get("fast")
+        self.sample_pct = self.args["system"].get("sample")
+        self.sample_predicate = None
+        self.except_keys = ExceptKeys(self.db_type,
+                                      self.key_cols,
+                                      except_rows=self.args["table_info"].get("except_rows"),
+                                      except_file=self.args["table_info"].get("except_file"),
+                                      except_query=self.args["table_info"].get("except_query"))
+        self.except_predicate = None
+        self.result_cache = None
+        self.temp_indexes = []
+        self.cached_results = None    # the stored report of a reused diff table
 
+        self.dialect = dialects.get_dialect(self.db_type)
+        self.dialect.prepare(conn)
         self.cur = conn.cursor()
+        self.except_keys.table_name = self.dialect.scratch_table('except_keys', self.table_diff)
+        self.narrow_keys_table = self.dialect.scratch_table('narrow_keys', self.table_diff)
 
 
     def _get_clauses(self):
-        db_facts = db_utils.DBFacts(self.conn)
-        initial_table_cols = get_cols(self.db_type,
-                                         self.schema_name,
-                                         self.table_initial)
-        secondary_table_cols = get_cols(self.db_type,
-                                         self.schema_name,
-                                         self.table_secondary)
+        self.db_facts = db_utils.DBFacts(self.conn,
+                                         cache_dir=self.args["system"].get("metadata_cache_dir"),
+                                         cache_ttl=self.args["system"].get("metadata_cache_ttl") or 0)
+        self.db_facts.metadata.update(self.metadata)
+        self.db_facts.get_table_metadata(self.schema_name,
+                                         self.db_type,
+                                         [self.table_initial, self.table_secondary])
+        initial_table_cols = self.db_facts.get_cols(self.schema_name,
+                                                    self.db_type,
+                                                    self.table_initial)
+        secondary_table_cols = self.db_facts.get_cols(self.schema_name,
+                                                      self.db_type,
+                                                      self.table_secondary)
         common_table_cols = db_utils.get_common_cols(initial_table_cols, secondary_table_cols)
 
         clauses = QueryClauses(
@@ -107,81 +236,549 @@ class DiffWriter:
                 compare_cols = self.compare_cols,
                 ignore_cols = self.ignore_cols,
                 initial_table_alias = self.initial_table_alias,
-                secondary_table_alias = self.secondary_table_alias)
+                secondary_table_alias = self.secondary_table_alias,
+                db_type = self.db_type)
         return clauses
 
-    def _assemble_create_query_psql(self):
-        select_clause = clauses.get_select()
+    def _table_ref(self, table_name):
+        return db_utils.table_ref(self.db_type, self.schema_name, table_name)
+
+    def _source(self, table_name, predicate=None):
+        """ Returns the FROM item for one of the compared tables, optionally
+            restricted to the rows matching predicate.
+        """
+        predicates = [pred for pred in (self.sample_predicate, self.except_predicate, predicate)
+                      if pred is not None]
+        if not predicates:
+            return self._table_ref(table_name)
+        return f"(SELECT * FROM {self._table_ref(table_name)} src WHERE {' AND '.join([f'({pred})' for pred in predicates])})"
+
+    def _assemble_select_query_full_join(self, clauses, predicate=None):
+        select_clause = clauses.get_select() + ', \n' + clauses.get_change_cols()
         join_clause = clauses.get_join()
-        create_query = f"""
-                CREATE TABLE {self.schema_name}.{self.table_diff} AS
-                SELECT {select_clauses}
-                FROM {self.schema_name}.{self.table_initial} A
-                    FULL OUTER JOIN {self.schema_name}.{self.table_secondary} B
+        select_query = f"""
+                SELECT
+                {select_clause}
+                FROM {self._source(self.table_initial, predicate)} a
+                    FULL OUTER JOIN {self._source(self.table_secondary, predicate)} b
                     ON {join_clause}
+                WHERE a.{self.key_cols[0]} IS NULL
+                    OR b.{self.key_cols[0]} IS NULL
+                    OR {clauses.get_any_changed()}
                 """
-        return create_query
+        return select_query
 
     def _assemble_drop_query(self):
-        if self.db_type == 'postgres' or 'mysql':
-            table_reference = f"{self.schema_name}.{self.table_diff}"
-        else:
-            table_reference = f"{self.table_diff}"
         drop_query = (
-            f"""DROP TABLE IF EXISTS {table_reference}""")
+            f"""DROP TABLE IF EXISTS {self._table_ref(self.table_diff)}""")
         return drop_query
 
-    def _assemble_create_query_sqlite(self, clauses):
-        select_clause = clauses.get_select()
+    def _assemble_select_query_anti_join(self, clauses, predicate=None):
+        """ Returns the changed matches of an inner join plus the keys missing from
+            either side as two anti-joins, for backends without a fast FULL OUTER JOIN
+        """
+        select_clause = clauses.get_select() + ', \n' + clauses.get_change_cols()
         join_clause = clauses.get_join()
-        except_clause = clauses.get_except()
-        create_query = f"""
-                CREATE TABLE IF NOT EXISTS {self.table_diff} AS
+        initial_source = self._source(self.table_initial, predicate)
+        secondary_source = self._source(self.table_secondary, predicate)
+        select_query = f"""
                     SELECT
                     {select_clause}
-                    FROM {self.table_initial} A
-                        INNER JOIN {self.table_secondary} B
+                    FROM {initial_source} a
+                        INNER JOIN {secondary_source} b
                             ON {join_clause}
-                        {except_clause}
+                        WHERE {clauses.get_any_changed()}
 
                     UNION ALL
                     SELECT
                     {select_clause}
-                    FROM {self.table_secondary} B
-                        LEFT OUTER JOIN {self.table_initial} A
+                    FROM {secondary_source} b
+                        LEFT OUTER JOIN {initial_source} a
+                            ON {join_clause}
+                        WHERE a.{self.key_cols[0]} IS NULL
+
+                    UNION ALL
+                    SELECT
+                    {select_clause}
+                    FROM {initial_source} a
+                        LEFT OUTER JOIN {secondary_source} b
+                            ON {join_clause}
+                        WHERE b.{self.key_cols[0]} IS NULL
+                    """
+        return select_query
+
+    def _assemble_select_query_left_join(self, clauses, predicate=None):
+        """ Returns the rows of a LEFT JOIN that are missing from or changed in the
+            secondary table, plus an anti-join for the keys only in the secondary
+            table. Every initial row is probed into the secondary key index once,
+            and every secondary row into the initial key index once.
+        """
+        select_clause = clauses.get_select() + ', \n' + clauses.get_change_cols()
+        join_clause = clauses.get_join()
+        initial_source = self._source(self.table_initial, predicate)
+        secondary_source = self._source(self.table_secondary, predicate)
+        select_query = f"""
+                    SELECT
+                    {select_clause}
+                    FROM {initial_source} a
+                        LEFT OUTER JOIN {secondary_source} b
                             ON {join_clause}
-                        WHERE A.{self.args['table_info']['key_columns'][0]} IS NULL
+                        WHERE b.{self.key_cols[0]} IS NULL
+                            OR {clauses.get_any_changed()}
 
                     UNION ALL
                     SELECT
                     {select_clause}
-                    FROM {self.table_secondary} B
-                        INNER JOIN {self.table_initial} A
+                    FROM {secondary_source} b
+                        LEFT OUTER JOIN {initial_source} a
                             ON {join_clause}
-                        WHERE A.{self.args['table_info']['key_columns'][0]} IS NULL
+                        WHERE a.{self.key_cols[0]} IS NULL
                     """
-        return create_query
+        return select_query
+
+    def _assemble_select_query(self, clauses, predicate=None):
+        if self.dialect.full_outer_join:
+            return self._assemble_select_query_full_join(clauses, predicate)
+        if self.dialect.left_join_union:
+            return self._assemble_select_query_left_join(clauses, predicate)
+        return self._assemble_select_query_anti_join(clauses, predicate)
+
+    def _assemble_create_query(self, clauses, predicate=None):
+        """ In fast mode the diff table skips durability: it is UNLOGGED on
+            Postgres (no WAL) and a TEMP table on SQLite.
+        """
+        select_query = self._assemble_select_query(clauses, predicate)
+        create_table = self.dialect.create_table(self.fast)
+        return f"{create_table} {self._table_ref(self.table_diff)} AS {select_query}"
+
+    def _promote_diff_table(self):
+        """ Turns a fast mode diff table into a regular, durable table
+        """
+        for promote_query in self.dialect.promote_queries(self._table_ref(self.table_diff), self.table_diff):
+            self.cur.execute(promote_query)
+        self.conn.commit()
+        logging.info(f"[bold red]Diff table promoted to a durable table:[/] {self.table_diff}")
+
+    def _assemble_insert_query(self, clauses, predicate=None):
+        select_query = self._assemble_select_query(clauses, predicate)
+        return f"INSERT INTO {self._table_ref(self.table_diff)} {select_query}"
+
+    def _get_bisect_ranges(self, clauses):
+        """ Returns the key ranges whose checksums differ, or None when the
+            tables cannot be bisected and a full build is required.
+        """
+        bisector = ChecksumBisector(self.cur,
+                                    clauses,
+                                    self._table_ref(self.table_initial),
+                                    self._table_ref(self.table_secondary),
+                                    fanout=self.args["system"]["bisect_fanout"],
+                                    leaf_width=self.args["system"]["bisect_leaf_width"])
+        try:
+            return bisector.find_ranges()
+        except ValueError as e:
+            logging.warning(f"[bold red]Bisect unavailable, falling back to full build:[/] {e}")
+            return None
+
+    def _get_partition_predicates(self):
+        partitioner = KeyPartitioner(self.cur,
+                                     self.db_type,
+                                     self.schema_name,
+                                     self.table_initial,
+                                     self.key_cols[0])
+        return partitioner.get_predicates(partitioner.get_bounds(self.workers))
+
+    def _can_run_parallel(self) -> bool:
+        if self.workers < 2:
+            return False
+        if not self.dialect.concurrent_writers:
+            logging.warning(f"[bold red]{self.db_type} allows a single writer, building partitions sequentially[/]")
+            return False
+        if self.connect is None:
+            logging.warning("[bold red]No connection factory given, building partitions sequentially[/]")
+            return False
+        return True
+
+    def _connect_worker(self):
+        """ Opens a worker connection, with its own copy of the excluded keys
+            since temp tables are only visible to the connection that made them
+        """
+        conn = self.connect()
+        if self.except_predicate is not None and self.dialect.local_temp_tables:
+            self.except_keys.load(conn.cursor(), self.dialect, self._table_ref(self.table_initial))
+            conn.commit()
+        return conn
+
+    def _run_inserts_parallel(self, insert_queries):
+        """ Runs each insert on its own pooled connection, at most workers at a time
+        """
+        pool = db_utils.ConnectionPool(self._connect_worker, self.workers)
+
+        def run_insert(insert_query):
+            conn = pool.get()
+            try:
+                conn.cursor().execute(insert_query)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                pool.put(conn)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(run_insert, insert_queries))
+        finally:
+            pool.close_all()
+
+    def _copy_diff_to_file(self, clauses, output_file) -> bool:
+        """ Lets the database (DuckDB) write the diff rows straight to a Parquet,
+            NDJSON or CSV file instead of materializing a diff table. Returns False
+            when it cannot, for the rows to be streamed through the client instead.
+        """
+        copy_query = self.dialect.copy_query(self._assemble_select_query(clauses),
+                                             output_file,
+                                             diff_sinks.get_file_format(output_file))
+        if copy_query is None:
+            return False
+        logging.debug(f"[bold red] Diff Query[/]: {copy_query}")
+        self.cur.execute(copy_query)
+        print(f'Diff File Created: {output_file}')
+        return True
+
+    def _stream_diff_to_file(self, clauses, output_file):
+        """ Streams the diff rows into a file sink through a server-side cursor,
+            batch_size rows at a time, so nothing is written to the database and
+            memory stays flat however large the diff is
+        """
+        batch_size = self.args["system"].get("batch_size") or 10000
+        sink = None
+        try:
+            narrow_predicate = self._get_narrow_predicate(clauses)
+            predicates = self._get_bisect_predicates(clauses)
+            if predicates is None:
+                predicates = [narrow_predicate]
+            elif not predicates:
+                predicates = ['1 = 0']    # still writes the header/schema of an empty diff
+            elif narrow_predicate is not None:
+                predicates = [f"({predicate}) AND ({narrow_predicate})" for predicate in predicates]
+            for predicate in predicates:
+                select_query = self._assemble_select_query(clauses, predicate)
+                logging.debug(f"[bold red] Diff Query[/]: {select_query}")
+                cur = db_utils.get_stream_cursor(self.conn, self.db_type, 'td_diff_stream', batch_size)
+                cur.execute(select_query)
+                rows = cur.fetchmany(batch_size)
+                if sink is None:
+                    # named cursors only describe their columns once rows were fetched
+                    sink = diff_sinks.get_file_sink(output_file,
+                                                    [col[0] for col in cur.description],
+                                                    batch_size)
+                    sink.open()
+                while rows:
+                    sink.write_rows(rows)
+                    rows = cur.fetchmany(batch_size)
+                cur.close()
+        finally:
+            if sink is not None:
+                sink.close()
+            self.conn.commit()
+            self._drop_narrow_keys()
+        print(f'Diff File Created: {output_file}')
+
+    def _has_key_index(self, table_name) -> bool:
+        """ Returns True when the primary key or an index of table_name starts with
+            the key columns, in any order, so the join can seek on it. A temporary
+            key index left behind by a killed run does not count, it is rebuilt and
+            dropped like any other.
+        """
+        metadata = self.db_facts.get_table_metadata(self.schema_name, self.db_type, [table_name])[table_name]
+        key_set = set(self.key_cols)
+        candidates = [metadata['primary_key']] + [index['columns'] for index in metadata['indexes']
+                                                  if not index['name'].startswith('td_tmp_')]
+        return any(set(cols[:len(self.key_cols)]) == key_set for cols in candidates)
+
+    def _create_key_indexes(self, clauses):
+        """ Creates a covering index on the key and compared columns of every SQLite
+            table that has no index on its key columns, so the joins do not fall back
+            to nested-loop scans. Each index is recorded in temp_indexes as soon as it
+            exists, to be dropped afterwards even when the run fails halfway.
+        """
+        index_cols = ', '.join(self.key_cols + clauses.get_usable_cols())
+        for table_name in dict.fromkeys([self.table_initial, self.table_secondary]):
+            if self._has_key_index(table_name):
+                continue
+            # SQLite keeps an index in the schema of its table, a TEMP index can only
+            # be put on a temp table, which the unqualified name gets on its own
+            index_name = self._table_ref('td_tmp_' + ''.join([char if char.isalnum() else '_'
+                                                               for char in table_name]) + '_key')
+            try:
+                self.cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({index_cols})")
+            except self.dialect.operational_error() as e:
+                logging.warning(f"[bold red]Could not index {table_name}, joining without an index:[/] {e}")
+                continue
+            logging.info(f"[bold red]Created temporary key index:[/] {index_name}")
+            self.temp_indexes.append(index_name)
+
+    def _check_key_indexes(self):
+        """ Warns about compared tables without an index on their key columns, whose
+            joins fall back to scans. Unlike SQLite's, server tables are not indexed
+            on the fly since they may be live (ex.: replicas).
+        """
+        for table_name in dict.fromkeys([self.table_initial, self.table_secondary]):
+            if not self._has_key_index(table_name):
+                logging.warning(f"[bold red]{table_name} has no index on {', '.join(self.key_cols)}:[/] "
+                                "every branch of the diff query will scan it")
+
+    def _drop_key_indexes(self):
+        while self.temp_indexes:
+            self.cur.execute(f"DROP INDEX IF EXISTS {self.temp_indexes.pop()}")
+        self.conn.commit()
+
+    def get_queries(self) -> dict[str, str]:
+        """ Returns the query that selects the diff rows, as create_diff_table would run it
+        """
+        clauses = self._get_clauses()
+        if self.sample_pct:
+            self.sample_predicate = clauses.get_sample(self.sample_pct)
+        # the plans should show the anti-join, so the excluded keys are loaded too
+        self._load_except_keys(clauses)
+        return {'diff': self._assemble_select_query(clauses)}
+
+    def get_check_queries(self, clauses, example_cnt: int = 1) -> dict[str, str]:
+        """ Returns one probe per kind of difference, each selecting the keys of
+            at most example_cnt differing rows. The database can stop a probe at
+            the first rows found instead of joining the whole tables.
+        """
+        initial_keys = ', '.join([f"a.{key}" for key in self.key_cols])
+        secondary_keys = ', '.join([f"b.{key}" for key in self.key_cols])
+        initial_source = self._source(self.table_initial)
+        secondary_source = self._source(self.table_secondary)
+        return {
+            'only_initial': f"""
+                SELECT {initial_keys} FROM {initial_source} a
+                WHERE NOT EXISTS (SELECT 1 FROM {secondary_source} b WHERE {clauses.get_join()})
+                LIMIT {int(example_cnt)}""",
+            'only_secondary': f"""
+                SELECT {secondary_keys} FROM {secondary_source} b
+                WHERE NOT EXISTS (SELECT 1 FROM {initial_source} a WHERE {clauses.get_join()})
+                LIMIT {int(example_cnt)}""",
+            'modified': f"""
+                SELECT {initial_keys} FROM {initial_source} a
+                    INNER JOIN {secondary_source} b
+                    ON {clauses.get_join()}
+                WHERE {clauses.get_any_changed()}
+                LIMIT {int(example_cnt)}"""}
+
+    def check(self, example_cnt: int = 1) -> tuple[str, list[tuple]]|None:
+        """ Probes the tables for any difference without building the diff table.
+            Returns the kind of the first difference found with the keys of up to
+            example_cnt such rows, or None when the tables are identical.
+        """
+        clauses = self._get_clauses()
+        if self.sample_pct:
+            self.sample_predicate = clauses.get_sample(self.sample_pct)
+        try:
+            self._load_except_keys(clauses)
+            for kind, query in self.get_check_queries(clauses, example_cnt).items():
+                logging.debug(f"[bold red] Check Query[/]: {query}")
+                self.cur.execute(query)
+                keys = [tuple(row) for row in self.cur.fetchall()]
+                if keys:
+                    return kind, keys
+            return None
+        finally:
+            self.drop_except_keys()
+
+    def _load_except_keys(self, clauses):
+        if self.except_keys:
+            self.except_keys.load(self.cur, self.dialect, self._table_ref(self.table_initial))
+            self.conn.commit()
+            self.except_predicate = clauses.get_except('src', self.except_keys.table_name)
+
+    def drop_except_keys(self):
+        if self.except_predicate is not None:
+            self.except_keys.drop(self.cur)
+            self.conn.commit()
 
     def create_diff_table(self):
 
         clauses = self._get_clauses()
+        if self._use_cached_diff(clauses):
+            print('Diff Table Reused')
+            return
+        try:
+            if self.dialect.temp_key_indexes:
+                self._create_key_indexes(clauses)
+            if self.dialect.left_join_union:
+                self._check_key_indexes()
+            self._load_except_keys(clauses)
+            self._drop_stale_state(clauses)
+            self._write_diff(clauses)
+        finally:
+            self._drop_key_indexes()
+            self.drop_except_keys()
 
-        if self.db_type == 'sqlite':
-            create_query = self._assemble_create_query_sqlite(clauses)
-            drop_query = self._assemble_drop_query()
+    def _use_cached_diff(self, clauses) -> bool:
+        """ Returns True when the diff table of the last run can be reused as is
+        """
+        if not self.args["system"].get("cache"):
+            return False
+        if self.fast:
+            raise ValueError('a cached diff table has to outlive the session, '
+                             '--cache cannot be combined with --fast')
+        if self.args["system"].get("diff_target") == 'file':
+            logging.warning("[bold red]--cache only applies to diff tables, writing the file in full[/]")
+            return False
+        self.result_cache = ResultCache(self, clauses)
+        self.cached_results = self.result_cache.lookup()
+        if self.cached_results is None:
+            self.result_cache.invalidate()
+            return False
+        return True
+
+    def _drop_stale_state(self, clauses):
+        """ Drops what earlier runs stored about the diff table that no longer holds
+            once this run rewrites it: the report cached by --cache, unless this run
+            caches its own, and the state of --incremental, unless this run patches it
+        """
+        if self.args["system"].get("diff_target") == 'file':
+            return
+        if self.result_cache is None:
+            ResultCache(self, clauses).invalidate()
+        if not self.args["system"].get("incremental") or self.sample_pct:
+            IncrementalUpdater(self, clauses).invalidate()
+
+    def store_results(self, results: dict):
+        """ Caches the report of the diff table just built, see --cache
+        """
+        if self.result_cache is not None and self.cached_results is None:
+            self.result_cache.store(results)
+
+    def _write_diff(self, clauses):
+        if self.sample_pct:
+            self.sample_predicate = clauses.get_sample(self.sample_pct)
+            logging.info(f"[bold red]Diffing a {self.sample_pct}% sample of keys:[/] {self.sample_predicate}")
+            if self.args["system"].get("incremental"):
+                logging.warning("[bold red]A sampled diff is not kept incrementally, building it in full[/]")
+
+        if self.args["system"].get("diff_target") == 'file':
+            output_file = self.args["system"].get("output_file")
+            if not output_file:
+                raise ValueError('diff_target of file requires an output_file')
+            if not self._copy_diff_to_file(clauses, output_file):
+                self._stream_diff_to_file(clauses, output_file)
+        elif self.args["system"].get("incremental") and not self.sample_pct:
+            updater = IncrementalUpdater(self, clauses, self.args["system"].get("watermark_col"))
+            updater.update()
+        elif self.args["system"].get("chunk_size"):
+            if any(self.args["system"].get(option) for option in ('bisect', 'narrow')) or self.workers > 1:
+                logging.warning("[bold red]A chunked build runs its chunks one after the other, "
+                                "ignoring --bisect, --narrow and --workers[/]")
+            builder = ChunkedBuilder(self, clauses, self.args["system"]["chunk_size"])
+            builder.build()
         else:
-            create_query = self._assemble_create_query(clauses)
-            drop_query = self._assemble_drop_query()
+            self._build_diff_table(clauses)
 
-        logging.debug(f"[bold red] Diff Query[/]: {create_query}")
+    def _get_bisect_predicates(self, clauses):
+        """ Returns one predicate per key range left to diff after bisection, or
+            None when bisection is off or unavailable
+        """
+        if not self.args["system"].get("bisect"):
+            return None
+        ranges = self._get_bisect_ranges(clauses)
+        if ranges is None:
+            return None
+        logging.info(f"[bold red]Bisect ranges to diff:[/] {len(ranges)}")
+        return [clauses.get_key_range(low, high) for low, high in ranges]
 
+    def _get_narrow_predicate(self, clauses) -> str|None:
+        """ In narrow mode, compares the tables on their keys plus one hash of the
+            compared columns and keeps the keys whose (key, hash) pair has no match
+            on the other side in a temp table. Returns the predicate restricting the
+            full-width diff to those keys, or None outside of narrow mode.
+        """
+        if not self.args["system"].get("narrow"):
+            return None
+        key_list = ', '.join(self.key_cols)
+        row_hash = clauses.get_row_hash()
+        initial_hashes = f"SELECT {key_list}, {row_hash} AS row_hash FROM {self._source(self.table_initial)}"
+        secondary_hashes = f"SELECT {key_list}, {row_hash} AS row_hash FROM {self._source(self.table_secondary)}"
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.narrow_keys_table}")
+        narrow_query = f"""
+                {self.dialect.create_temp_table} {self.narrow_keys_table} AS
+                SELECT {key_list} FROM ({initial_hashes} EXCEPT {secondary_hashes}) changed_initial
+                UNION
+                SELECT {key_list} FROM ({secondary_hashes} EXCEPT {initial_hashes}) changed_secondary
+                """
+        logging.debug(f"[bold red] Narrow Query[/]: {narrow_query}")
+        self.cur.execute(narrow_query)
+        self.cur.execute(f"SELECT COUNT(*) FROM {self.narrow_keys_table}")
+        logging.info(f"[bold red]Keys with differing row hashes:[/] {self.cur.fetchall()[0][0]}")
+        # NULL keys never match in the join, so they are always diffed in full
+        null_keys = ' OR '.join([f"{key} IS NULL" for key in self.key_cols])
+        return f"({key_list}) IN (SELECT {key_list} FROM {self.narrow_keys_table}) OR {null_keys}"
+
+    def _drop_narrow_keys(self):
+        if self.args["system"].get("narrow"):
+            self.cur.execute(f"DROP TABLE IF EXISTS {self.narrow_keys_table}")
+            self.conn.commit()
+
+    def _drop_partial_diff_table(self):
+        try:
+            self.cur.execute(self._assemble_drop_query())
+            self.conn.commit()
+        except Exception as e:
+            # the error of the build is the one raised
+            self.conn.rollback()
+            logging.warning(f"[bold red]Could not drop the partial diff table {self.table_diff}:[/] {e}")
+
+    def _build_diff_table(self, clauses):
+        """ Builds the diff table in one CREATE TABLE ... AS SELECT, or as an empty
+            table filled by one insert per bisect range or partition. A failed build
+            leaves no diff table behind: parallel inserts commit on their own
+            connections, and DDL commits implicitly on MySQL, so rolling back alone
+            could keep the ranges already inserted.
+        """
+        narrow_predicate = None
+        created = False
         try:
+            narrow_predicate = self._get_narrow_predicate(clauses)
+            predicates = self._get_bisect_predicates(clauses)
+            if predicates is None and self.workers > 1 and narrow_predicate is None:
+                predicates = self._get_partition_predicates()
+            if predicates is not None and narrow_predicate is not None:
+                predicates = [f"({predicate}) AND ({narrow_predicate})" for predicate in predicates]
+
+            drop_query = self._assemble_drop_query()
+            if predicates is None:
+                create_query = self._assemble_create_query(clauses, narrow_predicate)
+                insert_queries = []
+            else:
+                create_query = self._assemble_create_query(clauses, '1 = 0')
+                insert_queries = [self._assemble_insert_query(clauses, predicate)
+                                  for predicate in predicates]
+
+            for query in [create_query] + insert_queries:
+                logging.debug(f"[bold red] Diff Query[/]: {query}")
+
             self.cur.execute(drop_query)
             self.cur.execute(create_query)
-        except OperationalError as e:
-            logging.critical(f"[bold red blink]OPERATIONAL ERROR: [/] {e}")
-        except NoSuchTableError as e:
-            logging.critical(f"[bold red blink]No Table Error:[/] {e}")
-        finally:
+            created = True
+            # the narrow keys are in a temp table only this connection can see
+            if insert_queries and narrow_predicate is None and self._can_run_parallel():
+                self.conn.commit()
+                self._run_inserts_parallel(insert_queries)
+            else:
+                for insert_query in insert_queries:
+                    self.cur.execute(insert_query)
             self.conn.commit()
-            print('Diff Table Created')
+        except Exception:
+            self.conn.rollback()
+            if created:
+                self._drop_partial_diff_table()
+            raise
+        finally:
+            self._drop_narrow_keys()
+        print('Diff Table Created')
+
+        if self.fast and self.args["system"].get("fast_promote"):
+            self._promote_diff_table()
@@ -0,0 +1,341 @@
+#! usr/bin/env python
+
+""" daemon keeps Table Differ resident so that frequent diffs (ex.: CI gates) do
+    not pay for process startup, imports and connection handshakes on every check.
+    Diff jobs are posted as json over localhost HTTP or a Unix socket, queued, and
+    run by a fixed number of workers that each keep a warm connection. Table
+    metadata is cached between jobs for as long as the schema fingerprint of the
+    tables does not change. Every job returns its Basic Report counts as json.
+    The daemon only listens on loopback addresses and Unix sockets, and job fields
+    that end up in SQL must be plain identifiers. Jobs writing the same diff table
+    run one after the other, and finished jobs are forgotten after JOB_TTL seconds
+    or once more than MAX_FINISHED_JOBS are kept.
+
+    POST /jobs           {"table_initial": ..., "table_secondary": ..., "key_cols": [...], ...}
+                         queues a job, add ?wait=1 to get its result in the response
+    GET  /jobs/<job_id>  status and result of a job
+    GET  /health         number of workers and queued jobs
+"""
+
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from modules import db_utils
+from modules import dialects
+from modules.batch import diff_pair
+
+# job settings that may be set per job, with their types, everything else comes
+# from the daemon's config
+JOB_SYSTEM_TYPES = {'sample': (int, float),
+                    'bisect': bool,
+                    'bisect_fanout': int,
+                    'bisect_leaf_width': int,
+                    'fast': bool,
+                    'cache': bool}
+JOB_SYSTEM_KEYS = tuple(JOB_SYSTEM_TYPES)
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_$]*')
+JOB_TTL = 3600
+MAX_FINISHED_JOBS = 1000
+
+
+def get_job_view(record: dict) -> dict:
+    """ Returns the fields of a job record that are sent to clients
+    """
+    return {key: value for key, value in record.items() if key not in ('done', 'system', 'finished_at')}
+
+
+def validate_job(job: dict):
+    """ Raises ValueError unless every job field that is put into SQL is a plain
+        identifier (or, for the tables, a file path with no quotes) and every
+        setting has the expected type
+    """
+    for field in ("table_initial", "table_secondary"):
+        if not isinstance(job.get(field), str) or not job[field]:
+            raise ValueError(f'job is missing {field}')
+        if not IDENTIFIER.fullmatch(job[field]) and \
+                (not db_utils.is_file_source(job[field]) or "'" in job[field]):
+            raise ValueError(f'{field} is not a table name: {job[field]}')
+    for field in ("diff_table", "schema_name"):
+        if job.get(field) is not None and not (isinstance(job[field], str) and IDENTIFIER.fullmatch(job[field])):
+            raise ValueError(f'{field} is not an identifier: {job[field]}')
+    for field in ("key_cols", "compare_cols", "ignore_cols"):
+        cols = job.get(field)
+        if cols is None:
+            continue
+        if not isinstance(cols, list) or not all(isinstance(col, str) and IDENTIFIER.fullmatch(col) for col in cols):
+            raise ValueError(f'{field} must be a list of column names')
+    for key, value_type in JOB_SYSTEM_TYPES.items():
+        if key in job and job[key] is not None and \
+                (not isinstance(job[key], value_type) or (isinstance(job[key], bool) and value_type is not bool)):
+            raise ValueError(f'{key} has the wrong type: {job[key]!r}')
+    if job.get('sample') is not None and not 0 < job['sample'] <= 100:
+        raise ValueError(f"sample must be a percentage above 0 and at most 100, got {job['sample']}")
+
+
+class DiffService:
+    """Runs queued diff jobs on workers holding warm connections
+    """
+
+    def __init__(self, args, connect, max_jobs: int = 1):
+        self.args = args
+        self.connect = connect
+        self.db_type = self.args["database"]["db_type"]
+        if max_jobs > 1 and not dialects.get_dialect(self.db_type).concurrent_writers:
+            logging.warning(f"[bold red]{self.db_type} allows a single writer, running one job at a time[/]")
+            max_jobs = 1
+        self.max_jobs = max_jobs
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # jobs writing the same diff table (and its scratch tables) must not interleave,
+        # (schema_name, table_diff) -> [lock, number of jobs holding or waiting for it]
+        self.diff_table_locks = {}
+        self.metadata = {}    # (schema_name, table_name) -> (fingerprint, DBFacts metadata)
+        self.workers = []
+
+    def start(self):
+        for num in range(self.max_jobs):
+            worker = threading.Thread(target=self._work, name=f'td-worker-{num}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _get_table_info(self, job: dict) -> dict:
+        """ Returns the table_info of a job, defaults taken from the daemon's config
+        """
+        defaults = self.args["table_info"]
+        table_secondary = job["table_secondary"]
+        table_diff = job.get("diff_table") or \
+            re.sub(r'\W', '_', os.path.basename(table_secondary.rstrip('/')).split('.')[0]) + '__diff__'
+        return {
+            "table_initial": job["table_initial"],
+            "table_secondary": table_secondary,
+            "table_diff": table_diff,
+            "schema_name": job.get("schema_name") or defaults["schema_name"],
+            "key_cols": job.get("key_cols") or defaults["key_cols"],
+            "comp_cols": job.get("compare_cols") or defaults["comp_cols"],
+            "ignore_cols": job.get("ignore_cols") or defaults["ignore_cols"],
+            "initial_table_alias": defaults["initial_table_alias"],
+            "secondary_table_alias": defaults["secondary_table_alias"],
+            "except_rows": None}
+
+    def submit(self, job: dict) -> dict:
+        """ Validates and queues a job, returning its record
+        """
+        validate_job(job)
+        record = {'job_id': str(next(self.job_ids)),
+                  'status': 'queued',
+                  'table_info': self._get_table_info(job),
+                  'system': {key: job[key] for key in JOB_SYSTEM_KEYS if key in job},
+                  'result': None,
+                  'finished_at': None,
+                  'done': threading.Event()}
+        with self.lock:
+            self._evict_jobs()
+            self.jobs[record['job_id']] = record
+        self.queue.put(record)
+        return record
+
+    def _evict_jobs(self):
+        """ Forgets finished jobs older than JOB_TTL, and the oldest finished jobs
+            beyond MAX_FINISHED_JOBS. Called with the lock held.
+        """
+        now = time.monotonic()
+        finished = [job_id for job_id, record in self.jobs.items() if record['finished_at'] is not None]
+        for job_id in finished:
+            if now - self.jobs[job_id]['finished_at'] > JOB_TTL:
+                del self.jobs[job_id]
+        finished = [job_id for job_id in finished if job_id in self.jobs]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id: str) -> dict|None:
+        with self.lock:
+            record = self.jobs.get(job_id)
+        if record is None:
+            return None
+        return get_job_view(record)
+
+    def _get_metadata(self, conn, table_info: dict) -> dict:
+        """ Returns the cached metadata of the job's tables when their schema
+            fingerprint did not change since it was cached, refreshing it otherwise
+        """
+        schema_name = table_info["schema_name"]
+        table_names = [table_info["table_initial"], table_info["table_secondary"]]
+        db_facts = db_utils.DBFacts(conn)
+        _, fingerprint = db_facts.get_schema_fingerprint(schema_name, self.db_type, table_names)
+        with self.lock:
+            cached = {(schema_name, table): self.metadata.get((schema_name, table)) for table in table_names}
+        if fingerprint and all(entry and entry[0] == fingerprint for entry in cached.values()):
+            return {key: entry[1] for key, entry in cached.items()}
+
+        fetched = db_facts.get_table_metadata(schema_name, self.db_type, table_names)
+        metadata = {(schema_name, table): fetched[table] for table in table_names}
+        if fingerprint:
+            with self.lock:
+                for key, table_metadata in metadata.items():
+                    self.metadata[key] = (fingerprint, table_metadata)
+        return metadata
+
+    def _get_diff_table_lock(self, key: tuple) -> threading.Lock:
+        """ Returns the lock of a diff table, counting the job about to take it
+        """
+        with self.lock:
+            entry = self.diff_table_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _release_diff_table_lock(self, key: tuple):
+        """ Forgets the lock of a diff table once no job holds or waits for it, so
+            the locks do not pile up with every diff table ever written
+        """
+        with self.lock:
+            entry = self.diff_table_locks[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del self.diff_table_locks[key]
+
+    def _work(self):
+        conn = None
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            table_info = record['table_info']
+            lock_key = (table_info['schema_name'], table_info['table_diff'])
+            diff_table_lock = self._get_diff_table_lock(lock_key)
+            try:
+                with diff_table_lock:
+                    record['status'] = 'running'
+                    if conn is None:
+                        conn = self.connect()
+                    metadata = self._get_metadata(conn, table_info)
+                    job_args = {**self.args, "system": {**self.args["system"], **record['system']}}
+                    record['result'] = diff_pair(job_args, conn, table_info, metadata)
+                    record['status'] = 'done' if record['result']['status'] == 'ok' else 'failed'
+            except Exception as e:
+                # a broken connection is replaced on the next job
+                logging.error(f"[bold red]Job {record['job_id']} failed:[/] {e}")
+                record['status'] = 'failed'
+                record['result'] = {'status': f'failed: {e}'}
+                if conn is not None:
+                    conn.close()
+                conn = None
+            finally:
+                self._release_diff_table_lock(lock_key)
+                record['finished_at'] = time.monotonic()
+                record['done'].set()
+        if conn is not None:
+            conn.close()
+
+
+class DiffRequestHandler(BaseHTTPRequestHandler):
+    """Maps the HTTP routes onto the DiffService of the server
+    """
+
+    def _send_json(self, status: int, body: dict):
+        payload = json.dumps(body, default=str).encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, {'workers': service.max_jobs, 'queued': service.queue.qsize()})
+        elif path.startswith('/jobs/'):
+            job = service.get_job(path[len('/jobs/'):])
+            if job is None:
+                self._send_json(404, {'error': 'unknown job'})
+            else:
+                self._send_json(200, job)
+        else:
+            self._send_json(404, {'error': 'unknown route'})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path != '/jobs':
+            self._send_json(404, {'error': 'unknown route'})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            record = service.submit(job)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        if parse_qs(url.query).get('wait', ['0'])[0] not in ('0', ''):
+            record['done'].wait()
+            self._send_json(200, get_job_view(record))
+        else:
+            self._send_json(202, get_job_view(record))
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.info(f"[bold red]{self.address_string()}[/] {format % args}")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+
+def create_server(service: DiffService, address: str):
+    """ Returns the HTTP server for address, either unix:<path> or <host>:<port>.
+        Jobs are unauthenticated, so hosts other than loopback are refused.
+    """
+    if address.startswith('unix:'):
+        server = UnixHTTPServer(address[len('unix:'):], DiffRequestHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        host = host.strip('[]') or '127.0.0.1'
+        try:
+            loopback = host == 'localhost' or ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            loopback = False
+        if not loopback:
+            raise ValueError(f'the daemon only listens on loopback addresses, not {host}')
+        server = ThreadingHTTPServer((host, int(port)), DiffRequestHandler)
+    server.service = service
+    return server
+
+
+def serve(args: dict, connect, address: str):
+    service = DiffService(args, connect, max_jobs=args["system"].get("workers") or 1)
+    service.start()
+    server = create_server(service, address)
+    print(f'Table Differ serving on {address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
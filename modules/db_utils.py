@@ -1,34 +1,311 @@
 #! /bin/env/python3
 
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+SQLITE_HASH_FUNC = 'td_hash'
+
+DUCKDB_FILE_SUFFIXES = ('.parquet', '.csv', '.tsv', '.csv.gz', '.tsv.gz')
+
+# pragmas for throwaway SQLite diff runs: scratch data lives in memory and the
+# temp database (where fast mode puts the diff table) skips syncing and journaling
+SQLITE_FAST_PRAGMAS = [
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",      # 256 MiB, negative values are KiB
+    "PRAGMA temp.cache_size = -262144",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp.synchronous = OFF",
+    "PRAGMA temp.journal_mode = OFF"]
+
+
 class DBFacts:
-    def __init__(self, conn):
+    """Answers questions about the schema of the tables being compared.
+    Column, type, nullability, primary key and index information for every
+    requested table is fetched in one batched catalog query and kept in memory.
+    With a cache_dir it is also written to disk, keyed by the tables involved
+    and checked against a cheap schema fingerprint before each reuse.
+    """
+
+    def __init__(self,
+                 conn,
+                 cache_dir: str|None = None,
+                 cache_ttl: int = 3600):
         self.conn = conn
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.metadata = {}
 
     def get_cols(self,
                 schema_name: str,
                 db_type: str,
                 table_name: str) -> list[str]:
-        if db_type == 'postgres' or db_type == 'mysql':
-            cur = self.conn.cursor()
-            query = f"""
-                    SELECT column_name
-                    FROM information_schema.columns
-                    WHERE table_schema = '{schema_name}'
-                        AND table_name = '{table_name}'
-                    """
-            cur.execute(query)
-            cols = cur.fetchall()
-        elif db_type == 'sqlite':
-            query = f"""PRAGMA table_info({table_name})"""
-            results = self.conn.execute(query)
-            cols = []
-            for result in results:
-                cols.append(result[1])
-        else:
-            raise ValueError(f'db_type of {db_type} not supported')
-
-        return cols
-
-    def get_common_cols(table_a_cols: list[str],
-                        table_b_col: list[str]) -> list[str]:
-        return list(set(table_a_cols).intersection(set(table_b_cols)))
+        table_metadata = self.get_table_metadata(schema_name, db_type, [table_name])[table_name]
+        return [col['name'] for col in table_metadata['columns']]
+
+    def get_col_types(self,
+                      schema_name: str,
+                      db_type: str,
+                      table_name: str) -> dict[str, str]:
+        table_metadata = self.get_table_metadata(schema_name, db_type, [table_name])[table_name]
+        return {col['name']: col['type'] or 'TEXT' for col in table_metadata['columns']}
+
+    def get_table_metadata(self,
+                           schema_name: str,
+                           db_type: str,
+                           table_names: list[str]) -> dict[str, dict]:
+        """ Returns {table_name: {'columns': [...], 'primary_key': [...], 'indexes': [...]}}
+            for every table, fetching any table not already known in one batch.
+            Tables that do not exist come back with no columns.
+        """
+        missing = sorted({table for table in table_names if (schema_name, table) not in self.metadata})
+        if missing:
+            cache_file = fingerprint = None
+            if self.cache_dir and self.cache_ttl:
+                identity, fingerprint = self.get_schema_fingerprint(schema_name, db_type, missing)
+                if identity:
+                    cache_file = self._get_cache_file(db_type, identity, schema_name, missing)
+            fetched = self._read_cache(cache_file, fingerprint) if cache_file else None
+            if fetched is None:
+                fetched = self._fetch_metadata(schema_name, db_type, missing)
+                if cache_file:
+                    self._write_cache(cache_file, fingerprint, fetched)
+            for table in missing:
+                self.metadata[(schema_name, table)] = fetched[table]
+        return {table: self.metadata[(schema_name, table)] for table in table_names}
+
+    def _fetch_metadata(self,
+                        schema_name: str,
+                        db_type: str,
+                        table_names: list[str]) -> dict[str, dict]:
+        dialect = get_dialect(db_type)
+        metadata = dialect.fetch_metadata(self.conn, schema_name, table_names)
+        if metadata is not None:
+            return metadata
+
+        table_list = ', '.join([sql_literal(table) for table in table_names])
+        query = dialect.metadata_query(schema_name, table_list)
+        cur = self.conn.cursor()
+        cur.execute(query)
+        metadata = {table: {'columns': [], 'primary_key': [], 'indexes': []} for table in table_names}
+        pk_positions = {table: [] for table in table_names}
+        for kind, table, name, detail, flag_a, flag_b, position in sorted(cur.fetchall(),
+                                                                          key=lambda row: row[6]):
+            if kind == 'column':
+                metadata[table]['columns'].append({'name': name,
+                                                   'type': detail,
+                                                   'nullable': bool(flag_a)})
+                if flag_b:    # sqlite reports the primary key position per column
+                    pk_positions[table].append((flag_b, name))
+            else:
+                index_cols = detail.split(',') if detail else []
+                metadata[table]['indexes'].append({'name': name,
+                                                   'columns': index_cols,
+                                                   'unique': bool(flag_a)})
+                if flag_b:
+                    metadata[table]['primary_key'] = index_cols
+        for table, positions in pk_positions.items():
+            if positions and not metadata[table]['primary_key']:
+                metadata[table]['primary_key'] = [name for _, name in sorted(positions)]
+        return metadata
+
+    def get_schema_fingerprint(self,
+                               schema_name: str,
+                               db_type: str,
+                               table_names: list[str]) -> tuple[str, str]:
+        """ Returns (identity of the database, fingerprint of the tables' schema)
+            from one cheap catalog lookup. The fingerprint changes whenever a
+            table or one of its indexes is created, altered or dropped.
+        """
+        table_list = ', '.join([sql_literal(table) for table in table_names])
+        query = get_dialect(db_type).fingerprint_query(schema_name, table_list)
+        if query is None:
+            return '', ''
+        cur = self.conn.cursor()
+        cur.execute(query)
+        identity, fingerprint = cur.fetchall()[0]
+        return identity or '', str(fingerprint)
+
+    def _get_cache_file(self,
+                        db_type: str,
+                        identity: str,
+                        schema_name: str,
+                        table_names: list[str]) -> str:
+        key = '|'.join([db_type, identity, schema_name] + table_names)
+        return os.path.join(self.cache_dir, hashlib.md5(key.encode('UTF-8')).hexdigest() + '.json')
+
+    def _read_cache(self,
+                    cache_file: str,
+                    fingerprint: str) -> dict|None:
+        try:
+            with open(cache_file, encoding='UTF-8') as inbuf:
+                cached = json.load(inbuf)
+        except (OSError, ValueError):
+            return None
+        if cached.get('fingerprint') != fingerprint:
+            logging.info(f"[bold red]Schema changed, metadata cache invalidated:[/] {cache_file}")
+            return None
+        if time.time() - cached.get('created', 0) > self.cache_ttl:
+            return None
+        return cached['metadata']
+
+    def _write_cache(self,
+                     cache_file: str,
+                     fingerprint: str,
+                     metadata: dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(cache_file, 'w', encoding='UTF-8') as outbuf:
+            json.dump({'fingerprint': fingerprint,
+                       'created': time.time(),
+                       'metadata': metadata}, outbuf)
+
+    def get_row_estimate(self,
+                         schema_name: str,
+                         db_type: str,
+                         table_name: str) -> int|None:
+        """ Returns the row count the database keeps in its statistics catalog
+            without scanning the table, or None when no statistics exist.
+        """
+        query = get_dialect(db_type).row_estimate_query(self.conn, schema_name, table_name)
+        if query is None:
+            return None
+
+        cur = self.conn.cursor()
+        cur.execute(query)
+        results = cur.fetchall()
+        if not results or results[0][0] is None:
+            return None
+        estimate = int(str(results[0][0]).split()[0])
+        if estimate < 0:    # postgres reports -1 for tables that were never analyzed
+            return None
+        return estimate
+
+
+def get_dialect(db_type: str):
+    """ Returns the registered Dialect of db_type
+    """
+    from modules import dialects    # dialects builds on the helpers of this module
+    return dialects.get_dialect(db_type)
+
+
+def get_common_cols(table_a_cols: list[str],
+                    table_b_cols: list[str]) -> list[str]:
+    return list(set(table_a_cols).intersection(set(table_b_cols)))
+
+
+def table_ref(db_type: str,
+              schema_name: str,
+              table_name: str) -> str:
+    """ Returns the table name qualified the way the database expects it
+    """
+    return get_dialect(db_type).table_ref(schema_name, table_name)
+
+
+def is_file_source(table_name: str) -> bool:
+    """ Returns True when a table name is really a Parquet/CSV file, glob or directory
+        that DuckDB should read in place
+    """
+    return (table_name.lower().endswith(DUCKDB_FILE_SUFFIXES)
+            or '/' in table_name
+            or os.path.isdir(table_name))
+
+
+def duckdb_source(path: str) -> str:
+    """ Returns the DuckDB table function that scans a file, glob or directory
+    """
+    if os.path.isdir(path):
+        has_parquet = any(file_name.lower().endswith('.parquet')
+                          for _, _, file_names in os.walk(path) for file_name in file_names)
+        extension = 'parquet' if has_parquet else 'csv'
+        path = os.path.join(path, '**', f'*.{extension}')
+    if '.parquet' in path.lower():
+        return f"read_parquet({sql_literal(path)}, union_by_name = true)"
+    return f"read_csv_auto({sql_literal(path)}, union_by_name = true)"
+
+
+def param_marker(db_type: str) -> str:
+    """ Returns the DB-API parameter placeholder used by the database driver
+    """
+    return get_dialect(db_type).param_marker
+
+
+def sql_literal(value) -> str:
+    """ Returns value written as a SQL literal for inlining into generated queries
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class ConnectionPool:
+    """Hands out up to max_size connections made by connect, reusing
+    connections that have been returned instead of opening new ones
+    """
+
+    def __init__(self, connect, max_size: int):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle = queue.Queue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.opened < self.max_size:
+                self.opened += 1
+                return self.connect()
+        return self.idle.get()
+
+    def put(self, conn):
+        self.idle.put(conn)
+
+    def close_all(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+        self.opened = 0
+
+
+def get_stream_cursor(conn,
+                      db_type: str,
+                      name: str,
+                      batch_size: int):
+    """ Returns a cursor that fetches rows from the server in batches rather than
+        all at once. Postgres needs a named (server-side) cursor for this, while
+        SQLite cursors already step through results lazily.
+    """
+    return get_dialect(db_type).stream_cursor(conn, name, batch_size)
+
+
+def row_hash(*values) -> int:
+    """ Hashes a row of values into a signed 64-bit integer. Each value is
+        written as its length, a colon and its text, and a NULL as a bare N, so
+        no two rows encode alike: neither NULL and the text N nor values that
+        hold the separator, ex.: ('a|b', 'c') and ('a', 'b|c').
+    """
+    row = ''.join(['N' if value is None else f"{len(str(value))}:{value}" for value in values])
+    digest = hashlib.md5(row.encode('UTF-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def apply_sqlite_fast_pragmas(conn) -> None:
+    for pragma in SQLITE_FAST_PRAGMAS:
+        conn.execute(pragma)
+
+
+def register_sqlite_functions(conn) -> None:
+    """ SQLite has no built-in hash function, so one is registered on the
+        connection for the checksum queries to use.
+    """
+    conn.create_function(SQLITE_HASH_FUNC, -1, row_hash, deterministic=True)
@@ -0,0 +1,754 @@
+#! usr/bin/env python
+
+""" dialects holds everything that differs between the supported databases:
+    how to connect, how tables are named, which catalog queries describe them,
+    how rows are hashed and compared, and which diff query plan runs fastest.
+    Each backend registers one Dialect under its db_type. Database drivers
+    are imported only when a connection to that backend is opened, so a
+    SQLite run never loads psycopg2.
+"""
+
+import abc
+import csv
+import io
+import json
+import time
+
+from modules import db_utils
+
+DIALECTS = {}
+# actual rows this many times above (or below) the planner estimate are reported
+MISESTIMATE_FACTOR = 10
+
+
+def register_dialect(dialect_class):
+    """ Class decorator adding a Dialect to the registry under its name
+    """
+    DIALECTS[dialect_class.name] = dialect_class()
+    return dialect_class
+
+
+def get_dialect(db_type: str):
+    try:
+        return DIALECTS[db_type]
+    except KeyError:
+        raise ValueError(f'db_type of {db_type} not supported') from None
+
+
+class Dialect(abc.ABC):
+    """Backend defaults, overridden by each database
+    """
+    name = None
+    # True when the backend plans a FULL OUTER JOIN well; the others diff
+    # through an inner join plus two anti-joins glued with UNION ALL
+    full_outer_join = True
+    # without a FULL OUTER JOIN, True diffs through one LEFT JOIN plus one
+    # anti-join glued with UNION ALL, so each branch seeks on a key index
+    left_join_union = False
+    # False when only one connection can write at a time (SQLite, DuckDB)
+    concurrent_writers = True
+    param_marker = '%s'
+    # False when (a, b) > (x, y) comparisons have to be spelled out column by column
+    row_values = True
+    create_temp_table = "CREATE TEMP TABLE"
+    # False when scratch tables are shared by every connection, so worker
+    # connections must not load them again
+    local_temp_tables = True
+    # True when a compared table without a key index is indexed for the run.
+    # Server tables are left alone since they may be live (ex.: replicas).
+    temp_key_indexes = False
+    # False when the driver cannot bind a Decimal parameter
+    binds_decimal = True
+
+    @abc.abstractmethod
+    def connect(self, db_args: dict, fast: bool = False):
+        """ Returns a new connection to the database described by db_args
+        """
+
+    def operational_error(self) -> type:
+        """ Returns the exception the driver raises for a statement the database
+            could not run (ex.: a table it cannot index)
+        """
+        raise ValueError(f'db_type of {self.name} not supported')
+
+    def prepare(self, conn):
+        """ Readies a connection opened elsewhere for diffing
+        """
+
+    def table_ref(self, schema_name: str, table_name: str) -> str:
+        return f"{schema_name}.{table_name}"
+
+    def stream_cursor(self, conn, name: str, batch_size: int):
+        """ Returns a cursor that fetches rows in batches rather than all at once
+        """
+        return conn.cursor()
+
+    def row_hash(self, cols: list[str]) -> str:
+        """ Returns an expression hashing cols into a signed 64-bit integer, each
+            value encoded as in db_utils.row_hash so that no two rows collide by
+            construction
+        """
+        raise ValueError(f'db_type of {self.name} not supported')
+
+    def distinct(self, left: str, right: str) -> str:
+        """ Returns a null-safe predicate that is true when left and right differ
+        """
+        return f"{left} IS DISTINCT FROM {right}"
+
+    def binary_order(self, col: str) -> str:
+        """ Returns an ORDER BY term sorting the text column col by code point,
+            the order Python compares strings in, whatever the column collation
+        """
+        return col
+
+    def create_table(self, fast: bool = False) -> str:
+        return "CREATE TABLE"
+
+    def scratch_table(self, name: str, table_diff: str) -> str:
+        """ Returns the name of a scratch table of a run on table_diff, by default
+            a temp table private to its connection
+        """
+        return f"td_{name}"
+
+    def promote_queries(self, table_ref: str, table_name: str) -> list[str]:
+        """ Returns the queries turning a fast mode table into a durable one
+        """
+        return []
+
+    def expression_index_query(self, index_name: str, table_ref: str, exprs: list[str]) -> str|None:
+        """ Returns the query indexing table_ref on exprs, None when the backend
+            would not use such an index for a range scan
+        """
+        return f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_ref} ({', '.join(exprs)})"
+
+    def load_rows(self, cur, table_name: str, cols: list[str], rows: list[tuple]):
+        """ Bulk-loads rows into table_name
+        """
+        markers = ', '.join([self.param_marker] * len(cols))
+        cur.executemany(f"INSERT INTO {table_name} ({', '.join(cols)}) VALUES ({markers})", rows)
+
+    def fetch_metadata(self, conn, schema_name: str, table_names: list[str]) -> dict|None:
+        """ Returns the DBFacts metadata of table_names when the backend reads it
+            some other way than through metadata_query, None otherwise
+        """
+        return None
+
+    def metadata_query(self, schema_name: str, table_list: str) -> str:
+        """ Returns a query listing ('column', table, name, type, nullable, 0, position)
+            and ('index', table, name, 'col,col', unique, primary, 0) rows
+        """
+        raise ValueError(f'db_type of {self.name} not supported')
+
+    def fingerprint_query(self, schema_name: str, table_list: str) -> str|None:
+        """ Returns a query of (database identity, schema fingerprint), or None
+            when metadata should never be cached on disk
+        """
+        raise ValueError(f'db_type of {self.name} not supported')
+
+    def row_estimate_query(self, conn, schema_name: str, table_name: str) -> str|None:
+        return None
+
+    def data_fingerprint(self, cur, schema_name: str, table_name: str, table_ref: str, checksum: str) -> str:
+        """ Returns a value that changes whenever the data of table_name does,
+            by default its row count and aggregate checksum (a scan, but no join)
+        """
+        cur.execute(f"SELECT {checksum} FROM {table_ref}")
+        return str(tuple(cur.fetchall()[0]))
+
+    def copy_query(self, select_query: str, output_file: str, file_format: str) -> str|None:
+        """ Returns a statement writing the rows of select_query straight to
+            output_file, or None when they are streamed through the client
+        """
+        return None
+
+    def histogram_bounds(self, cur, schema_name: str, table_name: str, key_col: str) -> list|None:
+        """ Returns the planner histogram of key_col, or None when there is none
+        """
+        return None
+
+    def quantile_bounds(self, cur, table_ref: str, key_col: str, partition_cnt: int) -> list|None:
+        """ Returns the partition_cnt - 1 quantiles of key_col from one query, or
+            None when they are looked up one OFFSET at a time
+        """
+        return None
+
+    def explain(self, cur, query: str, analyze: bool = False) -> list|dict:
+        """ Returns the plan of query in the backend's structured format, with
+            analyze also running it for actual row counts and timings
+        """
+        raise ValueError(f'db_type of {self.name} not supported')
+
+    def advise(self, plan, table_names: list[str]) -> list[str]:
+        """ Returns a warning for every pattern of plan known to make a diff slow
+        """
+        return []
+
+    def statistics_warning(self, conn, schema_name: str, table_name: str) -> str|None:
+        """ Returns a warning when the planner has no statistics for table_name
+        """
+        return None
+
+
+@register_dialect
+class SqliteDialect(Dialect):
+    name = 'sqlite'
+    full_outer_join = False
+    concurrent_writers = False
+    param_marker = '?'
+    temp_key_indexes = True
+    binds_decimal = False
+
+    def connect(self, db_args: dict, fast: bool = False):
+        import sqlite3
+        assert db_args["db_path"]
+        conn = sqlite3.connect(db_args["db_path"])
+        if fast:
+            db_utils.apply_sqlite_fast_pragmas(conn)
+        self.prepare(conn)
+        return conn
+
+    def prepare(self, conn):
+        db_utils.register_sqlite_functions(conn)
+
+    def operational_error(self) -> type:
+        import sqlite3
+        return sqlite3.OperationalError
+
+    def table_ref(self, schema_name: str, table_name: str) -> str:
+        return table_name
+
+    def row_hash(self, cols: list[str]) -> str:
+        return f"{db_utils.SQLITE_HASH_FUNC}({', '.join(cols)})"
+
+    def distinct(self, left: str, right: str) -> str:
+        return f"{left} IS NOT {right}"
+
+    def binary_order(self, col: str) -> str:
+        return f"{col} COLLATE BINARY"
+
+    def create_table(self, fast: bool = False) -> str:
+        return "CREATE TEMP TABLE" if fast else "CREATE TABLE"
+
+    def promote_queries(self, table_ref: str, table_name: str) -> list[str]:
+        return [f"DROP TABLE IF EXISTS main.{table_name}",
+                f"CREATE TABLE main.{table_name} AS SELECT * FROM temp.{table_name}",
+                f"DROP TABLE temp.{table_name}"]
+
+    def metadata_query(self, schema_name: str, table_list: str) -> str:
+        return f"""
+                SELECT 'column', m.name, p.name, p.type, NOT p."notnull", p.pk, p.cid
+                FROM (SELECT name, type FROM sqlite_master
+                      UNION SELECT name, type FROM sqlite_temp_master) m
+                    JOIN pragma_table_info(m.name) p
+                WHERE m.type IN ('table', 'view')
+                    AND m.name IN ({table_list})
+                UNION ALL
+                SELECT 'index', m.name, il.name,
+                       (SELECT group_concat(name, ',')
+                        FROM (SELECT ii.name FROM pragma_index_info(il.name) ii ORDER BY ii.seqno)),
+                       il."unique", il.origin = 'pk', 0
+                FROM (SELECT name, type FROM sqlite_master
+                      UNION SELECT name, type FROM sqlite_temp_master) m
+                    JOIN pragma_index_list(m.name) il
+                WHERE m.type = 'table'
+                    AND m.name IN ({table_list})
+                """
+
+    def fingerprint_query(self, schema_name: str, table_list: str) -> str:
+        # the schema version alone repeats when a file is deleted and recreated
+        # at the same path, so the DDL of the tables and their indexes goes in too
+        return f"""
+                SELECT (SELECT file FROM pragma_database_list WHERE name = '{schema_name}'),
+                       (SELECT schema_version FROM pragma_schema_version)
+                           || ';' || (SELECT COALESCE(group_concat(type || ':' || name || ':'
+                                                                   || COALESCE(sql, ''), ';'), '')
+                                      FROM (SELECT type, name, sql
+                                            FROM {schema_name}.sqlite_master
+                                            WHERE tbl_name IN ({table_list})
+                                            ORDER BY type, name))
+                """
+
+    def row_estimate_query(self, conn, schema_name: str, table_name: str) -> str|None:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        if not cur.fetchall()[0][0]:
+            return None
+        return f"""
+                SELECT stat
+                FROM sqlite_stat1
+                WHERE tbl = '{table_name}'
+                ORDER BY idx IS NOT NULL
+                """
+
+    def explain(self, cur, query: str, analyze: bool = False) -> dict:
+        cur.execute(f"EXPLAIN QUERY PLAN {query}")
+        plan = {'steps': [{'id': row[0], 'parent': row[1], 'detail': row[3]}
+                          for row in cur.fetchall()]}
+        if analyze:
+            # sqlite has no EXPLAIN ANALYZE, the query is timed instead
+            start = time.perf_counter()
+            cur.execute(query)
+            plan['actual_rows'] = sum(1 for _ in cur)
+            plan['actual_seconds'] = round(time.perf_counter() - start, 3)
+        return plan
+
+    def _get_inner_steps(self, plan: dict) -> list[dict]:
+        """ Returns the steps of a plan that run once per row of an outer loop:
+            every table loop after the first one under the same parent, and
+            everything inside a correlated subquery
+        """
+        steps = {step['id']: step for step in plan['steps']}
+
+        def correlated(step):
+            while step['parent'] in steps:
+                step = steps[step['parent']]
+                if step['detail'].startswith('CORRELATED'):
+                    return True
+            return False
+
+        inner_steps = []
+        loop_parents = set()
+        for step in plan['steps']:
+            if not step['detail'].startswith(('SCAN', 'SEARCH')):
+                continue
+            if step['parent'] in loop_parents or correlated(step):
+                inner_steps.append(step)
+            loop_parents.add(step['parent'])
+        return inner_steps
+
+    def advise(self, plan: dict, table_names: list[str]) -> list[str]:
+        warnings = []
+        for step in self._get_inner_steps(plan):
+            detail = step['detail'].replace(' TABLE ', ' ')
+            if detail.startswith('SCAN'):
+                warnings.append(f"nested loop over a full scan of {detail.split()[1]}: "
+                                "the key columns are probably not indexed")
+            elif 'AUTOMATIC' in detail:
+                warnings.append(f"join through an automatic index on {detail.split()[1]}: "
+                                "the key columns are not indexed, so the index is rebuilt every run")
+        if any('TEMP B-TREE' in step['detail'] for step in plan['steps']):
+            warnings.append("sorting or grouping through a temporary b-tree: the key columns are not indexed")
+        return warnings
+
+    def statistics_warning(self, conn, schema_name: str, table_name: str) -> str|None:
+        if db_utils.DBFacts(conn).get_row_estimate(schema_name, self.name, table_name) is None:
+            return f"{table_name} has no sqlite_stat1 statistics: run ANALYZE"
+        return None
+
+
+@register_dialect
+class PostgresDialect(Dialect):
+    name = 'postgres'
+
+    def connect(self, db_args: dict, fast: bool = False):
+        import psycopg2
+        return psycopg2.connect(host=db_args["db_host"],
+                                database=db_args["db_name"],
+                                user=db_args["db_user"],
+                                port=db_args["db_port"])
+
+    def operational_error(self) -> type:
+        import psycopg2
+        return psycopg2.OperationalError
+
+    def stream_cursor(self, conn, name: str, batch_size: int):
+        # only a named cursor keeps the result set on the server
+        cur = conn.cursor(name=name)
+        cur.itersize = batch_size
+        return cur
+
+    def load_rows(self, cur, table_name: str, cols: list[str], rows: list[tuple]):
+        # COPY streams every row in one round trip instead of one INSERT per row
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        cur.copy_expert(f"COPY {table_name} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(f"ANALYZE {table_name}")    # temp tables are never auto-analyzed
+
+    def row_hash(self, cols: list[str]) -> str:
+        text_cols = ', '.join([f"COALESCE(length({col}::text) || ':' || {col}::text, 'N')" for col in cols])
+        return f"('x' || substr(md5(concat({text_cols})), 1, 16))::bit(64)::bigint"
+
+    def binary_order(self, col: str) -> str:
+        return f'{col} COLLATE "C"'
+
+    def create_table(self, fast: bool = False) -> str:
+        return "CREATE UNLOGGED TABLE" if fast else "CREATE TABLE"
+
+    def promote_queries(self, table_ref: str, table_name: str) -> list[str]:
+        return [f"ALTER TABLE {table_ref} SET LOGGED"]
+
+    def metadata_query(self, schema_name: str, table_list: str) -> str:
+        return f"""
+                SELECT 'column', c.relname, a.attname, format_type(a.atttypid, a.atttypmod),
+                       NOT a.attnotnull, FALSE, a.attnum::int
+                FROM pg_attribute a
+                    JOIN pg_class c ON c.oid = a.attrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{schema_name}'
+                    AND c.relname IN ({table_list})
+                    AND a.attnum > 0
+                    AND NOT a.attisdropped
+                UNION ALL
+                SELECT 'index', t.relname, i.relname,
+                       (SELECT string_agg(a.attname, ',' ORDER BY k.ord)
+                        FROM unnest(ix.indkey) WITH ORDINALITY k(attnum, ord)
+                            JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum),
+                       ix.indisunique, ix.indisprimary, 0
+                FROM pg_index ix
+                    JOIN pg_class t ON t.oid = ix.indrelid
+                    JOIN pg_class i ON i.oid = ix.indexrelid
+                    JOIN pg_namespace n ON n.oid = t.relnamespace
+                WHERE n.nspname = '{schema_name}'
+                    AND t.relname IN ({table_list})
+                """
+
+    def fingerprint_query(self, schema_name: str, table_list: str) -> str:
+        return f"""
+                SELECT current_database() || '@' || COALESCE(inet_server_addr()::text, 'local')
+                           || ':' || COALESCE(inet_server_port()::text, ''),
+                       COALESCE(string_agg(c.oid::text || ':' || c.xmin::text, ',' ORDER BY c.oid), '')
+                FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{schema_name}'
+                    AND (c.relname IN ({table_list})
+                         OR c.oid IN (SELECT ix.indexrelid
+                                      FROM pg_index ix
+                                          JOIN pg_class t ON t.oid = ix.indrelid
+                                      WHERE t.relnamespace = n.oid
+                                          AND t.relname IN ({table_list})))
+                """
+
+    def data_fingerprint(self, cur, schema_name: str, table_name: str, table_ref: str, checksum: str) -> str:
+        # every inserted or updated row version carries the id of the transaction
+        # that wrote it, so the row count and the sum of xmin change with any
+        # committed write. Unlike the statistics counters they are read under
+        # the query's snapshot, survive stats resets and crashes, and are the same
+        # on a hot standby. Only tuple headers are read, nothing is hashed.
+        # Views have no xmin and are checksummed instead.
+        cur.execute(f"""
+                SELECT c.relkind
+                FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{schema_name}'
+                    AND c.relname = '{table_name}'
+                """)
+        results = cur.fetchall()
+        if not results or results[0][0] not in ('r', 'p', 'm'):
+            return super().data_fingerprint(cur, schema_name, table_name, table_ref, checksum)
+        cur.execute(f"SELECT COUNT(*), SUM(xmin::text::bigint) FROM {table_ref}")
+        return str(tuple(cur.fetchall()[0]))
+
+    def row_estimate_query(self, conn, schema_name: str, table_name: str) -> str:
+        return f"""
+                SELECT c.reltuples::bigint
+                FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{schema_name}'
+                    AND c.relname = '{table_name}'
+                """
+
+    def histogram_bounds(self, cur, schema_name: str, table_name: str, key_col: str) -> list|None:
+        # the bounds are an anyarray: cast through text to an array of the key column
+        # type, they come back as values of the column, quoted text and all
+        cur.execute(f"""
+                SELECT format_type(a.atttypid, a.atttypmod)
+                FROM pg_attribute a
+                    JOIN pg_class c ON c.oid = a.attrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '{schema_name}'
+                    AND c.relname = '{table_name}'
+                    AND a.attname = '{key_col}'
+                """)
+        results = cur.fetchall()
+        if not results:
+            return None
+        query = f"""
+                SELECT h.bound
+                FROM (SELECT histogram_bounds
+                      FROM pg_stats
+                      WHERE schemaname = '{schema_name}'
+                          AND tablename = '{table_name}'
+                          AND attname = '{key_col}'
+                      ORDER BY inherited
+                      LIMIT 1) s,
+                    unnest(s.histogram_bounds::text::{results[0][0]}[]) WITH ORDINALITY AS h(bound, num)
+                ORDER BY h.num
+                """
+        cur.execute(query)
+        return [row[0] for row in cur.fetchall()] or None
+
+    def quantile_bounds(self, cur, table_ref: str, key_col: str, partition_cnt: int) -> list:
+        fractions = ', '.join([str(num / partition_cnt) for num in range(1, partition_cnt)])
+        query = f"""
+                SELECT percentile_disc(ARRAY[{fractions}]) WITHIN GROUP (ORDER BY {key_col})
+                FROM {table_ref}
+                """
+        cur.execute(query)
+        return list(cur.fetchall()[0][0] or [])
+
+    def explain(self, cur, query: str, analyze: bool = False) -> list:
+        options = 'FORMAT JSON, ANALYZE, BUFFERS' if analyze else 'FORMAT JSON'
+        cur.execute(f"EXPLAIN ({options}) {query}")
+        plan = cur.fetchall()[0][0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def _walk_nodes(self, node: dict):
+        yield node
+        for child in node.get('Plans', []):
+            yield from self._walk_nodes(child)
+
+    def advise(self, plan: list, table_names: list[str]) -> list[str]:
+        warnings = []
+        for node in self._walk_nodes(plan[0]['Plan']):
+            node_type = node['Node Type']
+            if node_type == 'Nested Loop' and len(node.get('Plans', [])) > 1:
+                # the inner side runs once per outer row, a scan there reads the whole
+                # table every time, while a scan on the outer side reads it just once
+                for scan in self._walk_nodes(node['Plans'][1]):
+                    if scan['Node Type'] == 'Seq Scan' and scan.get('Relation Name') in table_names:
+                        warnings.append(f"nested loop over a sequential scan of {scan['Relation Name']}: "
+                                        "the key columns are probably not indexed")
+            if node_type == 'Hash' and node.get('Hash Batches', 1) > 1:
+                warnings.append(f"hash join spilled to disk in {node['Hash Batches']} batches: "
+                                "raise work_mem or diff in partitions (--workers, --bisect)")
+            if node.get('Sort Space Type') == 'Disk':
+                warnings.append(f"sort spilled {node.get('Sort Space Used')}kB to disk: raise work_mem")
+            if 'Actual Rows' in node and node['Plan Rows']:
+                ratio = (node['Actual Rows'] + 1) / (node['Plan Rows'] + 1)
+                if ratio > MISESTIMATE_FACTOR or ratio < 1 / MISESTIMATE_FACTOR:
+                    warnings.append(f"{node_type} estimated {node['Plan Rows']} rows but returned "
+                                    f"{node['Actual Rows']}: statistics are likely stale, run ANALYZE")
+        return warnings
+
+    def statistics_warning(self, conn, schema_name: str, table_name: str) -> str|None:
+        cur = conn.cursor()
+        cur.execute(f"""
+                SELECT last_analyze IS NULL AND last_autoanalyze IS NULL
+                FROM pg_stat_user_tables
+                WHERE schemaname = '{schema_name}'
+                    AND relname = '{table_name}'
+                """)
+        results = cur.fetchall()
+        if results and results[0][0]:
+            return f"{table_name} was never analyzed: row estimates are guesses, run ANALYZE"
+        return None
+
+
+@register_dialect
+class MysqlDialect(Dialect):
+    name = 'mysql'
+    full_outer_join = False    # MySQL has no FULL OUTER JOIN
+    left_join_union = True
+    # a TEMPORARY table cannot be opened twice in one query, and the diff query
+    # reads each scratch table once per branch
+    create_temp_table = "CREATE TABLE"
+    local_temp_tables = False
+
+    def scratch_table(self, name: str, table_diff: str) -> str:
+        # scratch tables are permanent here: named after the diff table, runs on
+        # other diff tables cannot collide with them, and the next run on the same
+        # diff table replaces whatever a crashed run left behind
+        return f"{table_diff}__{name}"
+
+    def connect(self, db_args: dict, fast: bool = False):
+        import pymysql
+        # the password is read from ~/.my.cnf, as psycopg2 reads ~/.pgpass
+        return pymysql.connect(host=db_args["db_host"],
+                               database=db_args["db_name"],
+                               user=db_args["db_user"],
+                               port=db_args["db_port"],
+                               read_default_file='~/.my.cnf')
+
+    def operational_error(self) -> type:
+        import pymysql
+        return pymysql.err.OperationalError
+
+    def stream_cursor(self, conn, name: str, batch_size: int):
+        # an unbuffered cursor reads rows off the wire as they are fetched
+        # instead of loading the whole result set into the client first
+        import pymysql.cursors
+        return conn.cursor(pymysql.cursors.SSCursor)
+
+    def row_hash(self, cols: list[str]) -> str:
+        text_cols = ', '.join([f"COALESCE(CONCAT(CHAR_LENGTH(CAST({col} AS CHAR)), ':', CAST({col} AS CHAR)), 'N')"
+                               for col in cols])
+        return f"CAST(CONV(SUBSTRING(MD5(CONCAT({text_cols})), 1, 16), 16, 10) AS SIGNED)"
+
+    def distinct(self, left: str, right: str) -> str:
+        return f"NOT ({left} <=> {right})"
+
+    def binary_order(self, col: str) -> str:
+        # utf8mb4 bytes sort in code point order, and a cast works for any charset
+        return f"CAST({col} AS BINARY)"
+
+    def expression_index_query(self, index_name: str, table_ref: str, exprs: list[str]) -> str:
+        # functional key parts go in their own parentheses, and there is no IF NOT
+        # EXISTS: an index already there fails with an OperationalError
+        key_parts = ', '.join([f"({expr})" for expr in exprs])
+        return f"CREATE INDEX {index_name} ON {table_ref} ({key_parts})"
+
+    def metadata_query(self, schema_name: str, table_list: str) -> str:
+        return f"""
+                SELECT 'column', table_name, column_name, column_type,
+                       is_nullable = 'YES', FALSE, ordinal_position
+                FROM information_schema.columns
+                WHERE table_schema = '{schema_name}'
+                    AND table_name IN ({table_list})
+                UNION ALL
+                SELECT 'index', table_name, index_name,
+                       GROUP_CONCAT(column_name ORDER BY seq_in_index SEPARATOR ','),
+                       non_unique = 0, index_name = 'PRIMARY', 0
+                FROM information_schema.statistics
+                WHERE table_schema = '{schema_name}'
+                    AND table_name IN ({table_list})
+                GROUP BY table_name, index_name, non_unique
+                """
+
+    def fingerprint_query(self, schema_name: str, table_list: str) -> str:
+        # create_time survives ALTERs done in place (ex.: MySQL 8 INSTANT ADD/DROP
+        # COLUMN), so the columns and index columns are digested as well. Summed
+        # CRC32s, unlike GROUP_CONCAT, are not cut short by group_concat_max_len.
+        return f"""
+                SELECT CONCAT(DATABASE(), '@', @@hostname, ':', @@port),
+                       CONCAT_WS('|',
+                           (SELECT COALESCE(GROUP_CONCAT(CONCAT(table_name, ':', COALESCE(create_time, ''))
+                                                         ORDER BY table_name SEPARATOR ','), '')
+                            FROM information_schema.tables
+                            WHERE table_schema = '{schema_name}'
+                                AND table_name IN ({table_list})),
+                           (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS(':', table_name, ordinal_position,
+                                                                                     column_name, column_type,
+                                                                                     is_nullable))), 0))
+                            FROM information_schema.columns
+                            WHERE table_schema = '{schema_name}'
+                                AND table_name IN ({table_list})),
+                           (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS(':', table_name, index_name,
+                                                                                     seq_in_index, column_name,
+                                                                                     non_unique))), 0))
+                            FROM information_schema.statistics
+                            WHERE table_schema = '{schema_name}'
+                                AND table_name IN ({table_list})))
+                """
+
+    def data_fingerprint(self, cur, schema_name: str, table_name: str, table_ref: str, checksum: str) -> str:
+        # the server checksums the table itself, without shipping rows or hashing
+        # expressions through the SQL layer. Views have no checksum.
+        cur.execute(f"CHECKSUM TABLE {table_ref}")
+        results = cur.fetchall()
+        if not results or results[0][1] is None:
+            return super().data_fingerprint(cur, schema_name, table_name, table_ref, checksum)
+        return str(results[0][1])
+
+    def row_estimate_query(self, conn, schema_name: str, table_name: str) -> str:
+        return f"""
+                SELECT table_rows
+                FROM information_schema.tables
+                WHERE table_schema = '{schema_name}'
+                    AND table_name = '{table_name}'
+                """
+
+    def explain(self, cur, query: str, analyze: bool = False) -> dict:
+        explain = 'EXPLAIN ANALYZE' if analyze else 'EXPLAIN FORMAT=JSON'
+        cur.execute(f"{explain} {query}")
+        plan = cur.fetchall()[0][0]
+        return {'text': plan} if analyze else json.loads(plan)
+
+
+@register_dialect
+class DuckdbDialect(Dialect):
+    name = 'duckdb'
+    concurrent_writers = False    # and every query already runs on all cores
+    param_marker = '?'
+    row_values = False    # a lower and an upper row-value bound are rewritten to an invalid BETWEEN
+
+    def connect(self, db_args: dict, fast: bool = False):
+        import duckdb    # optional dependency, only needed for diffing Parquet/CSV files
+        return duckdb.connect(db_args["db_path"] or ':memory:')
+
+    def operational_error(self) -> type:
+        import duckdb
+        return duckdb.OperationalError
+
+    def table_ref(self, schema_name: str, table_name: str) -> str:
+        if db_utils.is_file_source(table_name):
+            return db_utils.duckdb_source(table_name)
+        return f"{schema_name}.{table_name}"
+
+    def row_hash(self, cols: list[str]) -> str:
+        text_cols = ', '.join([f"COALESCE(length(CAST({col} AS VARCHAR)) || ':' || CAST({col} AS VARCHAR), 'N')"
+                               for col in cols])
+        return f"CAST(hash(concat({text_cols})) & 9223372036854775807 AS BIGINT)"
+
+    def expression_index_query(self, index_name: str, table_ref: str, exprs: list[str]) -> None:
+        # ART indexes only serve point lookups, a page is a scan and a top-N either way
+        return None
+
+    def fetch_metadata(self, conn, schema_name: str, table_names: list[str]) -> dict:
+        """ DuckDB tables are read from its catalog functions, while Parquet/CSV
+            sources are described from the files themselves
+        """
+        cur = conn.cursor()
+        metadata = {table: {'columns': [], 'primary_key': [], 'indexes': []} for table in table_names}
+        db_tables = [table for table in table_names if not db_utils.is_file_source(table)]
+        for table in table_names:
+            if table in db_tables:
+                continue
+            cur.execute(f"DESCRIBE SELECT * FROM {db_utils.duckdb_source(table)}")
+            metadata[table]['columns'] = [{'name': name, 'type': col_type, 'nullable': nullable == 'YES'}
+                                          for name, col_type, nullable, *_ in cur.fetchall()]
+        if not db_tables:
+            return metadata
+
+        table_list = ', '.join([db_utils.sql_literal(table) for table in db_tables])
+        cur.execute(f"""
+                SELECT table_name, column_name, data_type, is_nullable = 'YES'
+                FROM information_schema.columns
+                WHERE table_schema = '{schema_name}'
+                    AND table_name IN ({table_list})
+                ORDER BY table_name, ordinal_position
+                """)
+        for table, name, col_type, nullable in cur.fetchall():
+            metadata[table]['columns'].append({'name': name, 'type': col_type, 'nullable': nullable})
+        cur.execute(f"""
+                SELECT table_name, constraint_column_names
+                FROM duckdb_constraints()
+                WHERE schema_name = '{schema_name}'
+                    AND table_name IN ({table_list})
+                    AND constraint_type = 'PRIMARY KEY'
+                """)
+        for table, pk_cols in cur.fetchall():
+            metadata[table]['primary_key'] = list(pk_cols)
+        cur.execute(f"""
+                SELECT table_name, index_name, expressions, is_unique
+                FROM duckdb_indexes()
+                WHERE schema_name = '{schema_name}'
+                    AND table_name IN ({table_list})
+                """)
+        for table, name, expressions, unique in cur.fetchall():
+            index_cols = [col.strip().strip('"') for col in str(expressions).strip('[]').split(',')]
+            metadata[table]['indexes'].append({'name': name, 'columns': index_cols, 'unique': unique})
+        return metadata
+
+    def fingerprint_query(self, schema_name: str, table_list: str) -> None:
+        return None    # files can change underneath DuckDB, so nothing is cached on disk
+
+    def row_estimate_query(self, conn, schema_name: str, table_name: str) -> str|None:
+        if db_utils.is_file_source(table_name):
+            return None
+        return f"""
+                SELECT estimated_size
+                FROM duckdb_tables()
+                WHERE schema_name = '{schema_name}'
+                    AND table_name = '{table_name}'
+                """
+
+    def copy_query(self, select_query: str, output_file: str, file_format: str) -> str:
+        # DuckDB writes Parquet, NDJSON or CSV itself, without a diff table
+        copy_format = {'csv': 'CSV, HEADER', 'ndjson': 'JSON', 'parquet': 'PARQUET'}[file_format]
+        return f"COPY ({select_query}) TO {db_utils.sql_literal(output_file)} (FORMAT {copy_format})"
+
+    def explain(self, cur, query: str, analyze: bool = False) -> dict:
+        explain = 'EXPLAIN ANALYZE' if analyze else 'EXPLAIN'
+        cur.execute(f"{explain} {query}")
+        return {'text': '\n'.join([str(row[-1]) for row in cur.fetchall()])}
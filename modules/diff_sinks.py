@@ -0,0 +1,169 @@
+#! usr/bin/env python
+
+""" diff_sinks holds the destinations that diff rows can be streamed into
+    when the diff is computed outside of a single database, or when the diff
+    should land in a file rather than in a 'diff_table'.
+    Every sink accepts rows in batches so that memory use stays bounded
+    no matter how large the diff becomes.
+"""
+
+import csv
+import json
+import logging
+
+from modules import db_utils
+
+
+class TableSink:
+    """Writes diff rows into a (re)created table through executemany
+    """
+
+    def __init__(self,
+                 conn,
+                 db_type: str,
+                 table_ref: str,
+                 columns: list[str],
+                 column_types: list[str]):
+        self.conn = conn
+        self.db_type = db_type
+        self.table_ref = table_ref
+        self.columns = columns
+        self.column_types = column_types
+        self.cur = conn.cursor()
+
+    def open(self):
+        col_defs = ',\n    '.join([f"{col} {col_type}"
+                                   for col, col_type in zip(self.columns, self.column_types)])
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.table_ref}")
+        self.cur.execute(f"CREATE TABLE {self.table_ref} (\n    {col_defs})")
+        marker = db_utils.param_marker(self.db_type)
+        self.insert_query = (f"INSERT INTO {self.table_ref} ({', '.join(self.columns)}) "
+                             f"VALUES ({', '.join([marker] * len(self.columns))})")
+
+    def write_rows(self, rows: list[tuple]):
+        self.cur.executemany(self.insert_query, rows)
+
+    def close(self):
+        self.conn.commit()
+        logging.info(f"[bold red]Diff rows written to table:[/] {self.table_ref}")
+
+
+class CsvSink:
+    """Writes diff rows to a csv file with a header row
+    """
+
+    def __init__(self,
+                 path: str,
+                 columns: list[str]):
+        self.path = path
+        self.columns = columns
+
+    def open(self):
+        self.outbuf = open(self.path, 'w', newline='', encoding='UTF-8')
+        self.writer = csv.writer(self.outbuf)
+        self.writer.writerow(self.columns)
+
+    def write_rows(self, rows: list[tuple]):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.outbuf.close()
+        logging.info(f"[bold red]Diff rows written to file:[/] {self.path}")
+
+
+class NdjsonSink:
+    """Writes diff rows to a newline delimited json file, one object per row.
+    Values json cannot represent (dates, decimals) are written as strings.
+    """
+
+    def __init__(self,
+                 path: str,
+                 columns: list[str]):
+        self.path = path
+        self.columns = columns
+
+    def open(self):
+        self.outbuf = open(self.path, 'w', encoding='UTF-8')
+
+    def write_rows(self, rows: list[tuple]):
+        for row in rows:
+            self.outbuf.write(json.dumps(dict(zip(self.columns, row)), default=str) + '\n')
+
+    def close(self):
+        self.outbuf.close()
+        logging.info(f"[bold red]Diff rows written to file:[/] {self.path}")
+
+
+class ParquetSink:
+    """Writes diff rows to a parquet file, one row group per row_group_size rows.
+    The schema is inferred from the first row group; columns that are entirely
+    NULL there are typed as strings.
+    """
+
+    def __init__(self,
+                 path: str,
+                 columns: list[str],
+                 row_group_size: int = 10000):
+        self.path = path
+        self.columns = columns
+        self.row_group_size = row_group_size
+
+    def open(self):
+        import pyarrow    # optional dependency, only needed for parquet output
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.writer = None
+        self.buffer = []
+
+    def _write_row_group(self):
+        table = self.pa.Table.from_pydict({col: list(values)
+                                           for col, values in zip(self.columns, zip(*self.buffer))})
+        if self.writer is None:
+            schema = self.pa.schema([self.pa.field(field.name, self.pa.string())
+                                     if self.pa.types.is_null(field.type) else field
+                                     for field in table.schema])
+            self.writer = self.pq.ParquetWriter(self.path, schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+        self.buffer = []
+
+    def write_rows(self, rows: list[tuple]):
+        self.buffer.extend(rows)
+        while len(self.buffer) >= self.row_group_size:
+            remainder = self.buffer[self.row_group_size:]
+            self.buffer = self.buffer[:self.row_group_size]
+            self._write_row_group()
+            self.buffer = remainder
+
+    def close(self):
+        if self.buffer:
+            self._write_row_group()
+        if self.writer is None:
+            schema = self.pa.schema([self.pa.field(col, self.pa.string()) for col in self.columns])
+            self.writer = self.pq.ParquetWriter(self.path, schema)
+        self.writer.close()
+        logging.info(f"[bold red]Diff rows written to file:[/] {self.path}")
+
+
+def get_file_format(path: str) -> str:
+    """ Returns the output format implied by the extension of path, csv by default
+    """
+    extension = path.lower().rsplit('.', 1)[-1]
+    if extension in ('ndjson', 'jsonl', 'json'):
+        return 'ndjson'
+    if extension in ('parquet', 'pq'):
+        return 'parquet'
+    return 'csv'
+
+
+def get_file_sink(path: str,
+                  columns: list[str],
+                  batch_size: int = 10000):
+    """ Returns the file sink matching the extension of path
+    """
+    file_format = get_file_format(path)
+    if file_format == 'ndjson':
+        return NdjsonSink(path, columns)
+    if file_format == 'parquet':
+        return ParquetSink(path, columns, row_group_size=batch_size)
+    return CsvSink(path, columns)
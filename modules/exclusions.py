@@ -0,0 +1,101 @@
+#! usr/bin/env python
+
+""" exclusions holds the keys of rows to be left out of the 'diff_table'.
+    Keys can be given on the CLI (-e), in a csv file (--ex-rows-file) or as a
+    query returning the key columns (--ex-rows-query). They are bulk-loaded into
+    an indexed temp table and the diff skips them with an anti-join, so tens of
+    thousands of keys cost one index probe per row instead of a literal IN (...)
+    list the parser has to swallow and every row has to be scanned against.
+"""
+
+import csv
+import hashlib
+import logging
+
+
+class ExceptKeys:
+    """Collects the excluded keys and loads them into a temp table of a connection
+    """
+
+    def __init__(self,
+                 db_type: str,
+                 key_cols: list[str],
+                 except_rows: list[str]|None = None,
+                 except_file: str|None = None,
+                 except_query: str|None = None,
+                 table_name: str = 'td_except_keys'):
+
+        self.db_type = db_type
+        self.key_cols = key_cols
+        self.except_rows = except_rows or []
+        self.except_file = except_file
+        self.except_query = except_query
+        self.table_name = table_name
+        self.keys = None
+
+    def __bool__(self):
+        return bool(self.except_rows or self.except_file or self.except_query)
+
+    def _parse_key(self, value: str) -> tuple:
+        """ Returns the key of a CLI value, comma separated for several key columns
+        """
+        if len(self.key_cols) == 1:
+            return (value,)
+        key = tuple(part.strip() for part in value.split(','))
+        if len(key) != len(self.key_cols):
+            raise ValueError(f'excluded key {value} does not have {len(self.key_cols)} values')
+        return key
+
+    def _read_file(self) -> list[tuple]:
+        """ Returns the keys of a csv file, one key per line in key column order,
+            skipping a header line naming the key columns
+        """
+        with open(self.except_file, newline='', encoding='UTF-8') as inbuf:
+            rows = [tuple(row) for row in csv.reader(inbuf) if row]
+        if rows and [col.strip().lower() for col in rows[0]] == [col.lower() for col in self.key_cols]:
+            rows = rows[1:]
+        for row in rows:
+            if len(row) != len(self.key_cols):
+                raise ValueError(f'excluded key {row} in {self.except_file} does not have '
+                                 f'{len(self.key_cols)} values')
+        return rows
+
+    def get_keys(self) -> list[tuple]:
+        """ Returns the keys given on the CLI and in the file, read once
+        """
+        if self.keys is None:
+            self.keys = [self._parse_key(value) for value in self.except_rows]
+            if self.except_file:
+                self.keys += self._read_file()
+        return self.keys
+
+    def get_fingerprint(self) -> str:
+        """ Returns a digest of the exclusions, changing whenever they do
+        """
+        digest = hashlib.md5()
+        for key in sorted(self.get_keys()):
+            digest.update(('\x1f'.join(key) + '\x1e').encode('UTF-8'))
+        digest.update((self.except_query or '').encode('UTF-8'))
+        return digest.hexdigest()
+
+    def load(self, cur, dialect, table_ref: str):
+        """ Creates the indexed temp table of excluded keys through cur (DuckDB
+            cursors are connections of their own, so it has to be the cursor the
+            diff runs on). Its columns take the types of the key columns of
+            table_ref, so the anti-join compares like with like.
+        """
+        key_list = ', '.join(self.key_cols)
+        cur.execute(f"DROP TABLE IF EXISTS {self.table_name}")
+        cur.execute(f"""{dialect.create_temp_table} {self.table_name} AS
+                        SELECT {key_list} FROM {table_ref} WHERE 1 = 0""")
+        keys = self.get_keys()
+        if keys:
+            dialect.load_rows(cur, self.table_name, self.key_cols, keys)
+        if self.except_query:
+            cur.execute(f"INSERT INTO {self.table_name} ({key_list}) {self.except_query}")
+        cur.execute(f"CREATE INDEX {self.table_name}_idx ON {self.table_name} ({key_list})")
+        cur.execute(f"SELECT COUNT(*) FROM {self.table_name}")
+        logging.info(f"[bold red]Excluded keys loaded:[/] {cur.fetchall()[0][0]}")
+
+    def drop(self, cur):
+        cur.execute(f"DROP TABLE IF EXISTS {self.table_name}")
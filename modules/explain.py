@@ -0,0 +1,93 @@
+#! usr/bin/env python
+
+""" explain captures the plans the database chooses for the diff query and the
+    report queries without building the 'diff_table', and saves them as json.
+    Each plan is checked for patterns known to make a diff slow: nested loops
+    over sequential scans of the compared tables, hash joins or sorts spilling
+    to disk, and tables the planner has no statistics for.
+    With analyze the queries are also run (but nothing is written), so the plans
+    carry actual row counts and timings.
+"""
+
+import json
+import logging
+
+from rich.console import Console
+from rich.table import Table
+
+from modules import db_utils
+
+
+class PlanAdvisor:
+    """Explains queries on one connection and flags the bad patterns in their plans
+    """
+
+    def __init__(self,
+                 conn,
+                 db_type: str,
+                 schema_name: str,
+                 table_names: list[str],
+                 analyze: bool = False):
+
+        self.conn = conn
+        self.db_type = db_type
+        self.schema_name = schema_name
+        self.table_names = table_names
+        self.analyze = analyze
+        self.dialect = db_utils.get_dialect(db_type)
+        self.cur = conn.cursor()
+
+    def explain(self, query: str) -> list|dict:
+        """ Returns the plan of query in the backend's structured format
+        """
+        return self.dialect.explain(self.cur, query, self.analyze)
+
+    def advise(self, plan) -> list[str]:
+        """ Returns a warning for every bad pattern found in plan
+        """
+        return self.dialect.advise(plan, self.table_names)
+
+    def check_statistics(self) -> list[str]:
+        """ Returns a warning for every compared table the planner has no statistics for
+        """
+        warnings = [self.dialect.statistics_warning(self.conn, self.schema_name, table_name)
+                    for table_name in self.table_names]
+        return [warning for warning in warnings if warning is not None]
+
+    def capture(self, queries: dict[str, str]) -> dict:
+        """ Explains every query and returns the plans and warnings found, ready to
+            be saved as json. A query that cannot be explained (ex.: a report query
+            on a diff table that was never built) records its error instead.
+        """
+        results = {'db_type': self.db_type,
+                   'analyze': self.analyze,
+                   'statistics_warnings': self.check_statistics(),
+                   'queries': {}}
+        for name, query in queries.items():
+            logging.debug(f"[bold red] Explain Query[/]: {query}")
+            try:
+                plan = self.explain(query)
+            except Exception as e:
+                logging.warning(f"[bold red]Could not explain {name}:[/] {e}")
+                self.conn.rollback()
+                results['queries'][name] = {'query': query, 'error': str(e)}
+                continue
+            results['queries'][name] = {'query': query, 'plan': plan, 'warnings': self.advise(plan)}
+        self.conn.commit()
+        return results
+
+    def write_plans(self, results: dict, plan_file: str):
+        with open(plan_file, 'w', encoding='UTF-8') as outbuf:
+            json.dump(results, outbuf, indent=2, default=str)
+
+        advice_table = Table(title=f"Query Plans ({plan_file})")
+        advice_table.add_column("query", style="red", no_wrap=True)
+        advice_table.add_column("warning", style="cyan")
+        for warning in results['statistics_warnings']:
+            advice_table.add_row('statistics', warning)
+        for name, result in results['queries'].items():
+            warnings = result.get('warnings', [f"not explained: {result.get('error')}"])
+            for warning in warnings or ['no known bad patterns']:
+                advice_table.add_row(name, warning)
+        console = Console()    # rich text output formatting for CLI tables
+        console.print(advice_table)
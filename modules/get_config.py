@@ -6,6 +6,8 @@
 # BUILT-INS
 import argparse
 import logging
+import os
+import re
 import sys
 from typing import Optional
 import yaml
@@ -56,7 +58,12 @@ def get_cli_args(cli_args):
     parser.add_argument("-e", "--ex-rows",
                         nargs="+",
                         action="store",
-                        help="potential rows to be excluded from diff_table. These should be key column values")
+                        help="potential rows to be excluded from diff_table. These should be key column values, "
+                             "comma separated for several key columns")
+    parser.add_argument("--ex-rows-file",
+                        help="csv file of keys to be excluded from diff_table, one key per line")
+    parser.add_argument("--ex-rows-query",
+                        help="query returning the key columns of the rows to be excluded from diff_table")
     parser.add_argument( "-l", "--logging_level",
                         default="warning",
                         choices=["debug", "info", "warning", "error", "critical"],
@@ -64,15 +71,117 @@ def get_cli_args(cli_args):
     parser.add_argument("-p", "--print-tables",
                         action="store_true",
                         default=None,
-                        help="prints the tables to the console, use at your own risk")
+                        help="pages through the compared tables and the diff table in key order")
+    parser.add_argument("--page-size",
+                        type=int,
+                        default=50,
+                        help="rows shown per page by --print-tables")
+    parser.add_argument("--start-key",
+                        nargs="+",
+                        help="key column value(s) --print-tables starts paging from")
     parser.add_argument("--local-db",
                         action="store_true",
                         default=None,
                         help="designates whether or not to use a local sourced database")
+    parser.add_argument("--bisect",
+                        action="store_true",
+                        default=None,
+                        help="compare per-range checksums first and only join the key ranges that differ")
+    parser.add_argument("--bisect-fanout",
+                        type=int,
+                        default=16,
+                        help="number of sub ranges each differing key range is split into")
+    parser.add_argument("--bisect-leaf-width",
+                        type=int,
+                        default=10000,
+                        help="width of a key range below which it is joined row by row")
+    parser.add_argument("--fast",
+                        action="store_true",
+                        default=None,
+                        help="throwaway run: UNLOGGED (postgres) or TEMP (sqlite) diff table and a tuned sqlite session")
+    parser.add_argument("--fast-promote",
+                        action="store_true",
+                        default=None,
+                        help="with --fast, turn the diff table into a durable table once it is built")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        metavar="N",
+                        help="build the diff table in key order, N keys at a time, committing a checkpoint after "
+                             "each chunk so an interrupted build resumes where it stopped (not with --fast)")
+    parser.add_argument("--cache",
+                        action="store_true",
+                        default=None,
+                        help="reuse the diff table and report of the last run when neither table nor any diff parameter changed")
+    parser.add_argument("--incremental",
+                        action="store_true",
+                        default=None,
+                        help="patch the diff table with keys changed since the last run instead of rebuilding it")
+    parser.add_argument("--watermark-col",
+                        help="column (ex.: updated_at) that marks rows changed since the last incremental run")
+    parser.add_argument("--explain",
+                        action="store_true",
+                        default=None,
+                        help="save the plans of the diff and report queries to --plan-file instead of running the diff")
+    parser.add_argument("--analyze",
+                        action="store_true",
+                        default=None,
+                        help="like --explain, but runs the queries (writing nothing) so the plans hold actual rows and timings")
+    parser.add_argument("--plan-file",
+                        help="json file the query plans are saved to, default <diff table>.plan.json")
+    parser.add_argument("--serve",
+                        metavar="ADDRESS",
+                        help="run as a resident daemon taking diff jobs over HTTP on host:port or a unix:<path> socket")
+    parser.add_argument("--check",
+                        action="store_true",
+                        default=None,
+                        help="only tell whether the tables differ, stopping at the first difference: exits 0 when "
+                             "identical, 1 when they differ and 2 when the check fails")
+    parser.add_argument("--check-examples",
+                        type=int,
+                        default=1,
+                        metavar="K",
+                        help="number of example keys --check prints for the first kind of difference found")
+    parser.add_argument("--narrow",
+                        action="store_true",
+                        default=None,
+                        help="compare one hash of the compared columns per key first, and join the full rows only for keys whose hashes differ")
+    parser.add_argument("--sample",
+                        type=sample_pct,
+                        metavar="PCT",
+                        help="diff only a deterministic PCT percent of the keys and extrapolate the report counts")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="number of connections that build key-range partitions of the diff table, or the table pairs of a batch config, concurrently")
+    parser.add_argument("--metadata-cache-dir",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "table-differ"),
+                        help="directory where table metadata is cached between runs")
+    parser.add_argument("--metadata-cache-ttl",
+                        type=int,
+                        default=3600,
+                        help="seconds cached table metadata stays valid, 0 disables the cache")
+    parser.add_argument("--diff-target",
+                        default="initial",
+                        choices=["initial", "secondary", "file"],
+                        help="where the diff is written: the initial or secondary database, or streamed to --output-file")
+    parser.add_argument("--output-file",
+                        help="file the diff rows are written to when --diff-target is file (.csv, .ndjson or .parquet)")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=10000,
+                        help="number of rows fetched per round trip when streaming rows")
     return parser.parse_args(cli_args)
 
 
 
+def sample_pct(value: str) -> float:
+    pct = float(value)
+    if not 0 < pct <= 100:
+        raise argparse.ArgumentTypeError(f'sample must be a percentage above 0 and at most 100, got {value}')
+    return pct
+
+
+
 def setup_logging(logging_level: str) -> None:
     log_level = str(logging_level).upper()
     rprint(f"[bold red]Current Log Level:[bold red blink] {log_level}")
@@ -118,8 +227,12 @@ def build_arg_dict(args,
                             secondary_table: str) -> str:
         if diff_table:
             return diff_table
+        elif not secondary_table:
+            return None
         else:
-            return secondary_table + '__diff__'
+            # secondary_table may be a Parquet/CSV path when diffing files with duckdb
+            table_name = os.path.basename(secondary_table.rstrip('/')).split('.')[0]
+            return re.sub(r'\W', '_', table_name) + '__diff__'
 
 
     if args.local_db:
@@ -127,6 +240,43 @@ def build_arg_dict(args,
     else:
         db_path = None
 
+    def get_secondary_database(secondary_config: dict|None) -> dict|None:
+        """ Returns the connection details of the secondary table when it
+            lives on a different connection than the initial table
+        """
+        if not secondary_config:
+            return None
+        return {
+            "db_host": secondary_config.get("db_host"),
+            "db_port": secondary_config.get("db_port"),
+            "db_name": secondary_config.get("db_name"),
+            "db_user": secondary_config.get("db_user"),
+            "db_type": secondary_config["db_type"],
+            "db_path": secondary_config.get("db_path"),
+            "schema_name": secondary_config.get("schema_name", yaml_config["schema_name"]) }
+
+    def get_pairs(pair_configs: list[dict]|None) -> list[dict]:
+        """ Returns the table_info of every table pair of a batch config. Settings
+            a pair leaves out are taken from the top level of the config.
+        """
+        pairs = []
+        for pair in pair_configs or []:
+            pairs.append({
+                "table_initial": pair['table_initial'],
+                "table_secondary": pair['table_secondary'],
+                "table_diff": get_diff_table_name(pair.get('diff_table'),
+                                                  pair['table_secondary']),
+                "schema_name": pair.get("schema_name", yaml_config.get("schema_name")),
+                "key_cols": pair.get('key_cols') or args.key_cols or yaml_config.get('key_cols'),
+                "comp_cols": pair.get('compare_cols') or args.compare_cols or yaml_config.get('compare_cols'),
+                "ignore_cols": pair.get('ignore_cols') or args.ignore_cols or yaml_config.get('ignore_cols'),
+                "initial_table_alias": yaml_config["initial_table_alias"],
+                "secondary_table_alias": yaml_config["secondary_table_alias"],
+                "except_rows": args.ex_rows,
+                "except_file": pair.get('except_file') or args.ex_rows_file or yaml_config.get('except_file'),
+                "except_query": pair.get('except_query') or args.ex_rows_query or yaml_config.get('except_query')})
+        return pairs
+
     arg_dict = {
         "database": {
             "db_host": yaml_config["db_host"],
@@ -135,11 +285,12 @@ def build_arg_dict(args,
             "db_user": yaml_config["db_user"],
             "db_type": args.db_type or yaml_config.get('db_type'),
             "db_path": db_path },
+        "secondary_database": get_secondary_database(yaml_config.get("secondary_database")),
         "table_info": {
-            "table_initial": yaml_config['table_initial'],
-            "table_secondary": yaml_config['table_secondary'],
-            "table_diff": get_diff_table_name(yaml_config['diff_table'],
-                                              yaml_config['table_secondary']),
+            "table_initial": yaml_config.get('table_initial'),
+            "table_secondary": yaml_config.get('table_secondary'),
+            "table_diff": get_diff_table_name(yaml_config.get('diff_table'),
+                                              yaml_config.get('table_secondary')),
             "schema_name": yaml_config["schema_name"],
             "table_cols": "null",  # name of the columns in the 2 tables queried
             "diff_table_cols": "null",  # name of the columns in the diff table
@@ -148,10 +299,38 @@ def build_arg_dict(args,
             "ignore_cols": args.ignore_cols or yaml_config.get('ignore_cols'),
             "initial_table_alias": yaml_config["initial_table_alias"],  # alias for 1st table
             "secondary_table_alias": yaml_config["secondary_table_alias"],  # alias for 2nd table
-            "except_rows": args.ex_rows},
+            "except_rows": args.ex_rows,
+            "except_file": args.ex_rows_file or yaml_config.get('except_file'),
+            "except_query": args.ex_rows_query or yaml_config.get('except_query')},
+        "pairs": get_pairs(yaml_config.get("pairs")),
         "system": {
             "local_db": args.local_db,
             "print_tables": args.print_tables,
+            "page_size": args.page_size,
+            "start_key": args.start_key,
+            "bisect": args.bisect,
+            "bisect_fanout": args.bisect_fanout,
+            "bisect_leaf_width": args.bisect_leaf_width,
+            "fast": args.fast,
+            "fast_promote": args.fast_promote,
+            "cache": args.cache,
+            "chunk_size": args.chunk_size,
+            "incremental": args.incremental,
+            "watermark_col": args.watermark_col,
+            "explain": args.explain or args.analyze,
+            "analyze": args.analyze,
+            "plan_file": args.plan_file,
+            "serve": args.serve,
+            "check": args.check,
+            "check_examples": args.check_examples,
+            "narrow": args.narrow,
+            "sample": args.sample,
+            "workers": args.workers,
+            "metadata_cache_dir": args.metadata_cache_dir,
+            "metadata_cache_ttl": args.metadata_cache_ttl,
+            "diff_target": args.diff_target,
+            "output_file": args.output_file,
+            "batch_size": args.batch_size,
             "col_type": col_type} }
     logging.info(f"[bold red]ARGUMENTS USED:[/]  {arg_dict}")
     return arg_dict
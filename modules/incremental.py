@@ -0,0 +1,210 @@
+#! usr/bin/env python
+
+""" incremental keeps a 'diff_table' up to date between runs without rebuilding it.
+    Alongside the diff table it stores a per-key row hash of both tables and the
+    state of the last run (the diff parameters and the highest watermark seen).
+    On the next run only the keys whose hash changed, whose watermark reached
+    that of the last run, or which disappeared are diffed again, and their rows
+    in the diff table are replaced in place. Keys holding a NULL never match, so
+    their rows are diffed again on every run.
+"""
+
+import hashlib
+import logging
+
+from modules import db_utils
+
+
+class IncrementalUpdater:
+    """Patches the diff table of a DiffWriter with the keys changed since the last run
+    """
+
+    def __init__(self, writer, clauses, watermark_col: str|None = None):
+        self.writer = writer
+        self.clauses = clauses
+        self.watermark_col = watermark_col
+        self.cur = writer.cur
+        self.key_cols = clauses.key_cols
+        self.key_list = ', '.join(self.key_cols)
+        self.sides = {
+            'initial': (writer._table_ref(writer.table_initial),
+                        writer._table_ref(f"{writer.table_diff}__hash_initial")),
+            'secondary': (writer._table_ref(writer.table_secondary),
+                          writer._table_ref(f"{writer.table_diff}__hash_secondary"))}
+        self.state_table = f"{writer.table_diff}__state"
+        self.changed_keys_table = writer.dialect.scratch_table('changed_keys', writer.table_diff)
+        self.state_ref = writer._table_ref(self.state_table)
+
+    def _get_params_hash(self) -> str:
+        """ Returns a fingerprint of the parameters that shape the stored hashes
+            and the diff table, a change of the excluded keys forces a rebuild
+        """
+        params = '|'.join([','.join(self.key_cols),
+                           ','.join(self.clauses.get_usable_cols()),
+                           self.watermark_col or ''])
+        if self.writer.except_keys:
+            params += '|' + self.writer.except_keys.get_fingerprint()
+        return hashlib.md5(params.encode('UTF-8')).hexdigest()
+
+    def _get_state(self) -> tuple|None:
+        db_facts = db_utils.DBFacts(self.writer.conn)
+        for table_name in (self.writer.table_diff, self.state_table,
+                           f"{self.writer.table_diff}__hash_initial",
+                           f"{self.writer.table_diff}__hash_secondary"):
+            if not db_facts.get_cols(self.writer.schema_name, self.writer.db_type, table_name):
+                return None
+        self.cur.execute(f"SELECT params_hash, initial_watermark, secondary_watermark FROM {self.state_ref}")
+        results = self.cur.fetchall()
+        if not results or results[0][0] != self._get_params_hash():
+            return None
+        return results[0]
+
+    def _get_watermarks(self) -> tuple:
+        if not self.watermark_col:
+            return None, None
+        watermarks = []
+        for table_ref, _ in self.sides.values():
+            self.cur.execute(f"SELECT MAX({self.watermark_col}) FROM {table_ref}")
+            watermarks.append(self.cur.fetchall()[0][0])
+        return tuple(watermarks)
+
+    def _write_state(self, watermarks: tuple):
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.state_ref}")
+        self.cur.execute(f"""
+                CREATE TABLE {self.state_ref} AS
+                SELECT '{self._get_params_hash()}' AS params_hash,
+                       {db_utils.sql_literal(watermarks[0])} AS initial_watermark,
+                       {db_utils.sql_literal(watermarks[1])} AS secondary_watermark
+                """)
+
+    def invalidate(self):
+        """ Drops the state of the last run, for a diff table rebuilt without it
+        """
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.state_ref}")
+        self.writer.conn.commit()
+
+    def _snapshot_hashes(self):
+        for table_ref, hash_ref in self.sides.values():
+            self.cur.execute(f"DROP TABLE IF EXISTS {hash_ref}")
+            self.cur.execute(f"""
+                    CREATE TABLE {hash_ref} AS
+                    SELECT {self.key_list}, {self.clauses.get_row_hash()} AS row_hash
+                    FROM {table_ref}
+                    """)
+            index_name = hash_ref.split('.')[-1] + '_key'
+            self.cur.execute(f"CREATE INDEX {index_name} ON {hash_ref} ({self.key_list})")
+
+    def _key_join(self, left: str, right: str) -> str:
+        return ' AND '.join([f"{left}.{key} = {right}.{key}" for key in self.key_cols])
+
+    def _key_in_changed(self, prefix: str = '') -> str:
+        keys = ', '.join([f"{prefix}{key}" for key in self.key_cols])
+        return f"({keys}) IN (SELECT {self.key_list} FROM {self.changed_keys_table})"
+
+    def _source_in_changed(self) -> str:
+        """ Returns a predicate matching the rows of a compared table to diff again:
+            those of a changed key, and those of a key holding a NULL, which never
+            match in the diff join nor in the changed keys table
+        """
+        null_keys = ' OR '.join([f"{key} IS NULL" for key in self.key_cols])
+        return f"{self._key_in_changed()} OR {null_keys}"
+
+    def _diff_in_changed(self) -> str:
+        """ Returns a predicate matching the diff table rows to replace: those of a
+            changed key on either side, and those of a key holding a NULL. The side
+            a row is missing from is all NULLs, so a NULL key shows as a side that
+            is only partly NULL, or, when every key column is NULL, as both sides
+            being NULL.
+        """
+        predicates = [self._key_in_changed(f"{self.writer.initial_table_alias}_"),
+                      self._key_in_changed(f"{self.writer.secondary_table_alias}_")]
+        all_null = []
+        for alias in (self.writer.initial_table_alias, self.writer.secondary_table_alias):
+            if len(self.key_cols) > 1:
+                any_null = ' OR '.join([f"{alias}_{key} IS NULL" for key in self.key_cols])
+                any_set = ' OR '.join([f"{alias}_{key} IS NOT NULL" for key in self.key_cols])
+                predicates.append(f"(({any_null}) AND ({any_set}))")
+            all_null += [f"{alias}_{key} IS NULL" for key in self.key_cols]
+        predicates.append(f"({' AND '.join(all_null)})")
+        return ' OR '.join(predicates)
+
+    def _collect_changed_keys(self, state: tuple):
+        """ Fills the changed keys table with every key whose row hash changed (or
+            whose watermark reached that of the last run) plus every key that was deleted
+        """
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.changed_keys_table}")
+        self.cur.execute(f"""
+                {self.writer.dialect.create_temp_table} {self.changed_keys_table} AS
+                SELECT {self.key_list} FROM {self.sides['initial'][0]} WHERE 1 = 0
+                """)
+        last_watermarks = {'initial': state[1], 'secondary': state[2]}
+        key = self.key_cols[0]
+        for side, (table_ref, hash_ref) in self.sides.items():
+            s_keys = ', '.join([f"s.{col}" for col in self.key_cols])
+            h_keys = ', '.join([f"h.{col}" for col in self.key_cols])
+            if self.watermark_col:
+                last_watermark = last_watermarks[side]
+                # rows written at the last watermark after it was read are diffed again
+                where = '1 = 1' if last_watermark is None else \
+                        f"{self.watermark_col} >= {db_utils.sql_literal(last_watermark)}"
+                changed_query = f"""
+                        INSERT INTO {self.changed_keys_table}
+                        SELECT DISTINCT {self.key_list} FROM {table_ref} WHERE {where}
+                        """
+            else:
+                changed_query = f"""
+                        INSERT INTO {self.changed_keys_table}
+                        SELECT DISTINCT {s_keys}
+                        FROM {table_ref} s
+                            LEFT OUTER JOIN {hash_ref} h
+                                ON {self._key_join('s', 'h')}
+                        WHERE h.{key} IS NULL
+                            OR h.row_hash <> {self.clauses.get_row_hash('s')}
+                        """
+            deleted_query = f"""
+                    INSERT INTO {self.changed_keys_table}
+                    SELECT DISTINCT {h_keys}
+                    FROM {hash_ref} h
+                        LEFT OUTER JOIN {table_ref} s
+                            ON {self._key_join('s', 'h')}
+                    WHERE s.{key} IS NULL
+                    """
+            self.cur.execute(changed_query)
+            self.cur.execute(deleted_query)
+
+    def _patch_diff_table(self):
+        # the hashes are taken before the diff rows, so a write landing in between
+        # shows as a change on the next run instead of being missed
+        for table_ref, hash_ref in self.sides.values():
+            self.cur.execute(f"DELETE FROM {hash_ref} WHERE {self._source_in_changed()}")
+            self.cur.execute(f"""
+                    INSERT INTO {hash_ref}
+                    SELECT {self.key_list}, {self.clauses.get_row_hash()}
+                    FROM {table_ref}
+                    WHERE {self._source_in_changed()}
+                    """)
+
+        diff_ref = self.writer._table_ref(self.writer.table_diff)
+        self.cur.execute(f"DELETE FROM {diff_ref} WHERE {self._diff_in_changed()}")
+        self.cur.execute(self.writer._assemble_insert_query(self.clauses, self._source_in_changed()))
+
+    def update(self):
+        state = self._get_state()
+        watermarks = self._get_watermarks()
+        if state is None:
+            logging.info("[bold red]No usable incremental state, building full diff table[/]")
+            # as when patching, the hashes are taken before the diff table is built
+            self._snapshot_hashes()
+            self.writer._build_diff_table(self.clauses)
+        else:
+            try:
+                self._collect_changed_keys(state)
+                self.cur.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT {self.key_list} "
+                                 f"FROM {self.changed_keys_table}) changed_keys")
+                logging.info(f"[bold red]Changed keys since last run:[/] {self.cur.fetchall()[0][0]}")
+                self._patch_diff_table()
+            finally:
+                self.cur.execute(f"DROP TABLE IF EXISTS {self.changed_keys_table}")
+            print('Diff Table Updated')
+        self._write_state(watermarks)
+        self.writer.conn.commit()
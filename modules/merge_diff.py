@@ -0,0 +1,379 @@
+#! usr/bin/env python
+
+""" merge_diff builds the 'diff_table' rows when the two tables being compared
+    live behind different connections (ex.: Postgres against a SQLite snapshot)
+    and therefore cannot be joined inside one database.
+    Both tables are read in key order in fixed size batches and merged in Python,
+    so memory use stays constant regardless of table size.
+    Text keys are ordered by code point on both sides, the order Python merges
+    them in, and keys and compared values are normalized per column type first,
+    since the two drivers can hand back the same value as different Python types
+    (ex.: Decimal against float, or a datetime against SQLite text).
+"""
+
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+
+from modules import db_utils
+from modules.create_diff_table import MASK_WIDTH, QueryClauses
+from modules.diff_sinks import TableSink, get_file_sink
+from modules.exclusions import ExceptKeys
+
+TEXT_TYPES = ('char', 'text', 'string', 'clob')
+NUMERIC_TYPES = ('int', 'numeric', 'decimal', 'real', 'float', 'double', 'number')
+TEMPORAL_TYPES = ('date', 'time')
+
+
+def _normalize_number(value):
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        try:
+            return Decimal(str(value))
+        except InvalidOperation:
+            return value
+    return value
+
+
+def _normalize_temporal(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            try:
+                return time.fromisoformat(value)
+            except ValueError:
+                return value
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, time())
+    return value
+
+
+def get_normalizer(*col_types: str):
+    """ Returns the function bringing the values of a column to one Python type,
+        judged from its type in both tables, None when they compare as they are
+    """
+    col_types = [col_type.lower() for col_type in col_types]
+    if any(col_type.startswith(TEMPORAL_TYPES) for col_type in col_types):
+        return _normalize_temporal
+    if any(col_type.startswith('interval') for col_type in col_types):
+        return None
+    if any(kind in col_type for col_type in col_types for kind in NUMERIC_TYPES):
+        return _normalize_number
+    return None
+
+
+class MergeDiffer:
+    """Streams both tables in key order and merge-joins them into a sink.
+    The rows produced match those of DiffWriter: every key and compared column
+    appears twice, once for each table alias, with NULLs for a missing side.
+    """
+
+    def __init__(self, args, initial_conn, secondary_conn):
+        self.args = args
+        self.initial_conn = initial_conn
+        self.secondary_conn = secondary_conn
+        self.initial_db_type = self.args["database"]["db_type"]
+        self.secondary_db_type = self.args["secondary_database"]["db_type"]
+        self.table_initial = self.args["table_info"]["table_initial"]
+        self.table_secondary = self.args["table_info"]["table_secondary"]
+        self.table_diff = self.args["table_info"]["table_diff"]
+        self.schema_name = self.args["table_info"]["schema_name"]
+        self.secondary_schema_name = self.args["secondary_database"]["schema_name"]
+        self.key_cols = self.args["table_info"]["key_cols"]
+        self.compare_cols = self.args["table_info"]["comp_cols"] or []
+        self.ignore_cols = self.args["table_info"]["ignore_cols"] or []
+        self.initial_table_alias = self.args["table_info"]["initial_table_alias"]
+        self.secondary_table_alias = self.args["table_info"]["secondary_table_alias"]
+        self.diff_target = self.args["system"]["diff_target"]
+        self.output_file = self.args["system"]["output_file"]
+        self.batch_size = self.args["system"]["batch_size"]
+        # rows streamed from each table, by cursor name
+        self.streamed_cnts = {}
+
+    def _get_clauses(self):
+        cache_dir = self.args["system"].get("metadata_cache_dir")
+        cache_ttl = self.args["system"].get("metadata_cache_ttl") or 0
+        initial_col_types = db_utils.DBFacts(self.initial_conn, cache_dir, cache_ttl).get_col_types(
+                self.schema_name, self.initial_db_type, self.table_initial)
+        secondary_col_types = db_utils.DBFacts(self.secondary_conn, cache_dir, cache_ttl).get_col_types(
+                self.secondary_schema_name, self.secondary_db_type, self.table_secondary)
+        self.initial_col_types = initial_col_types
+        self.secondary_col_types = secondary_col_types
+        common_table_cols = db_utils.get_common_cols(list(initial_col_types),
+                                                     list(secondary_col_types))
+
+        clauses = QueryClauses(
+                table_cols = common_table_cols,
+                key_cols = self.key_cols,
+                compare_cols = self.compare_cols,
+                ignore_cols = self.ignore_cols,
+                initial_table_alias = self.initial_table_alias,
+                secondary_table_alias = self.secondary_table_alias)
+        return clauses
+
+    def _get_key_normalizer(self, key: str):
+        """ Returns the normalizer of a key column, None when both sides come from
+            the same driver with the same declared type and so compare as they are
+        """
+        initial_type = self.initial_col_types.get(key, '')
+        secondary_type = self.secondary_col_types.get(key, '')
+        if self.initial_db_type == self.secondary_db_type and initial_type.lower() == secondary_type.lower():
+            return None
+        return get_normalizer(initial_type, secondary_type)
+
+    def _get_except_keys(self) -> tuple[set, list]:
+        """ Returns the excluded keys and the functions bringing a key to the form
+            they are kept in. The rows cannot be anti-joined across connections,
+            so the merge skips them instead. --ex-rows-query runs on the initial
+            connection, as it does for a single database diff.
+        """
+        except_keys = ExceptKeys(self.initial_db_type,
+                                 self.key_cols,
+                                 except_rows=self.args["table_info"].get("except_rows"),
+                                 except_file=self.args["table_info"].get("except_file"),
+                                 except_query=self.args["table_info"].get("except_query"))
+        if not except_keys:
+            return set(), []
+        # keys given as text only compare to the streamed values in one form
+        normalizers = [get_normalizer(self.initial_col_types.get(key, ''), self.secondary_col_types.get(key, ''))
+                       or str for key in self.key_cols]
+        keys = list(except_keys.get_keys())
+        if except_keys.except_query:
+            cur = self.initial_conn.cursor()
+            cur.execute(except_keys.except_query)
+            keys += cur.fetchall()
+            cur.close()
+        keys = {tuple(value if value is None else normalize(value) for normalize, value in zip(normalizers, key))
+                for key in keys}
+        logging.info(f"[bold red]Excluded keys loaded:[/] {len(keys)}")
+        return keys, normalizers
+
+    def _skip_except_keys(self, rows, except_keys: set, normalizers: list):
+        """ Yields the (key, row) pairs of rows whose key is not excluded
+        """
+        key_cnt = len(self.key_cols)
+        for key, row in rows:
+            if tuple(value if value is None else normalize(value)
+                     for normalize, value in zip(normalizers, row[:key_cnt])) not in except_keys:
+                yield key, row
+
+    def _get_diff_cols(self, clauses) -> list[str]:
+        diff_cols = []
+        for col in self.key_cols + clauses.get_usable_cols():
+            diff_cols.append(f"{self.initial_table_alias}_{col}")
+            diff_cols.append(f"{self.secondary_table_alias}_{col}")
+        return diff_cols + ['change_type'] + clauses.get_mask_cols()
+
+    def _get_sink(self, clauses):
+        diff_cols = self._get_diff_cols(clauses)
+        if self.diff_target == 'file':
+            if not self.output_file:
+                raise ValueError('diff_target of file requires an output_file')
+            return get_file_sink(self.output_file, diff_cols, self.batch_size)
+
+        # the diff columns take their types from the target database's own table,
+        # types of the other database may not exist there
+        target_col_types = self.secondary_col_types if self.diff_target == 'secondary' else self.initial_col_types
+        col_types = []
+        for col in self.key_cols + clauses.get_usable_cols():
+            col_types.extend([target_col_types[col]] * 2)
+        col_types.append('VARCHAR')
+        col_types.extend(['BIGINT'] * len(clauses.get_mask_cols()))
+        if self.diff_target == 'secondary':
+            return TableSink(self.secondary_conn,
+                             self.secondary_db_type,
+                             db_utils.table_ref(self.secondary_db_type,
+                                                self.secondary_schema_name,
+                                                self.table_diff),
+                             diff_cols,
+                             col_types)
+        return TableSink(self.initial_conn,
+                         self.initial_db_type,
+                         db_utils.table_ref(self.initial_db_type,
+                                            self.schema_name,
+                                            self.table_diff),
+                         diff_cols,
+                         col_types)
+
+    def _stream_rows(self,
+                     conn,
+                     db_type: str,
+                     table_ref: str,
+                     cols: list[str],
+                     col_types: dict[str, str],
+                     cursor_name: str,
+                     key_normalizers: list|None = None):
+        """ Yields the (normalized key, row) pairs of a table in key order, fetched
+            batch_size rows at a time. Raises ValueError if the database hands back
+            keys out of order, which happens when a key column sorts differently
+            from its Python values. Rows with a NULL key come in wherever the
+            database sorts NULLs.
+        """
+        dialect = db_utils.get_dialect(db_type)
+        order_terms = []
+        for key in self.key_cols:
+            if any(kind in col_types.get(key, '').lower() for kind in TEXT_TYPES):
+                order_terms.append(dialect.binary_order(key))
+            else:
+                order_terms.append(key)
+        query = f"""SELECT {', '.join(cols)} FROM {table_ref} ORDER BY {', '.join(order_terms)}"""
+        logging.debug(f"[bold red] Stream Query[/]: {query}")
+
+        cur = db_utils.get_stream_cursor(conn, db_type, cursor_name, self.batch_size)
+        cur.execute(query)
+        key_cnt = len(self.key_cols)
+        key_normalizers = key_normalizers or [None] * key_cnt
+        prior_key = None
+        self.streamed_cnts[cursor_name] = 0
+        while True:
+            rows = cur.fetchmany(self.batch_size)
+            if not rows:
+                break
+            self.streamed_cnts[cursor_name] += len(rows)
+            for row in rows:
+                key = tuple(value if normalize is None or value is None else normalize(value)
+                            for normalize, value in zip(key_normalizers, row[:key_cnt]))
+                if None in key:
+                    yield key, row
+                    continue
+                if prior_key is not None and key < prior_key:
+                    raise ValueError(f'{table_ref} returned key {key} after {prior_key}, '
+                                     'key columns must sort identically on both connections')
+                prior_key = key
+                yield key, row
+        cur.close()
+
+    def _merge_rows(self, initial_rows, secondary_rows, col_cnt: int, normalizers: list|None = None):
+        """ Yields diff rows from two key ordered row streams. A row with a NULL
+            key matches nothing, so it goes straight out as added or removed
+            without taking part in the ordered merge.
+        """
+        empty_row = (None,) * col_cnt
+        key_cnt = len(self.key_cols)
+        mask_cnt = -(-(col_cnt - key_cnt) // MASK_WIDTH)
+        normalizers = normalizers or [None] * (col_cnt - key_cnt)
+
+        def differ(position, initial_value, secondary_value):
+            if initial_value == secondary_value:
+                return False
+            normalize = normalizers[position]
+            if normalize is None or initial_value is None or secondary_value is None:
+                return True
+            return normalize(initial_value) != normalize(secondary_value)
+
+        def interleave(initial_row, secondary_row):
+            diff_row = tuple(value for pair in zip(initial_row, secondary_row) for value in pair)
+            masks = [0] * mask_cnt
+            if initial_row is empty_row:
+                change_type = 'added'
+            elif secondary_row is empty_row:
+                change_type = 'removed'
+            else:
+                for position in range(col_cnt - key_cnt):
+                    if differ(position, initial_row[key_cnt + position], secondary_row[key_cnt + position]):
+                        masks[position // MASK_WIDTH] |= 1 << (position % MASK_WIDTH)
+                if not any(masks):
+                    return None
+                change_type = 'modified'
+            return diff_row + (change_type,) + tuple(masks)
+
+        def precedes(key, other_key):
+            try:
+                return key < other_key
+            except TypeError:
+                raise ValueError(f'keys {key} and {other_key} cannot be compared, key columns '
+                                 'must have compatible types on both connections') from None
+
+        def next_row(rows, unmatched):
+            for key, row in rows:
+                if None not in key:
+                    return key, row
+                unmatched.append(row)
+            return None, None
+
+        def unmatched_rows():
+            for row in initial_nulls:
+                yield interleave(row, empty_row)
+            for row in secondary_nulls:
+                yield interleave(empty_row, row)
+            initial_nulls.clear()
+            secondary_nulls.clear()
+
+        initial_nulls = []
+        secondary_nulls = []
+        initial_key, initial_row = next_row(initial_rows, initial_nulls)
+        secondary_key, secondary_row = next_row(secondary_rows, secondary_nulls)
+        while initial_row is not None or secondary_row is not None:
+            yield from unmatched_rows()
+            if secondary_row is None or (initial_row is not None and precedes(initial_key, secondary_key)):
+                yield interleave(initial_row, empty_row)
+                initial_key, initial_row = next_row(initial_rows, initial_nulls)
+            elif initial_row is None or precedes(secondary_key, initial_key):
+                yield interleave(empty_row, secondary_row)
+                secondary_key, secondary_row = next_row(secondary_rows, secondary_nulls)
+            else:
+                diff_row = interleave(initial_row, secondary_row)
+                if diff_row is not None:    # rows identical in both tables are not written
+                    yield diff_row
+                initial_key, initial_row = next_row(initial_rows, initial_nulls)
+                secondary_key, secondary_row = next_row(secondary_rows, secondary_nulls)
+        yield from unmatched_rows()
+
+    def get_row_cnts(self) -> tuple[int, int]:
+        """ Returns the row counts of the initial and secondary tables, read off
+            the streams of the last diff, since the report connection may hold
+            neither table
+        """
+        return self.streamed_cnts['table_differ_initial'], self.streamed_cnts['table_differ_secondary']
+
+    def create_diff_table(self):
+        clauses = self._get_clauses()
+        cols = self.key_cols + clauses.get_usable_cols()
+        key_normalizers = [self._get_key_normalizer(key) for key in self.key_cols]
+
+        initial_rows = self._stream_rows(self.initial_conn,
+                                         self.initial_db_type,
+                                         db_utils.table_ref(self.initial_db_type,
+                                                            self.schema_name,
+                                                            self.table_initial),
+                                         cols,
+                                         self.initial_col_types,
+                                         'table_differ_initial',
+                                         key_normalizers)
+        secondary_rows = self._stream_rows(self.secondary_conn,
+                                           self.secondary_db_type,
+                                           db_utils.table_ref(self.secondary_db_type,
+                                                              self.secondary_schema_name,
+                                                              self.table_secondary),
+                                           cols,
+                                           self.secondary_col_types,
+                                           'table_differ_secondary',
+                                           key_normalizers)
+
+        except_keys, except_normalizers = self._get_except_keys()
+        if except_keys:
+            initial_rows = self._skip_except_keys(initial_rows, except_keys, except_normalizers)
+            secondary_rows = self._skip_except_keys(secondary_rows, except_keys, except_normalizers)
+
+        normalizers = [get_normalizer(self.initial_col_types.get(col, ''), self.secondary_col_types.get(col, ''))
+                       for col in clauses.get_usable_cols()]
+
+        sink = self._get_sink(clauses)
+        sink.open()
+        try:
+            batch = []
+            for diff_row in self._merge_rows(initial_rows, secondary_rows, len(cols), normalizers):
+                batch.append(diff_row)
+                if len(batch) >= self.batch_size:
+                    sink.write_rows(batch)
+                    batch = []
+            if batch:
+                sink.write_rows(batch)
+        except Exception:
+            # the rows a table sink wrote are undone rather than committed by its close
+            self.initial_conn.rollback()
+            self.secondary_conn.rollback()
+            raise
+        finally:
+            sink.close()
+        print('Diff Table Created')
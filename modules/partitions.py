@@ -0,0 +1,88 @@
+#! usr/bin/env python
+
+""" partitions splits the key space of the tables being compared into ranges
+    holding roughly the same number of rows, so that each range can be diffed
+    on its own connection. Boundaries come from the planner histograms in
+    pg_stats when Postgres has them, and from quantile queries otherwise.
+"""
+
+import logging
+
+from modules import db_utils
+
+
+class KeyPartitioner:
+    """Returns balanced boundaries of the leading key column and the predicates
+    that select each partition between them
+    """
+
+    def __init__(self,
+                 cur,
+                 db_type: str,
+                 schema_name: str,
+                 table_name: str,
+                 key_col: str):
+
+        self.cur = cur
+        self.db_type = db_type
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.key_col = key_col
+        self.table_ref = db_utils.table_ref(db_type, schema_name, table_name)
+        self.dialect = db_utils.get_dialect(db_type)
+
+    def _get_quantile_bounds(self, partition_cnt: int) -> list:
+        bounds = self.dialect.quantile_bounds(self.cur, self.table_ref, self.key_col, partition_cnt)
+        if bounds is not None:
+            return bounds
+
+        self.cur.execute(f"SELECT COUNT(*) FROM {self.table_ref}")
+        row_cnt = self.cur.fetchall()[0][0]
+        bounds = []
+        for num in range(1, partition_cnt):
+            query = f"""
+                    SELECT {self.key_col}
+                    FROM {self.table_ref}
+                    WHERE {self.key_col} IS NOT NULL
+                    ORDER BY {self.key_col}
+                    LIMIT 1 OFFSET {row_cnt * num // partition_cnt}
+                    """
+            self.cur.execute(query)
+            results = self.cur.fetchall()
+            if results:
+                bounds.append(results[0][0])
+        return bounds
+
+    def get_bounds(self, partition_cnt: int) -> list:
+        """ Returns up to partition_cnt - 1 sorted, distinct boundary keys
+        """
+        if partition_cnt < 2:
+            return []
+
+        histogram = self.dialect.histogram_bounds(self.cur, self.schema_name, self.table_name, self.key_col)
+        if histogram:
+            step = len(histogram) / partition_cnt
+            bounds = [histogram[int(num * step)] for num in range(1, partition_cnt)]
+            logging.info(f"[bold red]Partition bounds from the planner histogram:[/] {bounds}")
+        else:
+            bounds = self._get_quantile_bounds(partition_cnt)
+            logging.info(f"[bold red]Partition bounds from quantiles:[/] {bounds}")
+
+        distinct_bounds = []
+        for bound in bounds:
+            if bound not in distinct_bounds:
+                distinct_bounds.append(bound)
+        return distinct_bounds
+
+    def get_predicates(self, bounds: list) -> list[str]:
+        """ Returns one predicate per partition. Rows with a NULL key are
+            assigned to the first partition so that none are lost.
+        """
+        if not bounds:
+            return ["1 = 1"]
+        literals = [db_utils.sql_literal(bound) for bound in bounds]
+        predicates = [f"({self.key_col} < {literals[0]} OR {self.key_col} IS NULL)"]
+        for low, high in zip(literals, literals[1:]):
+            predicates.append(f"{self.key_col} >= {low} AND {self.key_col} < {high}")
+        predicates.append(f"{self.key_col} >= {literals[-1]}")
+        return predicates
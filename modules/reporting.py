@@ -3,22 +3,35 @@
 """ reporting handles all aspects of the various reports
     that Table Differ runs both on the 'diff_table' but also
     on the two tables being compared. Due to the potential size
-    of the two tables, reports done on those are kept to a minimum.
+    of the two tables, reports done on those are kept to a minimum:
+    every count is taken in a single pass over the 'diff_table', and
+    row counts of the two tables come from catalog statistics when the
+    database keeps them. When the 'diff_table' was built from a sample of
+    keys the counts are extrapolated to the full tables with a 95%
+    confidence interval.
 """
 
 import logging
+import math
 
 from rich.prompt import Prompt
 from rich.console import Console
 from rich.table import Table
 
+from modules import db_utils
+from modules.create_diff_table import MASK_WIDTH
+
+Z_95 = 1.96
+
 
 class BasicReport:
-        """Types of simple reporting this needs to return:
-        - counts of rows in origin, comp, and diff, tables
-        - counts of identical rows
-        - counts of modified rows
-        """
+    """Types of simple reporting this needs to return:
+    - counts of rows in origin, comp, and diff, tables
+    - counts of rows only within the initial or secondary table
+    - counts of identical rows
+    - counts of modified rows
+    - counts of changes within each compared column
+    """
 
     def __init__(self,
                 conn,
@@ -27,7 +40,14 @@ class BasicReport:
                 table_secondary: str,
                 table_diff: str,
                 compare_cols: list[str],
-                ignore_cols: list[str]):
+                ignore_cols: list[str],
+                key_cols: list[str]|None = None,
+                initial_table_alias: str = 'initial',
+                secondary_table_alias: str = 'secondary',
+                db_type: str = 'sqlite',
+                sample_pct: float|None = None,
+                sample_predicate: str|None = None,
+                row_cnts: tuple[int, int]|None = None):
 
         self.conn = conn
         self.schema_name = schema_name
@@ -36,63 +56,168 @@ class BasicReport:
         self.table_diff = table_diff
         self.compare_cols = compare_cols
         self.ignore_cols = ignore_cols
+        self.key_cols = key_cols or []
+        self.initial_table_alias = initial_table_alias
+        self.secondary_table_alias = secondary_table_alias
+        self.db_type = db_type
+        self.sample_pct = sample_pct
+        self.sample_predicate = sample_predicate
+        # exact (initial, secondary) row counts taken while building the diff
+        # table, for when the compared tables are not on conn
+        self.row_cnts = row_cnts
+        self.results = {}
+
+
+    def generate_report(self):
+        self.get_counts()
+        self.write_report()
+
+
+    def _get_report_cols(self) -> list[str]:
+        """ Returns the compared (non-key) columns found in the diff table, in
+            the order of its columns: the order the changed-column mask bits were
+            assigned in, whatever case the database stored the names in
+        """
+        diff_cols = db_utils.DBFacts(self.conn).get_cols(self.schema_name,
+                                                         self.db_type,
+                                                         self.table_diff)
+        initial_prefix = f"{self.initial_table_alias}_"
+        secondary_prefix = f"{self.secondary_table_alias}_"
+        initial_cols = [col[len(initial_prefix):] for col in diff_cols if col.startswith(initial_prefix)]
+        paired_cols = [col for col in initial_cols if f"{secondary_prefix}{col}" in diff_cols]
+        # the key columns lead the diff table
+        return paired_cols[len(self.key_cols):]
+
+
+    def _assemble_counts_query(self) -> str:
+        """ Returns the query that takes every diff_table count, including the
+            per-column change counts held in the changed-column bitmasks, in one scan
+        """
+        column_cnts = ''
+        for position, col in enumerate(self._get_report_cols()):
+            mask_col = f"changed_mask_{position // MASK_WIDTH}"
+            bit = 1 << (position % MASK_WIDTH)
+            column_cnts += f",\n                       SUM(CASE WHEN ({mask_col} & {bit}) <> 0 THEN 1 ELSE 0 END)"
+        query = f"""
+                SELECT COUNT(*),
+                       SUM(CASE WHEN change_type = 'removed' THEN 1 ELSE 0 END),
+                       SUM(CASE WHEN change_type = 'added' THEN 1 ELSE 0 END),
+                       SUM(CASE WHEN change_type = 'modified' THEN 1 ELSE 0 END){column_cnts}
+                FROM {db_utils.table_ref(self.db_type, self.schema_name, self.table_diff)}
+                """
+        return query
+
+
+    def get_queries(self) -> dict[str, str]:
+        return {'counts': self._assemble_counts_query()}
+
+
+    def _get_interval(self, sampled_cnt: int, fraction: float) -> tuple[int, int]:
+        """ Returns the 95% confidence interval of a count extrapolated from a sample
+            in which every key was kept with probability fraction. An empty sample
+            still bounds the count from above (rule of three).
+        """
+        estimate = sampled_cnt / fraction
+        if sampled_cnt == 0:
+            return 0, math.ceil(3 * (1 - fraction) / fraction)
+        margin = Z_95 * math.sqrt(sampled_cnt * (1 - fraction)) / fraction
+        return max(math.floor(estimate - margin), sampled_cnt), math.ceil(estimate + margin)
 
 
-        def generate_report(self):
-            self.get_counts()
-            self.write_report()
-
-
-        def get_counts(self):
-            def count_rows():
-                query = f"""SELECT COUNT(*) FROM {self.schema_name}.{self.table_initial}"""
-                cur = self.conn.cursor()
-                cur.execute(query)
-                self.initial_table_row_cnt = cur.fetchall()[0][0]
-
-        def count_same_rows():
-            comp_string = ""
-            for num, col in enumerate(self.compare_cols):
-                if num == 0:
-                    comp_string += f"A.{col} = B.{col}"
-                else:
-                    comp_string += f" AND A.{col} = B.{col}"
-
-            query = f""" SELECT COUNT(*)
-                         FROM (SELECT *
-                            FROM {self.schema_name}.{self.table_initial} A
-                           INNER JOIN {self.schema_name}.{self.table_secondary} B
-                              ON {comp_string})
-                          """
-            cur = self.conn.cursor()
-            cur.execute(query)
-            self.row_match_cnt = cur.fetchall()[0][0]
-
-    def count_modified_rows():
-        query = f""" SELECT COUNT(*)
-                     FROM (SELECT *
-                            FROM {self.schema_name}.{self.table_initial}
-                            EXCEPT
-                            SELECT *
-                                FROM {self.schema_name}.{self.table_secondary})
-                    """
+    def _get_initial_cnt(self, cur, initial_estimate: int|None) -> int:
+        """ Returns the number of initial table rows the diff table was built from:
+            as counted during the build, taken from catalog stats, or counted
+            if there are none
+        """
+        if self.row_cnts is not None:
+            return self.row_cnts[0]
+        if initial_estimate is not None:
+            return initial_estimate
+        initial_ref = db_utils.table_ref(self.db_type, self.schema_name, self.table_initial)
+        if self.sample_predicate:
+            # only the sampled keys need counting, the full count is extrapolated below
+            cur.execute(f"SELECT COUNT(*) FROM {initial_ref} WHERE {self.sample_predicate}")
+            return round(cur.fetchall()[0][0] * 100 / self.sample_pct)
+        cur.execute(f"SELECT COUNT(*) FROM {initial_ref}")
+        return cur.fetchall()[0][0]
+
+
+    def get_counts(self):
+        query = self._assemble_counts_query()
+        logging.debug(f"[bold red] Report Query[/]: {query}")
         cur = self.conn.cursor()
         cur.execute(query)
-        self.row_diff_cnt = cur.fetchall()[0][0]
-
-    count_rows()
-    count_same_rows()
-    count_modified_rows()
-    self.conn.commit()
-
-
-def write_report(self):
-    report_table = Table(title="Basic Report")
-    report_table.add_column("report", style="red", no_wrap=True)
-    report_table.add_column("measure", style="magenta", no_wrap=True)
-    report_table.add_column("result", style="cyan", no_wrap=True)
-    report_table.add_row('Diff Table Build', 'initial table row count', str(self.initial_table_row_cnt))
-    report_table.add_row('Diff Table Build', 'row match count', str(self.row_match_cnt))
-    report_table.add_row('Diff Table Build', 'row diff count', str(self.row_diff_cnt))
-    console = Console()    # rich text output formatting for CLI tables
-    console.print(report_table)
+        counts = [cnt or 0 for cnt in cur.fetchall()[0]]
+        diff_cnt, only_initial_cnt, only_secondary_cnt, modified_cnt = counts[:4]
+        column_change_cnts = dict(zip(self._get_report_cols(), counts[4:]))
+
+        initial_estimate, secondary_estimate = None, None
+        if self.row_cnts is None:
+            db_facts = db_utils.DBFacts(self.conn)
+            initial_estimate = db_facts.get_row_estimate(self.schema_name, self.db_type, self.table_initial)
+            secondary_estimate = db_facts.get_row_estimate(self.schema_name, self.db_type, self.table_secondary)
+
+        intervals = {}
+        if self.sample_pct:
+            fraction = self.sample_pct / 100
+            sampled_cnts = {'diff_table_row_cnt': diff_cnt,
+                            'only_initial_row_cnt': only_initial_cnt,
+                            'only_secondary_row_cnt': only_secondary_cnt,
+                            'modified_row_cnt': modified_cnt}
+            intervals = {name: self._get_interval(cnt, fraction) for name, cnt in sampled_cnts.items()}
+            diff_cnt, only_initial_cnt, only_secondary_cnt, modified_cnt = \
+                [round(cnt / fraction) for cnt in sampled_cnts.values()]
+            column_change_cnts = {col: round(cnt / fraction) for col, cnt in column_change_cnts.items()}
+
+        # the diff table only holds rows that differ, so the identical rows are whatever
+        # is left of the initial table
+        # reltuples stays 0 until a Postgres table is first vacuumed or analyzed, so
+        # an estimate of no rows is no reason to skip the count
+        usable_estimate = initial_estimate if initial_estimate and initial_estimate > 0 else None
+        initial_cnt = self._get_initial_cnt(cur, usable_estimate)
+        unchanged_cnt = max(initial_cnt - only_initial_cnt - modified_cnt, 0)
+
+        self.results = {
+            'diff_table_row_cnt': diff_cnt,
+            'only_initial_row_cnt': only_initial_cnt,
+            'only_secondary_row_cnt': only_secondary_cnt,
+            'modified_row_cnt': modified_cnt,
+            'unchanged_row_cnt': unchanged_cnt,
+            'unchanged_row_cnt_estimated': usable_estimate is not None or bool(self.sample_pct),
+            'sample_pct': self.sample_pct,
+            'confidence_intervals': intervals,
+            'initial_table_row_cnt': only_initial_cnt + modified_cnt + unchanged_cnt,
+            'secondary_table_row_cnt': only_secondary_cnt + modified_cnt + unchanged_cnt,
+            'column_change_cnts': column_change_cnts,
+            'initial_table_row_estimate': initial_estimate,
+            'secondary_table_row_estimate': secondary_estimate}
+        self.conn.commit()
+
+
+    def write_report(self):
+        title = f"Basic Report ({self.sample_pct}% sample, extrapolated)" if self.sample_pct else "Basic Report"
+        report_table = Table(title=title)
+        report_table.add_column("report", style="red", no_wrap=True)
+        report_table.add_column("measure", style="magenta", no_wrap=True)
+        report_table.add_column("result", style="cyan", no_wrap=True)
+        # the table row counts are derived from the row match count, estimated or not
+        estimated = ' (estimated)' if self.results['unchanged_row_cnt_estimated'] else ''
+        report_table.add_row('Diff Table Build', f'initial table row count{estimated}',
+                             str(self.results['initial_table_row_cnt']))
+        report_table.add_row('Diff Table Build', f'secondary table row count{estimated}',
+                             str(self.results['secondary_table_row_cnt']))
+        if self.results['initial_table_row_estimate'] is not None:
+            report_table.add_row('Catalog Stats', 'initial table row estimate', str(self.results['initial_table_row_estimate']))
+        if self.results['secondary_table_row_estimate'] is not None:
+            report_table.add_row('Catalog Stats', 'secondary table row estimate', str(self.results['secondary_table_row_estimate']))
+        report_table.add_row('Diff Table Build', 'diff table row count', str(self.results['diff_table_row_cnt']))
+        report_table.add_row('Diff Table Build', 'rows only in initial', str(self.results['only_initial_row_cnt']))
+        report_table.add_row('Diff Table Build', 'rows only in secondary', str(self.results['only_secondary_row_cnt']))
+        report_table.add_row('Diff Table Build', f'row match count{estimated}', str(self.results['unchanged_row_cnt']))
+        report_table.add_row('Diff Table Build', 'row diff count', str(self.results['modified_row_cnt']))
+        for name, (low, high) in self.results['confidence_intervals'].items():
+            report_table.add_row('Sample 95% Interval', name, f'{low} - {high}')
+        for col, change_cnt in self.results['column_change_cnts'].items():
+            report_table.add_row('Column Changes', col, str(change_cnt))
+        console = Console()    # rich text output formatting for CLI tables
+        console.print(report_table)
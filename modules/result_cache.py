@@ -0,0 +1,86 @@
+#! usr/bin/env python
+
+""" result_cache skips rebuilding a 'diff_table' that is already up to date.
+    Each run fingerprints both compared tables, cheaply and per backend, along
+    with every diff parameter (key, compared and ignored columns, exclusions,
+    sample). The fingerprint and the Basic Report counts of the run are stored
+    next to the diff table. When the next run computes the same fingerprint
+    and the diff table is still there, the table and its report are reused.
+"""
+
+import hashlib
+import json
+import logging
+
+from modules import db_utils
+
+
+class ResultCache:
+    """Looks up and stores the report of a DiffWriter's diff table by fingerprint
+    """
+
+    def __init__(self, writer, clauses):
+        self.writer = writer
+        self.clauses = clauses
+        self.cur = writer.cur
+        self.cache_table = f"{writer.table_diff}__cache"
+        self.cache_ref = writer._table_ref(self.cache_table)
+        self.fingerprint = None
+
+    def _get_table_fingerprint(self, table_name: str) -> str:
+        return self.writer.dialect.data_fingerprint(self.cur,
+                                                    self.writer.schema_name,
+                                                    table_name,
+                                                    self.writer._table_ref(table_name),
+                                                    self.clauses.get_checksum())
+
+    def get_fingerprint(self) -> str:
+        """ Returns a digest of the diff parameters and of the data of both tables,
+            computed once per run, before the diff table is built
+        """
+        if self.fingerprint is None:
+            params = [self.writer.table_initial,
+                      self.writer.table_secondary,
+                      ','.join(self.clauses.key_cols),
+                      ','.join(self.clauses.get_usable_cols()),
+                      self.writer.initial_table_alias,
+                      self.writer.secondary_table_alias,
+                      str(self.writer.sample_pct or ''),
+                      self.writer.except_keys.get_fingerprint() if self.writer.except_keys else '',
+                      self._get_table_fingerprint(self.writer.table_initial),
+                      self._get_table_fingerprint(self.writer.table_secondary)]
+            self.fingerprint = hashlib.md5('|'.join(params).encode('UTF-8')).hexdigest()
+        return self.fingerprint
+
+    def lookup(self) -> dict|None:
+        """ Returns the stored report of the diff table when it was built from
+            the same parameters and data, None when it has to be rebuilt. The
+            fingerprint is taken first in either case: stored after the build, it
+            has to describe the data the build read, not a later state.
+        """
+        fingerprint = self.get_fingerprint()
+        db_facts = db_utils.DBFacts(self.writer.conn)
+        for table_name in (self.writer.table_diff, self.cache_table):
+            if not db_facts.get_cols(self.writer.schema_name, self.writer.db_type, table_name):
+                return None
+        self.cur.execute(f"SELECT fingerprint, results FROM {self.cache_ref}")
+        results = self.cur.fetchall()
+        self.writer.conn.commit()
+        if not results or results[0][0] != fingerprint:
+            logging.info("[bold red]Tables or parameters changed since the cached diff, rebuilding[/]")
+            return None
+        return json.loads(results[0][1])
+
+    def store(self, results: dict):
+        """ Saves the report of the diff table built under the current fingerprint
+        """
+        marker = db_utils.param_marker(self.writer.db_type)
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.cache_ref}")
+        self.cur.execute(f"CREATE TABLE {self.cache_ref} (fingerprint VARCHAR(32), results TEXT)")
+        self.cur.execute(f"INSERT INTO {self.cache_ref} VALUES ({marker}, {marker})",
+                         (self.get_fingerprint(), json.dumps(results, default=str)))
+        self.writer.conn.commit()
+
+    def invalidate(self):
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.cache_ref}")
+        self.writer.conn.commit()
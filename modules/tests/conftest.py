@@ -0,0 +1,90 @@
+#!/bin/env python
+
+""" Fixtures shared by the test modules: the args of a diff of tab_initial and
+    tab_secondary in an SQLite database, and the two tables themselves
+"""
+
+import sqlite3
+
+import pytest
+
+from modules.reporting import BasicReport
+
+TABLE_COLS = "id INT, name VARCHAR, amount INT, note VARCHAR"
+# one row of each kind of difference: 1 and 3 are modified, 4 was removed and 6
+# added, while 2 only differs in the note column
+INITIAL_ROWS = [(1, 'acme', 300, 'a'), (2, 'nasa', 400, 'b'), (3, 'jpl', None, 'c'),
+                (4, 'disney', 280, 'd'), (5, 'ginsu', None, 'e')]
+SECONDARY_ROWS = [(1, 'acme', 340, 'a'), (2, 'nasa', 400, 'changed'), (3, 'jpl', 430, 'c'),
+                  (5, 'ginsu', None, 'e'), (6, 'petrock', 15, 'f')]
+
+
+@pytest.fixture
+def build_args():
+    """ Returns a builder of the args of a diff of tab_initial and tab_secondary,
+        keyed on id, in the main schema of an SQLite database. Keyword arguments
+        other than the named ones go in the system section, table_info entries
+        override those of the table_info section.
+    """
+    def build(comp_cols=('name', 'amount'),
+              ignore_cols=(),
+              key_cols=('id',),
+              secondary_database=None,
+              table_info=None,
+              **system):
+        args = {
+            "database": {"db_type": "sqlite"},
+            "table_info": {
+                "table_initial": "tab_initial",
+                "table_secondary": "tab_secondary",
+                "table_diff": "tab_diff",
+                "schema_name": "main",
+                "key_cols": list(key_cols),
+                "comp_cols": list(comp_cols),
+                "ignore_cols": list(ignore_cols),
+                "initial_table_alias": "initial",
+                "secondary_table_alias": "secondary",
+                "except_rows": None,
+                **(table_info or {})},
+            "system": system}
+        if secondary_database:
+            args["secondary_database"] = secondary_database
+        return args
+    return build
+
+
+@pytest.fixture
+def load_table():
+    """ Returns a loader creating a table of cols on a connection and inserting rows
+    """
+    def load(conn, table_name, rows, cols=TABLE_COLS):
+        conn.execute(f"CREATE TABLE {table_name} ({cols})")
+        if rows:
+            markers = ', '.join(['?'] * len(rows[0]))
+            conn.executemany(f"INSERT INTO {table_name} VALUES ({markers})", rows)
+        conn.commit()
+    return load
+
+
+@pytest.fixture
+def conn(load_table):
+    """ Returns an in-memory database holding tab_initial and tab_secondary
+    """
+    conn = sqlite3.connect(':memory:')
+    load_table(conn, 'tab_initial', INITIAL_ROWS)
+    load_table(conn, 'tab_secondary', SECONDARY_ROWS)
+    return conn
+
+
+@pytest.fixture
+def get_report():
+    """ Returns a builder of the report on tab_diff for the args of build_args
+    """
+    def build(conn, comp_cols=('name', 'amount'), ignore_cols=(), key_cols=('id',)):
+        return BasicReport(conn, 'main', 'tab_initial', 'tab_secondary', 'tab_diff',
+                           list(comp_cols), list(ignore_cols),
+                           key_cols=list(key_cols),
+                           initial_table_alias='initial',
+                           secondary_table_alias='secondary',
+                           db_type='sqlite')
+    return build
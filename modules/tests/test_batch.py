@@ -0,0 +1,49 @@
+#!/bin/env python
+
+import sqlite3
+
+from modules.batch import BatchRunner
+
+
+def build_pair(name, **overrides):
+    pair = {"table_initial": f"{name}_initial",
+            "table_secondary": f"{name}_secondary",
+            "table_diff": f"{name}__diff__",
+            "schema_name": "main",
+            "key_cols": ["id"],
+            "comp_cols": ["amount"],
+            "ignore_cols": [],
+            "initial_table_alias": "initial",
+            "secondary_table_alias": "secondary",
+            "except_rows": None}
+    pair.update(overrides)
+    return pair
+
+
+def test_batch_diffs_every_pair(tmp_path):
+    db_path = str(tmp_path / 'batch.db')
+    conn = sqlite3.connect(db_path)
+    for num in range(3):
+        for side in ('initial', 'secondary'):
+            conn.execute(f"CREATE TABLE t{num}_{side} (id INT, amount INT)")
+            conn.executemany(f"INSERT INTO t{num}_{side} VALUES (?, ?)", [(i, i) for i in range(10)])
+        conn.execute(f"UPDATE t{num}_secondary SET amount = -1 WHERE id < {num}")
+    conn.commit()
+    conn.close()
+
+    args = {"database": {"db_type": "sqlite"},
+            "pairs": [build_pair(f"t{num}") for num in range(3)] + [build_pair("missing")],
+            "system": {"workers": 4}}
+    opened = []
+
+    def connect():
+        opened.append(sqlite3.connect(db_path))
+        return opened[-1]
+
+    batch = BatchRunner(args, connect)
+    results = batch.run()
+    batch.write_report()
+    assert len(opened) == 1
+    assert [result.get('modified_row_cnt') for result in results] == [0, 1, 2, None]
+    assert [result['status'] for result in results[:3]] == ['ok'] * 3
+    assert results[3]['status'].startswith('failed')
@@ -0,0 +1,30 @@
+#!/bin/env python
+
+import json
+import sqlite3
+
+import pytest
+
+from benchmarks import bench_diff
+
+
+def test_benchmark_runs_emit_json(tmp_path):
+    output = tmp_path / 'bench.json'
+    bench_diff.main(['--rows', '3000', '--cols', '3', '--key-arity', '2', '--change-rate', '0.03',
+                     '--engines', 'sqlite', 'postgres', '--output', str(output)])
+    with open(output) as inbuf:
+        results = json.load(inbuf)
+    assert results['skipped'] == {'postgres': 'no --pg-dsn given'}
+    run = results['runs'][0]
+    assert run['engine'] == 'sqlite' and run['rows'] == 3000
+    # a third of the changed keys are added, a third removed and a third modified
+    assert 60 <= run['diff_row_cnt'] <= 140
+    assert run['diff_seconds'] > 0 and run['report_seconds'] > 0
+
+
+def test_connections_are_closed_when_a_run_fails():
+    with pytest.raises(RuntimeError):
+        with bench_diff.connect('sqlite', None) as (conn, _):
+            raise RuntimeError('failed run')
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
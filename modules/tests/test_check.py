@@ -0,0 +1,41 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+
+
+@pytest.fixture
+def conn(load_table):
+    conn = sqlite3.connect(':memory:')
+    rows = [(num, f'name_{num}', num * 10, 'a') for num in range(1, 101)]
+    load_table(conn, 'tab_initial', rows)
+    load_table(conn, 'tab_secondary', rows)
+    return conn
+
+
+def test_identical_tables(conn, build_args):
+    # the note column is not compared
+    conn.execute("UPDATE tab_secondary SET note = 'b'")
+    assert DiffWriter(build_args(), conn).check() is None
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff'").fetchall()
+
+
+def test_first_difference_with_examples(conn, build_args):
+    conn.execute("UPDATE tab_secondary SET amount = NULL WHERE id IN (7, 9, 11)")
+    kind, keys = DiffWriter(build_args(), conn).check(example_cnt=2)
+    assert kind == 'modified'
+    assert len(keys) == 2 and set(keys) <= {(7,), (9,), (11,)}
+
+
+def test_missing_rows_are_found_first(conn, build_args):
+    conn.execute("UPDATE tab_secondary SET amount = -1 WHERE id = 3")
+    conn.execute("DELETE FROM tab_secondary WHERE id = 50")
+    assert DiffWriter(build_args(), conn).check(example_cnt=5) == ('only_initial', [(50,)])
+
+
+def test_excluded_keys_are_not_differences(conn, build_args):
+    conn.execute("INSERT INTO tab_secondary VALUES (101, 'new', 1, 'a')")
+    assert DiffWriter(build_args(table_info={"except_rows": ['101']}), conn).check() is None
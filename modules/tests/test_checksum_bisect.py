@@ -0,0 +1,100 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+from modules.checksum_bisect import ChecksumBisector
+
+
+BISECT = {"bisect_fanout": 16, "bisect_leaf_width": 100}
+
+
+@pytest.fixture
+def conn(load_table):
+    conn = sqlite3.connect(':memory:')
+    rows = [(i, f'name_{i}', i * 10) for i in range(1, 20001)]
+    for table in ('tab_initial', 'tab_secondary'):
+        load_table(conn, table, rows, cols="id INT, name VARCHAR, amount INT")
+    conn.execute("UPDATE tab_secondary SET amount = -1 WHERE id IN (7, 12345)")
+    conn.execute("UPDATE tab_secondary SET name = NULL WHERE id = 19999")
+    conn.execute("DELETE FROM tab_secondary WHERE id = 500")
+    conn.execute("INSERT INTO tab_secondary VALUES (20500, 'new', 1)")
+    conn.commit()
+    return conn
+
+
+def get_diff_rows(conn):
+    return conn.execute("SELECT * FROM tab_diff ORDER BY initial_id, secondary_id").fetchall()
+
+
+def test_bisect_finds_only_differing_ranges(conn, build_args):
+    writer = DiffWriter(build_args(bisect=True, **BISECT), conn)
+    clauses = writer._get_clauses()
+    bisector = ChecksumBisector(writer.cur, clauses, 'tab_initial', 'tab_secondary',
+                                fanout=16, leaf_width=100)
+    ranges = bisector.find_ranges()
+    assert len(ranges) == 5
+    for key in (7, 500, 12345, 19999, 20500):
+        assert any(low <= key <= high for low, high in ranges)
+    assert sum(high - low + 1 for low, high in ranges) <= 5 * 100
+
+
+def test_bisect_matches_full_build(conn, build_args):
+    DiffWriter(build_args(), conn).create_diff_table()
+    full_rows = get_diff_rows(conn)
+
+    DiffWriter(build_args(bisect=True, **BISECT), conn).create_diff_table()
+    bisect_rows = get_diff_rows(conn)
+
+    assert len(full_rows) == 5
+    assert bisect_rows == full_rows
+
+
+def test_bisect_diffs_null_leading_keys(conn, build_args):
+    conn.execute("INSERT INTO tab_initial VALUES (NULL, 'ghost', 1)")
+    conn.execute("INSERT INTO tab_secondary VALUES (NULL, 'ghost', 1)")
+    conn.commit()
+    writer = DiffWriter(build_args(bisect=True, **BISECT), conn)
+    bisector = ChecksumBisector(writer.cur, writer._get_clauses(), 'tab_initial', 'tab_secondary',
+                                fanout=16, leaf_width=100)
+    assert bisector.find_ranges()[0] == (None, None)
+
+    DiffWriter(build_args(), conn).create_diff_table()
+    full_rows = get_diff_rows(conn)
+    DiffWriter(build_args(bisect=True, **BISECT), conn).create_diff_table()
+    assert len(full_rows) == 7
+    assert get_diff_rows(conn) == full_rows
+
+
+def test_bisect_requires_integer_keys(conn, build_args):
+    conn.execute("CREATE TABLE text_keys (id VARCHAR, name VARCHAR, amount INT)")
+    conn.execute("INSERT INTO text_keys VALUES ('a', 'b', 1)")
+    writer = DiffWriter(build_args(bisect=True, **BISECT), conn)
+    bisector = ChecksumBisector(writer.cur, writer._get_clauses(), 'text_keys', 'text_keys')
+    with pytest.raises(ValueError):
+        bisector.find_ranges()
+
+
+@pytest.mark.parametrize('system', [{'narrow': True}, {'narrow': True, 'bisect': True}])
+def test_narrow_matches_full_build(conn, system, build_args):
+    DiffWriter(build_args(), conn).create_diff_table()
+    full_rows = get_diff_rows(conn)
+
+    DiffWriter(build_args(**system, **BISECT), conn).create_diff_table()
+    assert get_diff_rows(conn) == full_rows
+    assert not conn.execute("SELECT name FROM sqlite_temp_master WHERE name = 'td_narrow_keys'").fetchall()
+
+
+def test_narrow_keeps_rows_whose_old_encoding_collided(build_args, load_table):
+    conn = sqlite3.connect(':memory:')
+    cols = "id INT, name VARCHAR, note VARCHAR"
+    load_table(conn, 'tab_initial', [(1, 'x', 'y'), (2, None, 'z'), (3, 'a|b', 'c')], cols)
+    load_table(conn, 'tab_secondary', [(1, 'x', 'y'), (2, '\\N', 'z'), (3, 'a', 'b|c')], cols)
+    DiffWriter(build_args(comp_cols=['name', 'note']), conn).create_diff_table()
+    full_rows = get_diff_rows(conn)
+    assert [row[0] for row in full_rows] == [2, 3]
+
+    DiffWriter(build_args(comp_cols=['name', 'note'], narrow=True), conn).create_diff_table()
+    assert get_diff_rows(conn) == full_rows
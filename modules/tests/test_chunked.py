@@ -0,0 +1,84 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.chunked import ChunkedBuilder
+from modules.create_diff_table import DiffWriter
+
+TABLE_COLS = "region VARCHAR, id INT, amount INT"
+
+
+@pytest.fixture
+def conn(tmp_path, load_table):
+    conn = sqlite3.connect(str(tmp_path / 'chunked.db'))
+    rows = [(region, num, num * 10) for region in ('east', 'north', 'west') for num in range(1, 11)]
+    load_table(conn, 'tab_initial', rows + [(None, 1, 0)], TABLE_COLS)
+    load_table(conn, 'tab_secondary',
+               [(region, num, amount + (num % 3 == 0)) for region, num, amount in rows if num != 5]
+               + [('south', num, 0) for num in range(1, 12)], TABLE_COLS)
+    return conn
+
+
+@pytest.fixture
+def get_args(build_args):
+    """ Returns a builder of the args of a diff keyed on region and id
+    """
+    def build(**system):
+        return build_args(key_cols=['region', 'id'], comp_cols=['amount'], **system)
+    return build
+
+
+def get_diff_rows(conn):
+    return sorted(conn.execute("SELECT * FROM tab_diff").fetchall(), key=str)
+
+
+def test_chunked_build_matches_full_build(conn, get_args):
+    DiffWriter(get_args(), conn).create_diff_table()
+    full_rows = get_diff_rows(conn)
+    DiffWriter(get_args(chunk_size=4), conn).create_diff_table()
+    assert get_diff_rows(conn) == full_rows
+    assert len(full_rows) == 3 * 3 + 3 + 11 + 1
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff__progress'").fetchall()
+
+
+def test_interrupted_build_resumes_from_checkpoint(conn, monkeypatch, get_args):
+    DiffWriter(get_args(), conn).create_diff_table()
+    full_rows = get_diff_rows(conn)
+
+    write_chunk = ChunkedBuilder._write_chunk
+    written = []
+
+    def failing_write_chunk(self, predicate, chunk_cnt, last_key, done):
+        if chunk_cnt == 4:
+            raise ConnectionError('connection dropped')
+        written.append(chunk_cnt)
+        write_chunk(self, predicate, chunk_cnt, last_key, done)
+
+    monkeypatch.setattr(ChunkedBuilder, '_write_chunk', failing_write_chunk)
+    with pytest.raises(ConnectionError):
+        DiffWriter(get_args(chunk_size=4), conn).create_diff_table()
+    assert written == [1, 2, 3]
+    conn.rollback()
+
+    written.clear()
+    monkeypatch.setattr(ChunkedBuilder, '_write_chunk', lambda *args: (written.append(args[2]), write_chunk(*args)))
+    DiffWriter(get_args(chunk_size=4), conn).create_diff_table()
+    assert written[0] == 4    # the chunks already committed are not redone
+    assert get_diff_rows(conn) == full_rows
+
+
+def test_checkpoint_of_other_parameters_is_not_resumed(conn, get_args):
+    DiffWriter(get_args(chunk_size=4), conn).create_diff_table()
+    conn.execute("CREATE TABLE tab_diff__progress (params_hash VARCHAR(32), chunk_cnt INT, last_key TEXT, done INT)")
+    conn.execute("INSERT INTO tab_diff__progress VALUES ('other', 3, '[\"east\", 4]', 0)")
+    conn.commit()
+    DiffWriter(get_args(chunk_size=4), conn).create_diff_table()
+    assert len(get_diff_rows(conn)) == 24
+
+
+def test_fast_mode_is_refused(conn, get_args):
+    with pytest.raises(ValueError):
+        DiffWriter(get_args(chunk_size=4, fast=True), conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'tab_diff%'").fetchall()
@@ -0,0 +1,149 @@
+#!/bin/env python
+
+import collections
+import json
+import sqlite3
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from modules import daemon
+from modules.daemon import DiffService, create_server
+
+
+ARGS = {
+    "database": {"db_type": "sqlite"},
+    "table_info": {
+        "table_initial": None,
+        "table_secondary": None,
+        "table_diff": None,
+        "schema_name": "main",
+        "key_cols": ["id"],
+        "comp_cols": ["amount"],
+        "ignore_cols": [],
+        "initial_table_alias": "initial",
+        "secondary_table_alias": "secondary",
+        "except_rows": None},
+    "system": {}}
+
+
+@pytest.fixture
+def server(tmp_path):
+    db_path = str(tmp_path / 'daemon.db')
+    conn = sqlite3.connect(db_path)
+    for side in ('initial', 'secondary'):
+        conn.execute(f"CREATE TABLE tab_{side} (id INT, amount INT)")
+        conn.executemany(f"INSERT INTO tab_{side} VALUES (?, ?)", [(i, i) for i in range(10)])
+    conn.execute("UPDATE tab_secondary SET amount = -1 WHERE id = 3")
+    conn.commit()
+    conn.close()
+
+    connections = []
+
+    def connect():
+        connections.append(sqlite3.connect(db_path))
+        return connections[-1]
+
+    service = DiffService(ARGS, connect, max_jobs=2)
+    service.start()
+    server = create_server(service, '127.0.0.1:0')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, connections
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def request(server, path, body=None):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    data = json.dumps(body).encode('UTF-8') if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_jobs_share_a_warm_connection(server):
+    server, connections = server
+    job = {"table_initial": "tab_initial", "table_secondary": "tab_secondary"}
+    for _ in range(3):
+        status, body = request(server, '/jobs?wait=1', job)
+        assert status == 200
+        assert body['status'] == 'done'
+        assert body['result']['modified_row_cnt'] == 1
+        assert body['result']['table_diff'] == 'tab_secondary__diff__'
+    assert len(connections) == 1
+
+    status, body = request(server, f"/jobs/{body['job_id']}")
+    assert status == 200 and body['status'] == 'done'
+    assert request(server, '/health')[1] == {'workers': 1, 'queued': 0}
+
+
+def test_bad_jobs_are_reported(server):
+    server, _ = server
+    assert request(server, '/jobs', {"table_initial": "tab_initial"})[0] == 400
+    assert request(server, '/jobs/999')[0] == 404
+    status, body = request(server, '/jobs?wait=1', {"table_initial": "nope", "table_secondary": "tab_secondary"})
+    assert status == 200 and body['status'] == 'failed'
+
+
+def test_job_fields_must_be_identifiers(server):
+    server, _ = server
+    for job in ({"table_initial": "tab_initial; DROP TABLE tab_secondary", "table_secondary": "tab_secondary"},
+                {"table_initial": "tab_initial", "table_secondary": "tab_secondary", "key_cols": ["id) OR (1"]},
+                {"table_initial": "tab_initial", "table_secondary": "tab_secondary", "diff_table": "x.y"},
+                {"table_initial": "tab_initial", "table_secondary": "tab_secondary", "sample": "1"},
+                {"table_initial": "tab_initial", "table_secondary": "tab_secondary", "sample": 0},
+                {"table_initial": "tab_initial", "table_secondary": "tab_secondary", "sample": 150}):
+        status, body = request(server, '/jobs', job)
+        assert status == 400, job
+
+
+def test_only_loopback_addresses_are_served():
+    service = DiffService(ARGS, lambda: None)
+    with pytest.raises(ValueError):
+        create_server(service, '0.0.0.0:0')
+
+
+def test_finished_jobs_are_evicted(monkeypatch):
+    monkeypatch.setattr(daemon, 'MAX_FINISHED_JOBS', 2)
+    monkeypatch.setattr(daemon, 'diff_pair', lambda *args: {'status': 'ok'})
+    monkeypatch.setattr(DiffService, '_get_metadata', lambda *args: {})
+    service = DiffService(ARGS, lambda: None)
+    service.start()
+    records = [service.submit({"table_initial": "tab_initial", "table_secondary": "tab_secondary"})
+               for _ in range(4)]
+    for record in records:
+        record['done'].wait()
+    service.submit({"table_initial": "tab_initial", "table_secondary": "tab_secondary"})['done'].wait()
+    service.stop()
+    assert [service.get_job(record['job_id']) is None for record in records] == [True, True, False, False]
+
+
+def test_jobs_on_one_diff_table_do_not_overlap(monkeypatch):
+    running = collections.Counter()
+    overlaps = []
+
+    def diff_pair(args, conn, table_info, metadata):
+        running[table_info['table_diff']] += 1
+        overlaps.append(running[table_info['table_diff']] > 1)
+        time.sleep(0.05)
+        running[table_info['table_diff']] -= 1
+        return {'status': 'ok'}
+
+    monkeypatch.setattr(daemon, 'diff_pair', diff_pair)
+    monkeypatch.setattr(DiffService, '_get_metadata', lambda *args: {})
+    service = DiffService({**ARGS, "database": {"db_type": "postgres"}}, lambda: None, max_jobs=4)
+    service.start()
+    records = [service.submit({"table_initial": "tab_initial", "table_secondary": "tab_secondary"})
+               for _ in range(4)]
+    for record in records:
+        record['done'].wait()
+    service.stop()
+    assert all(record['status'] == 'done' for record in records)
+    assert not any(overlaps)
+    assert not service.diff_table_locks    # forgotten once their jobs finished
@@ -0,0 +1,69 @@
+#!/bin/env python
+
+import os
+import sqlite3
+
+import pytest
+
+from modules import db_utils
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = str(tmp_path / 'facts.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE tab_a (id INT NOT NULL, sub_id INT NOT NULL, name VARCHAR, "
+                 "PRIMARY KEY (id, sub_id))")
+    conn.execute("CREATE TABLE tab_b (id INT, amount INT)")
+    conn.execute("CREATE UNIQUE INDEX tab_b_id ON tab_b (id, amount)")
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def test_batched_metadata(db_path):
+    facts = db_utils.DBFacts(sqlite3.connect(db_path))
+    metadata = facts.get_table_metadata('main', 'sqlite', ['tab_a', 'tab_b', 'no_such_table'])
+    assert [col['name'] for col in metadata['tab_a']['columns']] == ['id', 'sub_id', 'name']
+    assert metadata['tab_a']['columns'][2] == {'name': 'name', 'type': 'VARCHAR', 'nullable': True}
+    assert metadata['tab_a']['primary_key'] == ['id', 'sub_id']
+    assert metadata['tab_b']['indexes'] == [{'name': 'tab_b_id', 'columns': ['id', 'amount'], 'unique': True}]
+    assert metadata['no_such_table']['columns'] == []
+    assert facts.get_cols('main', 'sqlite', 'tab_b') == ['id', 'amount']
+
+
+def test_disk_cache_invalidated_by_schema_change(db_path, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    conn = sqlite3.connect(db_path)
+    facts = db_utils.DBFacts(conn, cache_dir=cache_dir, cache_ttl=60)
+    facts.get_table_metadata('main', 'sqlite', ['tab_a', 'tab_b'])
+    assert len(os.listdir(cache_dir)) == 1
+
+    cached_facts = db_utils.DBFacts(conn, cache_dir=cache_dir, cache_ttl=60)
+    cached_facts._fetch_metadata = None    # any catalog fetch would now fail
+    cached = cached_facts.get_table_metadata('main', 'sqlite', ['tab_b', 'tab_a'])
+    assert [col['name'] for col in cached['tab_b']['columns']] == ['id', 'amount']
+
+    conn.execute("ALTER TABLE tab_b ADD COLUMN note VARCHAR")
+    fresh_facts = db_utils.DBFacts(conn, cache_dir=cache_dir, cache_ttl=60)
+    assert fresh_facts.get_table_metadata('main', 'sqlite', ['tab_a', 'tab_b'])['tab_b']['columns'][-1]['name'] == 'note'
+
+
+def test_disk_cache_invalidated_by_recreated_file(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    db_path = str(tmp_path / 'recreated.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (id INT, a INT)")
+    assert db_utils.DBFacts(conn, cache_dir=cache_dir, cache_ttl=60).get_cols('main', 'sqlite', 't') == ['id', 'a']
+    conn.close()
+
+    # the same DDL count at the same path gives the same schema_version
+    os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (id INT, b INT, c INT)")
+    assert db_utils.DBFacts(conn, cache_dir=cache_dir, cache_ttl=60).get_cols('main', 'sqlite', 't') == ['id', 'b', 'c']
+
+
+@pytest.mark.parametrize('row, other', [((None,), ('\\N',)), (('a|b', 'c'), ('a', 'b|c')), ((None, ''), ('', None))])
+def test_row_hash_encoding_is_unambiguous(row, other):
+    assert db_utils.row_hash(*row) != db_utils.row_hash(*other)
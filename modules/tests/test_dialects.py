@@ -0,0 +1,61 @@
+#!/bin/env python
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from modules import dialects
+from modules.create_diff_table import DiffWriter
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        dialects.get_dialect('oracle')
+
+
+def test_diff_plan_follows_dialect(conn, build_args):
+    writer = DiffWriter(build_args(), conn)
+    assert 'FULL OUTER JOIN' not in writer.get_queries()['diff']
+
+    writer.dialect = dialects.get_dialect('postgres')
+    clauses = writer._get_clauses()
+    assert 'FULL OUTER JOIN' in writer._assemble_select_query(clauses)
+
+
+def test_sqlite_connection_loads_no_other_driver():
+    code = ("import sys; from modules import dialects; "
+            "conn = dialects.get_dialect('sqlite').connect({'db_path': ':memory:'}); "
+            "assert conn.execute('SELECT td_hash(1) = td_hash(1)').fetchall() == [(1,)]; "
+            "print(sorted({'psycopg2', 'duckdb', 'pymysql'} & set(sys.modules)))")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    assert result.stdout.strip() == '[]'
+
+
+def test_left_join_union_matches_the_anti_join_plan(conn, build_args):
+    writer = DiffWriter(build_args(), conn)
+    clauses = writer._get_clauses()
+    left_join_query = writer._assemble_select_query_left_join(clauses)
+    assert left_join_query.count('UNION ALL') == 1
+    assert sorted(conn.execute(left_join_query).fetchall(), key=str) == \
+        sorted(conn.execute(writer._assemble_select_query_anti_join(clauses)).fetchall(), key=str)
+
+
+def test_shared_scratch_tables_are_named_per_diff_table(conn, build_args):
+    writer = DiffWriter(build_args(), conn)
+    assert writer.except_keys.table_name == 'td_except_keys'
+
+    mysql = dialects.get_dialect('mysql')
+    assert mysql.scratch_table('except_keys', 'tab_diff') == 'tab_diff__except_keys'
+    assert mysql.scratch_table('narrow_keys', 'other_diff') == 'other_diff__narrow_keys'
+
+
+def test_dialects_must_connect():
+    class Unconnected(dialects.Dialect):
+        name = 'unconnected'
+
+    with pytest.raises(TypeError):
+        dialects.register_dialect(Unconnected)
+    assert 'unconnected' not in dialects.DIALECTS
@@ -0,0 +1,27 @@
+#!/bin/env python
+
+import csv
+import json
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+
+
+@pytest.mark.parametrize('file_name', ['diff.csv', 'diff.ndjson', 'diff.parquet'])
+def test_diff_streamed_to_file(conn, build_args, tmp_path, file_name):
+    if file_name.endswith('.parquet'):
+        pq = pytest.importorskip('pyarrow.parquet')
+    output_file = str(tmp_path / file_name)
+    DiffWriter(build_args(diff_target='file', output_file=output_file, batch_size=2), conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff'").fetchall()
+
+    if file_name.endswith('.csv'):
+        with open(output_file, newline='') as inbuf:
+            rows = list(csv.DictReader(inbuf))
+    elif file_name.endswith('.ndjson'):
+        with open(output_file) as inbuf:
+            rows = [json.loads(line) for line in inbuf]
+    else:
+        rows = pq.read_table(output_file).to_pylist()
+    assert sorted(str(row['change_type']) for row in rows) == ['added', 'modified', 'modified', 'removed']
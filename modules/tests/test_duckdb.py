@@ -0,0 +1,73 @@
+#!/bin/env python
+
+import pytest
+
+from modules import dialects
+from modules.create_diff_table import DiffWriter
+from modules.reporting import BasicReport
+
+duckdb = pytest.importorskip("duckdb")
+
+
+def build_args(initial, secondary, **system):
+    return {
+        "database": {"db_type": "duckdb"},
+        "table_info": {
+            "table_initial": initial,
+            "table_secondary": secondary,
+            "table_diff": "tab_diff",
+            "schema_name": "main",
+            "key_cols": ["id"],
+            "comp_cols": ["name", "amount"],
+            "ignore_cols": [],
+            "initial_table_alias": "initial",
+            "secondary_table_alias": "secondary",
+            "except_rows": None},
+        "system": system}
+
+
+@pytest.fixture
+def files(tmp_path):
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE t1 AS SELECT range AS id, 'name_' || range AS name, range * 10 AS amount FROM range(1, 1001)")
+    conn.execute("CREATE TABLE t2 AS SELECT * FROM t1")
+    conn.execute("UPDATE t2 SET amount = -1 WHERE id = 7")
+    conn.execute("UPDATE t2 SET name = NULL WHERE id = 8")
+    conn.execute("DELETE FROM t2 WHERE id = 500")
+    conn.execute("INSERT INTO t2 VALUES (2000, 'new', 1)")
+    initial = str(tmp_path / 'initial.parquet')
+    (tmp_path / 'secondary').mkdir()
+    conn.execute(f"COPY t1 TO '{initial}' (FORMAT PARQUET)")
+    conn.execute(f"COPY (SELECT * FROM t2 WHERE id <= 500) TO '{tmp_path}/secondary/part_0.parquet' (FORMAT PARQUET)")
+    conn.execute(f"COPY (SELECT * FROM t2 WHERE id > 500) TO '{tmp_path}/secondary/part_1.parquet' (FORMAT PARQUET)")
+    conn.close()
+    return initial, str(tmp_path / 'secondary')
+
+
+def test_diff_parquet_file_against_directory(files):
+    conn = duckdb.connect()
+    DiffWriter(build_args(*files), conn).create_diff_table()
+    rows = conn.execute("SELECT initial_id, secondary_id, change_type FROM tab_diff ORDER BY 1, 2").fetchall()
+    assert rows == [(7, 7, 'modified'), (8, 8, 'modified'), (500, None, 'removed'), (None, 2000, 'added')]
+
+    report = BasicReport(conn, 'main', files[0], files[1], 'tab_diff', ['name', 'amount'], [],
+                         key_cols=['id'], db_type='duckdb')
+    report.get_counts()
+    assert report.results['unchanged_row_cnt'] == 997
+    assert report.results['column_change_cnts'] == {'amount': 1, 'name': 1}
+
+
+def test_diff_written_straight_to_file(files, tmp_path):
+    conn = duckdb.connect()
+    output_file = str(tmp_path / 'diff.parquet')
+    DiffWriter(build_args(*files, diff_target='file', output_file=output_file), conn).create_diff_table()
+    rows = conn.execute(f"SELECT change_type, COUNT(*) FROM read_parquet('{output_file}') GROUP BY 1 ORDER BY 1").fetchall()
+    assert rows == [('added', 1), ('modified', 2), ('removed', 1)]
+
+
+def test_row_hash_encoding_is_unambiguous():
+    row_hash = dialects.get_dialect('duckdb').row_hash(['x', 'y'])
+    conn = duckdb.connect()
+    hashes = {conn.execute(f"SELECT {row_hash} FROM (SELECT {x} AS x, {y} AS y)").fetchall()[0][0]
+              for x, y in [("NULL", "'\\N'"), ("'\\N'", "NULL"), ("'a|b'", "'c'"), ("'a'", "'b|c'")]}
+    assert len(hashes) == 4
@@ -0,0 +1,64 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+from modules.exclusions import ExceptKeys
+
+
+TABLE_COLS = "region VARCHAR, id INT, amount INT"
+
+
+@pytest.fixture
+def get_args(build_args):
+    """ Returns a builder of the args of a diff keyed on region and id
+    """
+    def build(**table_info):
+        return build_args(key_cols=['region', 'id'], comp_cols=['amount'], table_info=table_info)
+    return build
+
+
+@pytest.fixture
+def conn(load_table):
+    conn = sqlite3.connect(':memory:')
+    load_table(conn, 'tab_initial',
+               [('east', 1, 10), ('east', 2, 20), ('west', 1, 30), ('west', 2, 40)], TABLE_COLS)
+    load_table(conn, 'tab_secondary',
+               [('east', 1, 11), ('east', 2, 21), ('west', 1, 31), ('west', 3, 50)], TABLE_COLS)
+    load_table(conn, 'bad_keys', [('west', 3)], "region VARCHAR, id INT")
+    return conn
+
+
+def get_diff_keys(conn):
+    rows = conn.execute("SELECT COALESCE(initial_region, secondary_region), "
+                        "COALESCE(initial_id, secondary_id) FROM tab_diff ORDER BY 1, 2").fetchall()
+    return rows
+
+
+def test_keys_from_cli_file_and_query_are_excluded(conn, tmp_path, get_args):
+    except_file = tmp_path / 'keys.csv'
+    except_file.write_text('region,id\neast,2\n')
+    DiffWriter(get_args(except_rows=['east,1'],
+                        except_file=str(except_file),
+                        except_query="SELECT region, id FROM bad_keys"), conn).create_diff_table()
+    assert get_diff_keys(conn) == [('west', 1), ('west', 2)]
+    # the temp table of excluded keys does not outlive the run
+    assert not conn.execute("SELECT name FROM sqlite_temp_master WHERE name = 'td_except_keys'").fetchall()
+
+
+def test_no_exclusions_diffs_every_key(conn, get_args):
+    DiffWriter(get_args(), conn).create_diff_table()
+    assert get_diff_keys(conn) == [('east', 1), ('east', 2), ('west', 1), ('west', 2), ('west', 3)]
+
+
+def test_excluded_key_arity_is_checked():
+    with pytest.raises(ValueError):
+        ExceptKeys('sqlite', ['region', 'id'], except_rows=['east']).get_keys()
+
+
+def test_fingerprint_follows_the_keys():
+    keys = ExceptKeys('sqlite', ['id'], except_rows=['1', '2'])
+    assert keys.get_fingerprint() == ExceptKeys('sqlite', ['id'], except_rows=['2', '1']).get_fingerprint()
+    assert keys.get_fingerprint() != ExceptKeys('sqlite', ['id'], except_rows=['1']).get_fingerprint()
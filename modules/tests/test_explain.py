@@ -0,0 +1,63 @@
+#!/bin/env python
+
+import json
+import sqlite3
+
+from modules.create_diff_table import DiffWriter
+from modules.explain import PlanAdvisor
+from modules.reporting import BasicReport
+
+
+def test_plans_flag_unindexed_join(tmp_path, build_args):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE tab_initial (id INT, name VARCHAR)")
+    conn.execute("CREATE TABLE tab_secondary (id INT, name VARCHAR)")
+    queries = DiffWriter(build_args(comp_cols=['name']), conn).get_queries()
+    queries['report_counts'] = BasicReport(conn, 'main', 'tab_initial', 'tab_secondary', 'tab_diff',
+                                           ['name'], [], key_cols=['id']).get_queries()['counts']
+
+    advisor = PlanAdvisor(conn, 'sqlite', 'main', ['tab_initial', 'tab_secondary'], analyze=True)
+    results = advisor.capture(queries)
+    plan_file = str(tmp_path / 'tab_diff.plan.json')
+    advisor.write_plans(results, plan_file)
+
+    with open(plan_file) as inbuf:
+        saved = json.load(inbuf)
+    assert len(saved['statistics_warnings']) == 2
+    assert any('not indexed' in warning for warning in saved['queries']['diff']['warnings'])
+    assert saved['queries']['diff']['plan']['actual_rows'] == 0
+    assert 'no such table' in saved['queries']['report_counts']['error']
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff'").fetchall()
+
+
+def test_sqlite_advice_ignores_outer_scans(build_args):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE tab_initial (id INT, name VARCHAR)")
+    conn.execute("CREATE TABLE tab_secondary (id INT, name VARCHAR)")
+    conn.execute("CREATE INDEX tab_initial_id ON tab_initial (id)")
+    conn.execute("CREATE INDEX tab_secondary_id ON tab_secondary (id)")
+    args = build_args(comp_cols=['name'])
+    advisor = PlanAdvisor(conn, 'sqlite', 'main', ['tab_initial', 'tab_secondary'])
+    # every branch scans its outer table once, and seeks the other one by key
+    assert advisor.advise(advisor.explain(DiffWriter(args, conn).get_queries()['diff'])) == []
+
+    conn.execute("PRAGMA automatic_index = OFF")
+    conn.execute("DROP INDEX tab_secondary_id")
+    warnings = advisor.advise(advisor.explain(DiffWriter(args, conn).get_queries()['diff']))
+    assert warnings and all('full scan of b' in warning for warning in warnings)
+
+
+def test_postgres_advice_inspects_only_the_inner_side():
+    def scan(table):
+        return {'Node Type': 'Seq Scan', 'Relation Name': table, 'Plan Rows': 10}
+
+    advisor = PlanAdvisor(sqlite3.connect(':memory:'), 'postgres', 'public', ['tab_initial', 'tab_secondary'])
+    outer_scan = [{'Plan': {'Node Type': 'Nested Loop', 'Plan Rows': 10,
+                            'Plans': [scan('tab_initial'),
+                                      {'Node Type': 'Index Scan', 'Relation Name': 'tab_secondary',
+                                       'Plan Rows': 1}]}}]
+    assert advisor.advise(outer_scan) == []
+    inner_scan = [{'Plan': {'Node Type': 'Nested Loop', 'Plan Rows': 10,
+                            'Plans': [scan('tab_initial'), scan('tab_secondary')]}}]
+    assert advisor.advise(inner_scan) == ['nested loop over a sequential scan of tab_secondary: '
+                                          'the key columns are probably not indexed']
@@ -0,0 +1,22 @@
+#!/bin/env python
+
+import sqlite3
+
+from modules import db_utils
+from modules.create_diff_table import DiffWriter
+
+
+def test_fast_mode_temp_table_and_promotion(build_args, load_table, get_report):
+    conn = sqlite3.connect(':memory:')
+    db_utils.apply_sqlite_fast_pragmas(conn)
+    load_table(conn, 'tab_initial', [(1, 'a', 1, ''), (2, 'b', 2, '')])
+    load_table(conn, 'tab_secondary', [(1, 'a', 5, ''), (2, 'b', 2, '')])
+    DiffWriter(build_args(fast=True), conn).create_diff_table()
+    assert conn.execute("SELECT name FROM sqlite_temp_master WHERE name = 'tab_diff'").fetchall()
+    report = get_report(conn)
+    report.get_counts()
+    assert report.results['column_change_cnts'] == {'amount': 1, 'name': 0}
+
+    DiffWriter(build_args(fast=True, fast_promote=True), conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_temp_master WHERE name = 'tab_diff'").fetchall()
+    assert conn.execute("SELECT COUNT(*) FROM main.tab_diff").fetchall()[0][0] == 1
@@ -0,0 +1,108 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+
+
+@pytest.fixture
+def conn(load_table):
+    conn = sqlite3.connect(':memory:')
+    rows = [(i, f'name_{i}', i, 1) for i in range(1, 101)]
+    for table in ('tab_initial', 'tab_secondary'):
+        load_table(conn, table, rows, cols="id INT, name VARCHAR, amount INT, updated_at INT")
+    conn.execute("UPDATE tab_secondary SET amount = 0 WHERE id = 10")
+    conn.commit()
+    return conn
+
+
+def get_rows(conn, table):
+    return conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+
+
+def rebuild_expected(conn, build_args):
+    DiffWriter(build_args(), conn).create_diff_table()
+    return get_rows(conn, 'tab_diff')
+
+
+def change_tables(conn):
+    conn.execute("UPDATE tab_secondary SET name = 'renamed', updated_at = 2 WHERE id = 20")
+    conn.execute("UPDATE tab_initial SET amount = 0, updated_at = 2 WHERE id = 10")
+    conn.execute("DELETE FROM tab_initial WHERE id = 30")
+    conn.execute("INSERT INTO tab_secondary VALUES (101, 'new', 101, 2)")
+    conn.commit()
+
+
+@pytest.mark.parametrize('watermark_col', [None, 'updated_at'])
+def test_incremental_update_matches_rebuild(conn, watermark_col, build_args):
+    DiffWriter(build_args(incremental=True, watermark_col=watermark_col), conn).create_diff_table()
+    assert conn.execute("SELECT params_hash FROM tab_diff__state").fetchall()
+
+    change_tables(conn)
+    DiffWriter(build_args(incremental=True, watermark_col=watermark_col), conn).create_diff_table()
+    patched = get_rows(conn, 'tab_diff')
+    assert patched == rebuild_expected(conn, build_args)
+
+
+def test_unchanged_tables_touch_no_keys(conn, build_args):
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    before = get_rows(conn, 'tab_diff')
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    assert get_rows(conn, 'tab_diff') == before
+    assert len(get_rows(conn, 'tab_diff__hash_initial')) == 100
+
+
+def test_changed_parameters_force_rebuild(conn, build_args):
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    args = build_args(incremental=True)
+    args["table_info"]["comp_cols"] = ["amount"]
+    DiffWriter(args, conn).create_diff_table()
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(tab_diff)")]
+    assert 'initial_name' not in cols
+
+
+def test_rebuild_without_incremental_drops_the_state(conn, build_args):
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    DiffWriter(build_args(sample=5), conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff__state'").fetchall()
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    assert get_rows(conn, 'tab_diff') == rebuild_expected(conn, build_args)
+
+
+def test_null_keys_are_patched(conn, build_args):
+    conn.execute("INSERT INTO tab_initial VALUES (NULL, 'null_key', 1, 1)")
+    conn.commit()
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    conn.execute("UPDATE tab_initial SET amount = 2 WHERE id IS NULL")
+    conn.execute("INSERT INTO tab_secondary VALUES (NULL, 'null_key', 3, 1)")
+    conn.commit()
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    assert get_rows(conn, 'tab_diff') == rebuild_expected(conn, build_args)
+
+
+def test_rows_written_at_the_last_watermark_are_diffed(conn, build_args):
+    args = build_args(incremental=True, watermark_col='updated_at')
+    DiffWriter(args, conn).create_diff_table()
+    # a write committed after the last run read its watermark, with the same value
+    conn.execute("UPDATE tab_secondary SET name = 'renamed' WHERE id = 20")
+    conn.commit()
+    DiffWriter(args, conn).create_diff_table()
+    assert get_rows(conn, 'tab_diff') == rebuild_expected(conn, build_args)
+
+
+def test_hashes_are_taken_before_the_first_build(conn, build_args):
+    writer = DiffWriter(build_args(incremental=True), conn)
+    build_diff_table = writer._build_diff_table
+
+    def build_then_change(clauses):
+        build_diff_table(clauses)
+        # a write landing after the diff table is built is not in it
+        conn.execute("UPDATE tab_secondary SET name = 'renamed' WHERE id = 20")
+        conn.commit()
+
+    writer._build_diff_table = build_then_change
+    writer.create_diff_table()
+    DiffWriter(build_args(incremental=True), conn).create_diff_table()
+    assert get_rows(conn, 'tab_diff') == rebuild_expected(conn, build_args)
@@ -0,0 +1,45 @@
+#!/bin/env python
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+
+
+def test_temporary_key_indexes(conn, build_args):
+    conn.execute("CREATE UNIQUE INDEX tab_secondary_pk ON tab_secondary (id)")
+    writer = DiffWriter(build_args(), conn)
+    seen = []
+    build = writer._write_diff
+
+    def spy(clauses):
+        seen.extend(conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE name LIKE 'td_tmp_%'").fetchall())
+        build(clauses)
+
+    writer._write_diff = spy
+    writer.create_diff_table()
+    assert seen == [('td_tmp_tab_initial_key', 'tab_initial')]
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'td_tmp_%'").fetchall()
+    assert conn.execute("SELECT COUNT(*) FROM tab_diff").fetchall()[0][0] == 4
+
+
+def test_temporary_key_indexes_dropped_on_failure(conn, build_args):
+    writer = DiffWriter(build_args(), conn)
+    has_key_index = writer._has_key_index
+
+    def fail_on_secondary(table_name):
+        # the run is interrupted after the first table was indexed
+        if table_name == 'tab_secondary':
+            raise RuntimeError('interrupted')
+        return has_key_index(table_name)
+
+    writer._has_key_index = fail_on_secondary
+    with pytest.raises(RuntimeError):
+        writer.create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'td_tmp_%'").fetchall()
+
+
+def test_leftover_temporary_key_index_is_dropped(conn, build_args):
+    # as left by a run killed before its cleanup
+    conn.execute("CREATE INDEX td_tmp_tab_initial_key ON tab_initial (id, name, amount)")
+    DiffWriter(build_args(), conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'td_tmp_%'").fetchall()
@@ -0,0 +1,184 @@
+#!/bin/env python
+
+import csv
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+from modules.merge_diff import MergeDiffer, get_normalizer
+from modules.reporting import BasicReport
+
+
+INITIAL_ROWS = [(1, 'acme', 300), (2, 'nasa', 400), (3, 'jpl', 400), (4, 'disney', 280)]
+SECONDARY_ROWS = [(1, 'acme', 340), (2, 'nasa', 400), (3, 'jpl', None), (6, 'petrock', 15)]
+TABLE_COLS = "id INT, name VARCHAR, amount INT"
+
+
+@pytest.fixture
+def merge_args(build_args):
+    """ Returns a builder of MergeDiffer args, the tables being in two SQLite databases
+    """
+    def build(**system):
+        return build_args(secondary_database={"db_type": "sqlite", "schema_name": "main"},
+                          **{"diff_target": "initial", "output_file": None, "batch_size": 3, **system})
+    return build
+
+
+@pytest.fixture
+def conns(load_table):
+    initial_conn = sqlite3.connect(':memory:')
+    secondary_conn = sqlite3.connect(':memory:')
+    load_table(initial_conn, 'tab_initial', INITIAL_ROWS, TABLE_COLS)
+    load_table(secondary_conn, 'tab_secondary', SECONDARY_ROWS, TABLE_COLS)
+    return initial_conn, secondary_conn
+
+
+@pytest.fixture
+def expected_rows(build_args, load_table):
+    """ Returns the diff of the same tables held in a single database
+    """
+    conn = sqlite3.connect(':memory:')
+    load_table(conn, 'tab_initial', INITIAL_ROWS, TABLE_COLS)
+    load_table(conn, 'tab_secondary', SECONDARY_ROWS, TABLE_COLS)
+    DiffWriter(build_args(), conn).create_diff_table()
+    return conn.execute("SELECT * FROM tab_diff ORDER BY initial_id, secondary_id").fetchall()
+
+
+def test_merge_matches_single_database_diff(conns, merge_args, expected_rows):
+    initial_conn, secondary_conn = conns
+    MergeDiffer(merge_args(), initial_conn, secondary_conn).create_diff_table()
+    actual = initial_conn.execute(
+            "SELECT * FROM tab_diff ORDER BY initial_id, secondary_id").fetchall()
+    assert actual == expected_rows
+
+
+def test_merge_to_secondary_and_file(conns, tmp_path, merge_args):
+    initial_conn, secondary_conn = conns
+    MergeDiffer(merge_args(diff_target='secondary'), initial_conn, secondary_conn).create_diff_table()
+    assert secondary_conn.execute("SELECT COUNT(*) FROM tab_diff").fetchall()[0][0] == 4
+
+    output_file = tmp_path / 'diff.csv'
+    MergeDiffer(merge_args(diff_target='file', output_file=str(output_file)),
+                initial_conn, secondary_conn).create_diff_table()
+    with open(output_file, newline='') as inbuf:
+        rows = list(csv.reader(inbuf))
+    assert rows[0] == ['initial_id', 'secondary_id', 'initial_amount', 'secondary_amount',
+                       'initial_name', 'secondary_name', 'change_type', 'changed_mask_0']
+    assert len(rows) == 5
+
+
+def test_merge_rejects_unsorted_keys(conns, merge_args):
+    initial_conn, secondary_conn = conns
+    initial_conn.execute("CREATE TABLE nocase_keys (code VARCHAR COLLATE NOCASE)")
+    initial_conn.executemany("INSERT INTO nocase_keys VALUES (?)", [('a',), ('B',)])
+    differ = MergeDiffer(merge_args(), initial_conn, secondary_conn)
+    differ.key_cols = ['code']
+    rows = differ._stream_rows(initial_conn, 'sqlite', 'nocase_keys', ['code'], {}, 'unused')
+    with pytest.raises(ValueError):
+        list(rows)
+
+
+def test_merge_orders_text_keys_by_code_point(conns, merge_args):
+    initial_conn, secondary_conn = conns
+    initial_conn.execute("CREATE TABLE nocase_keys (code VARCHAR COLLATE NOCASE)")
+    initial_conn.executemany("INSERT INTO nocase_keys VALUES (?)", [('a',), ('B',)])
+    differ = MergeDiffer(merge_args(), initial_conn, secondary_conn)
+    differ.key_cols = ['code']
+    rows = differ._stream_rows(initial_conn, 'sqlite', 'nocase_keys', ['code'], {'code': 'VARCHAR'}, 'unused')
+    assert [key for key, _ in rows] == [('B',), ('a',)]
+
+
+def test_merge_sends_null_keys_to_one_side(conns, merge_args):
+    initial_conn, secondary_conn = conns
+    initial_conn.execute("INSERT INTO tab_initial VALUES (NULL, 'ghost', 1)")
+    secondary_conn.execute("INSERT INTO tab_secondary VALUES (NULL, 'ghost', 1)")
+    MergeDiffer(merge_args(), initial_conn, secondary_conn).create_diff_table()
+    actual = initial_conn.execute("""
+            SELECT change_type, initial_name, secondary_name
+            FROM tab_diff
+            WHERE initial_id IS NULL AND secondary_id IS NULL""").fetchall()
+    assert sorted(actual, key=str) == [('added', None, 'ghost'), ('removed', 'ghost', None)]
+
+
+def test_merge_normalizes_values_per_column_type(conns, merge_args):
+    initial_conn, secondary_conn = conns
+    differ = MergeDiffer(merge_args(), initial_conn, secondary_conn)
+    normalizers = [get_normalizer('numeric(10,2)', 'REAL'), get_normalizer('timestamp', 'TEXT')]
+    initial_rows = iter([((1,), (1, Decimal('1.10'), datetime(2024, 1, 2, 3, 4, 5))),
+                         ((2,), (2, Decimal('2.00'), datetime(2024, 1, 2)))])
+    secondary_rows = iter([((1,), (1, 1.1, '2024-01-02 03:04:05')),
+                           ((2,), (2, 2.5, '2024-01-02'))])
+    diff_rows = list(differ._merge_rows(initial_rows, secondary_rows, 3, normalizers))
+    assert len(diff_rows) == 1
+    assert diff_rows[0][:2] == (2, 2)
+    assert diff_rows[0][-2:] == ('modified', 1)
+
+
+def test_report_on_secondary_target_uses_streamed_counts(conns, merge_args):
+    initial_conn, secondary_conn = conns
+    differ = MergeDiffer(merge_args(diff_target='secondary'), initial_conn, secondary_conn)
+    differ.create_diff_table()
+    assert differ.get_row_cnts() == (4, 4)
+    report = BasicReport(secondary_conn, 'main', 'tab_initial', 'tab_secondary', 'tab_diff',
+                         ['name', 'amount'], [],
+                         key_cols=['id'],
+                         db_type='sqlite',
+                         row_cnts=differ.get_row_cnts())
+    report.get_counts()
+    assert report.results['unchanged_row_cnt'] == 1
+    assert report.results['initial_table_row_cnt'] == 4
+    assert report.results['secondary_table_row_cnt'] == 4
+    assert not report.results['unchanged_row_cnt_estimated']
+
+
+def test_merge_normalizes_keys_across_drivers(merge_args, load_table):
+    # a TIMESTAMP key parsed into datetimes against the same key stored as text
+    initial_conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    secondary_conn = sqlite3.connect(':memory:')
+    load_table(initial_conn, 'tab_initial', [('2024-01-01 00:00:00', 'a', 1), ('2024-01-02 00:00:00', 'b', 2)],
+               "id TIMESTAMP, name VARCHAR, amount INT")
+    load_table(secondary_conn, 'tab_secondary', [('2024-01-01 00:00:00', 'a', 1), ('2024-01-03 00:00:00', 'c', 3)],
+               "id TEXT, name VARCHAR, amount INT")
+    MergeDiffer(merge_args(), initial_conn, secondary_conn).create_diff_table()
+    actual = initial_conn.execute("SELECT change_type FROM tab_diff ORDER BY change_type").fetchall()
+    assert actual == [('added',), ('removed',)]
+
+
+def test_merge_refuses_incomparable_keys_and_closes_the_sink(merge_args, load_table, tmp_path):
+    initial_conn = sqlite3.connect(':memory:')
+    secondary_conn = sqlite3.connect(':memory:')
+    load_table(initial_conn, 'tab_initial', [(1, 'a', 1)], TABLE_COLS)
+    load_table(secondary_conn, 'tab_secondary', [('one', 'a', 1)], "id TEXT, name VARCHAR, amount INT")
+    output_file = tmp_path / 'diff.csv'
+    with pytest.raises(ValueError, match='cannot be compared'):
+        MergeDiffer(merge_args(diff_target='file', output_file=str(output_file)),
+                    initial_conn, secondary_conn).create_diff_table()
+    assert output_file.read_text().startswith('initial_id,secondary_id')
+
+
+def test_merge_to_secondary_takes_its_column_types(merge_args, load_table):
+    initial_conn = sqlite3.connect(':memory:')
+    secondary_conn = sqlite3.connect(':memory:')
+    load_table(initial_conn, 'tab_initial', INITIAL_ROWS, "id BIGINT, name VARCHAR(20), amount NUMERIC(10, 2)")
+    load_table(secondary_conn, 'tab_secondary', SECONDARY_ROWS, TABLE_COLS)
+    MergeDiffer(merge_args(diff_target='secondary'), initial_conn, secondary_conn).create_diff_table()
+    col_types = {row[1]: row[2] for row in secondary_conn.execute("PRAGMA table_info(tab_diff)")}
+    assert col_types['initial_amount'] == col_types['secondary_amount'] == 'INT'
+    assert col_types['initial_id'] == 'INT'
+
+
+def test_merge_skips_excluded_keys(conns, merge_args, tmp_path):
+    initial_conn, secondary_conn = conns
+    initial_conn.execute("CREATE TABLE bad_keys (id INT)")
+    initial_conn.execute("INSERT INTO bad_keys VALUES (6)")
+    except_file = tmp_path / 'keys.csv'
+    except_file.write_text('id\n3\n')
+    args = merge_args()
+    args["table_info"].update(except_rows=['1'], except_file=str(except_file),
+                              except_query="SELECT id FROM bad_keys")
+    MergeDiffer(args, initial_conn, secondary_conn).create_diff_table()
+    actual = initial_conn.execute("SELECT COALESCE(initial_id, secondary_id) FROM tab_diff").fetchall()
+    assert actual == [(4,)]
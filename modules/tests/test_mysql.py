@@ -0,0 +1,108 @@
+#!/bin/env python
+
+""" Runs against a throwaway MySQL or MariaDB server, ex.:
+        docker run -d -p 3306:3306 -e MARIADB_ALLOW_EMPTY_ROOT_PASSWORD=1 -e MARIADB_DATABASE=td mariadb
+        TD_MYSQL_HOST=127.0.0.1 TD_MYSQL_USER=root TD_MYSQL_DB=td pytest modules/tests/test_mysql.py
+    and is skipped when TD_MYSQL_HOST is not set.
+"""
+
+import os
+
+import pytest
+
+from modules import db_utils
+from modules.create_diff_table import DiffWriter
+from modules.reporting import BasicReport
+
+pymysql = pytest.importorskip("pymysql")
+pytestmark = pytest.mark.skipif(not os.environ.get('TD_MYSQL_HOST'), reason='TD_MYSQL_HOST is not set')
+
+DB_NAME = os.environ.get('TD_MYSQL_DB', 'td')
+
+
+def get_args(**system):
+    return {
+        "database": {"db_type": "mysql"},
+        "table_info": {
+            "table_initial": "tab_initial",
+            "table_secondary": "tab_secondary",
+            "table_diff": "tab_diff",
+            "schema_name": DB_NAME,
+            "key_cols": ["id"],
+            "comp_cols": ["name", "amount"],
+            "ignore_cols": [],
+            "initial_table_alias": "initial",
+            "secondary_table_alias": "secondary",
+            "except_rows": None},
+        "system": system}
+
+
+@pytest.fixture
+def conn():
+    conn = pymysql.connect(host=os.environ['TD_MYSQL_HOST'],
+                           port=int(os.environ.get('TD_MYSQL_PORT', 3306)),
+                           user=os.environ.get('TD_MYSQL_USER', 'root'),
+                           password=os.environ.get('TD_MYSQL_PASSWORD', ''),
+                           database=DB_NAME)
+    cur = conn.cursor()
+    for table_name in ('tab_initial', 'tab_secondary', 'tab_diff'):
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cur.execute("CREATE TABLE tab_initial (id INT PRIMARY KEY, name VARCHAR(20), amount INT)")
+    cur.execute("CREATE TABLE tab_secondary (id INT PRIMARY KEY, name VARCHAR(20), amount INT)")
+    cur.executemany("INSERT INTO tab_initial VALUES (%s, %s, %s)",
+                    [(1, 'acme', 300), (2, 'nasa', 400), (3, 'jpl', None), (4, 'disney', 280)])
+    cur.executemany("INSERT INTO tab_secondary VALUES (%s, %s, %s)",
+                    [(1, 'acme', 340), (2, 'nasa', 400), (3, 'jpl', 430), (6, 'petrock', 15)])
+    conn.commit()
+    yield conn
+    for table_name in ('tab_initial', 'tab_secondary', 'tab_diff'):
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+    conn.close()
+
+
+def get_diff_rows(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT initial_id, secondary_id, change_type FROM tab_diff ORDER BY COALESCE(initial_id, secondary_id)")
+    return [tuple(row) for row in cur.fetchall()]
+
+
+EXPECTED = [(1, 1, 'modified'), (3, 3, 'modified'), (4, None, 'removed'), (None, 6, 'added')]
+
+
+def test_diff_table_and_report(conn):
+    DiffWriter(get_args(), conn).create_diff_table()
+    assert get_diff_rows(conn) == EXPECTED
+    report = BasicReport(conn, DB_NAME, 'tab_initial', 'tab_secondary', 'tab_diff', ['name', 'amount'], [],
+                         key_cols=['id'], db_type='mysql')
+    report.get_counts()
+    assert report.results['modified_row_cnt'] == 2
+    assert report.results['column_change_cnts'] == {'amount': 2, 'name': 0}
+
+
+def test_narrow_with_excluded_keys(conn):
+    args = get_args(narrow=True)
+    args["table_info"]["except_rows"] = ['4']
+    DiffWriter(args, conn).create_diff_table()
+    assert get_diff_rows(conn) == [row for row in EXPECTED if row[0] != 4]
+    # the scratch tables are named after the diff table and do not outlive the run
+    cur = conn.cursor()
+    cur.execute("SHOW TABLES LIKE 'tab\\_diff\\_\\_%'")
+    assert not cur.fetchall()
+
+
+def test_stream_to_file(conn, tmp_path):
+    output_file = tmp_path / 'diff.csv'
+    DiffWriter(get_args(diff_target='file', output_file=str(output_file), batch_size=1), conn).create_diff_table()
+    assert len(output_file.read_text().splitlines()) == len(EXPECTED) + 1
+
+
+def test_schema_fingerprint_follows_in_place_alters(conn):
+    db_facts = db_utils.DBFacts(conn)
+    _, before = db_facts.get_schema_fingerprint(DB_NAME, 'mysql', ['tab_initial'])
+    cur = conn.cursor()
+    # done in place, without changing create_time
+    cur.execute("ALTER TABLE tab_initial ADD COLUMN note VARCHAR(20)")
+    _, added = db_facts.get_schema_fingerprint(DB_NAME, 'mysql', ['tab_initial'])
+    cur.execute("ALTER TABLE tab_initial MODIFY COLUMN note VARCHAR(40)")
+    _, modified = db_facts.get_schema_fingerprint(DB_NAME, 'mysql', ['tab_initial'])
+    assert len({before, added, modified}) == 3
@@ -0,0 +1,81 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules import db_utils
+from modules.create_diff_table import DiffWriter
+from modules.partitions import KeyPartitioner
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = str(tmp_path / 'partitions.db')
+    conn = sqlite3.connect(db_path)
+    for table in ('tab_initial', 'tab_secondary'):
+        conn.execute(f"CREATE TABLE {table} (id INT, amount INT)")
+        conn.executemany(f"INSERT INTO {table} VALUES (?, ?)", [(i, i) for i in range(1, 1001)])
+    conn.execute("UPDATE tab_secondary SET amount = 0 WHERE id % 100 = 0")
+    conn.execute("INSERT INTO tab_secondary VALUES (NULL, 5)")
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def test_balanced_bounds_and_predicates(db_path):
+    conn = sqlite3.connect(db_path)
+    partitioner = KeyPartitioner(conn.cursor(), 'sqlite', 'main', 'tab_initial', 'id')
+    bounds = partitioner.get_bounds(4)
+    assert bounds == [251, 501, 751]
+    predicates = partitioner.get_predicates(bounds)
+    assert len(predicates) == 4
+    counts = [conn.execute(f"SELECT COUNT(*) FROM tab_secondary WHERE {predicate}").fetchall()[0][0]
+              for predicate in predicates]
+    assert counts == [251, 250, 250, 250]
+
+
+def test_parallel_inserts_match_single_build(db_path, build_args):
+    conn = sqlite3.connect(db_path)
+    DiffWriter(build_args(comp_cols=['amount']), conn).create_diff_table()
+    expected = conn.execute("SELECT * FROM tab_diff ORDER BY 1, 2").fetchall()
+
+    def connect():
+        return sqlite3.connect(db_path, check_same_thread=False)
+
+    writer = DiffWriter(build_args(comp_cols=['amount'], workers=4), conn, connect=connect)
+    clauses = writer._get_clauses()
+    writer.cur.execute(writer._assemble_drop_query())
+    writer.cur.execute(writer._assemble_create_query(clauses, '1 = 0'))
+    conn.commit()
+    writer._run_inserts_parallel([writer._assemble_insert_query(clauses, predicate)
+                                  for predicate in writer._get_partition_predicates()])
+    assert conn.execute("SELECT * FROM tab_diff ORDER BY 1, 2").fetchall() == expected
+
+    writer.create_diff_table()
+    assert conn.execute("SELECT * FROM tab_diff ORDER BY 1, 2").fetchall() == expected
+
+
+def test_failed_partition_leaves_no_diff_table(db_path, build_args):
+    conn = sqlite3.connect(db_path)
+    writer = DiffWriter(build_args(comp_cols=['amount'], workers=4), conn)
+    partitions = writer._get_partition_predicates
+    writer._get_partition_predicates = lambda: partitions()[:2] + ['no_such_col = 1']
+    with pytest.raises(sqlite3.OperationalError, match='no_such_col'):
+        writer.create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff'").fetchall()
+
+
+def test_connection_pool_reuses_connections():
+    opened = []
+
+    def connect():
+        opened.append(sqlite3.connect(':memory:'))
+        return opened[-1]
+
+    pool = db_utils.ConnectionPool(connect, 2)
+    first = pool.get()
+    pool.put(first)
+    assert pool.get() is first
+    pool.get()
+    assert len(opened) == 2
@@ -0,0 +1,90 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+from modules.reporting import BasicReport
+
+
+@pytest.fixture
+def conn(conn, build_args):
+    DiffWriter(build_args(), conn).create_diff_table()
+    return conn
+
+
+def test_diff_table_holds_only_changed_rows(conn):
+    rows = conn.execute("SELECT initial_id, secondary_id, change_type FROM tab_diff ORDER BY 1, 2").fetchall()
+    assert rows == [(None, 6, 'added'), (1, 1, 'modified'), (3, 3, 'modified'), (4, None, 'removed')]
+
+
+def test_counts_from_diff_table(conn, get_report):
+    report = get_report(conn)
+    report.get_counts()
+    assert report.results['only_initial_row_cnt'] == 1
+    assert report.results['only_secondary_row_cnt'] == 1
+    assert report.results['modified_row_cnt'] == 2
+    assert report.results['unchanged_row_cnt'] == 2
+    assert report.results['initial_table_row_cnt'] == 5
+    assert report.results['secondary_table_row_cnt'] == 5
+    assert report.results['initial_table_row_estimate'] is None
+    assert report.results['column_change_cnts'] == {'amount': 2, 'name': 0}
+
+
+def test_failed_build_raises_the_driver_error(conn, build_args, capsys):
+    conn.execute("DROP TABLE tab_secondary")
+    with pytest.raises(sqlite3.OperationalError, match='tab_secondary'):
+        DiffWriter(build_args(), conn).create_diff_table()
+    assert 'Diff Table Created' not in capsys.readouterr().out
+
+
+def test_column_counts_follow_diff_table_order(conn):
+    # mask bits are assigned in get_usable_cols() order (Zeta before alpha), which a
+    # database folding the names to lower case no longer sorts the same way
+    conn.execute("""CREATE TABLE lowered_diff (initial_id INT, secondary_id INT,
+                        initial_zeta INT, secondary_zeta INT, initial_alpha INT, secondary_alpha INT,
+                        change_type VARCHAR, changed_mask_0 INT)""")
+    conn.execute("INSERT INTO lowered_diff VALUES (1, 1, 1, 2, 5, 5, 'modified', 1)")
+    report = BasicReport(conn, 'main', 'tab_initial', 'tab_secondary', 'lowered_diff',
+                         ['Zeta', 'alpha'], [],
+                         key_cols=['id'],
+                         initial_table_alias='initial',
+                         secondary_table_alias='secondary',
+                         db_type='sqlite')
+    report.get_counts()
+    assert report.results['column_change_cnts'] == {'zeta': 1, 'alpha': 0}
+
+
+def test_row_estimate_from_sqlite_stats(conn, get_report):
+    conn.execute("CREATE INDEX tab_initial_id ON tab_initial (id)")
+    conn.execute("ANALYZE")
+    report = get_report(conn)
+    report.get_counts()
+    assert report.results['initial_table_row_estimate'] == 5
+    report.write_report()
+
+
+def test_estimated_row_counts_are_labelled(conn, get_report, capsys):
+    conn.execute("CREATE INDEX tab_initial_id ON tab_initial (id)")
+    conn.execute("ANALYZE")
+    report = get_report(conn)
+    report.get_counts()
+    report.write_report()
+    out = capsys.readouterr().out
+    assert 'initial table row count (estimated)' in out
+    assert 'secondary table row count (estimated)' in out
+
+
+def test_empty_row_estimate_falls_back_to_count(conn, get_report, capsys):
+    # as Postgres reports a table never vacuumed nor analyzed
+    conn.execute("CREATE INDEX tab_initial_id ON tab_initial (id)")
+    conn.execute("ANALYZE")
+    conn.execute("UPDATE sqlite_stat1 SET stat = '0 1'")
+    report = get_report(conn)
+    report.get_counts()
+    assert report.results['initial_table_row_estimate'] == 0
+    assert report.results['initial_table_row_cnt'] == 5
+    assert not report.results['unchanged_row_cnt_estimated']
+    report.write_report()
+    assert '(estimated)' not in capsys.readouterr().out
@@ -0,0 +1,114 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.batch import diff_pair
+from modules.create_diff_table import DiffWriter
+
+
+@pytest.fixture
+def conn(tmp_path, load_table):
+    conn = sqlite3.connect(str(tmp_path / 'cache.db'))
+    load_table(conn, 'tab_initial', [(1, 'acme', 300, 'a'), (2, 'nasa', 400, 'b'), (3, 'jpl', None, 'c')])
+    load_table(conn, 'tab_secondary', [(1, 'acme', 340, 'a'), (2, 'nasa', 400, 'b'), (4, 'ginsu', 10, 'd')])
+    return conn
+
+
+@pytest.fixture
+def cache_args(build_args):
+    def build(**table_info):
+        return build_args(comp_cols=(), ignore_cols=['note'], table_info=table_info, cache=True)
+    return build
+
+
+@pytest.fixture
+def run(cache_args):
+    def run_diff(conn, args=None):
+        args = args or cache_args()
+        result = diff_pair(args, conn, args["table_info"])
+        assert result['status'] == 'ok'
+        return result
+    return run_diff
+
+
+def mark_diff_table(conn):
+    # a row the diff never writes, so a rebuild can be told from a reuse
+    conn.execute("INSERT INTO tab_diff (change_type) VALUES ('marker')")
+    conn.commit()
+
+
+def is_marked(conn):
+    return bool(conn.execute("SELECT COUNT(*) FROM tab_diff WHERE change_type = 'marker'").fetchall()[0][0])
+
+
+def test_unchanged_tables_reuse_the_diff_and_report(conn, run):
+    first = run(conn)
+    mark_diff_table(conn)
+    second = run(conn)
+    assert is_marked(conn)
+    assert second['modified_row_cnt'] == first['modified_row_cnt'] == 1
+    assert second['column_change_cnts'] == first['column_change_cnts']
+
+
+def test_changed_data_rebuilds(conn, run):
+    run(conn)
+    mark_diff_table(conn)
+    conn.execute("UPDATE tab_secondary SET name = 'NASA' WHERE id = 2")
+    conn.commit()
+    result = run(conn)
+    assert not is_marked(conn)
+    assert result['modified_row_cnt'] == 2
+
+
+def test_changed_parameters_rebuild(conn, run, cache_args):
+    run(conn)
+    mark_diff_table(conn)
+    run(conn, cache_args(except_rows=['4']))
+    assert not is_marked(conn)
+
+
+def test_ignored_column_changes_keep_the_cache(conn, run):
+    run(conn)
+    mark_diff_table(conn)
+    conn.execute("UPDATE tab_secondary SET note = 'changed'")
+    conn.commit()
+    run(conn)
+    assert is_marked(conn)
+
+
+def test_fingerprint_is_taken_before_the_first_build(conn, run, cache_args):
+    writer = DiffWriter(cache_args(), conn)
+    write_diff = writer._write_diff
+
+    def write_diff_then_change(clauses):
+        write_diff(clauses)
+        # a write landing while the diff table is built is not in it
+        conn.execute("UPDATE tab_secondary SET name = 'NASA' WHERE id = 2")
+        conn.commit()
+
+    writer._write_diff = write_diff_then_change
+    writer.create_diff_table()
+    writer.store_results({'modified_row_cnt': 1})
+    mark_diff_table(conn)
+    result = run(conn)
+    assert not is_marked(conn)
+    assert result['modified_row_cnt'] == 2
+
+
+def test_rebuild_without_cache_drops_the_cached_report(conn, run, build_args):
+    run(conn)
+    sampled_args = build_args(comp_cols=(), ignore_cols=['note'], sample=5)
+    DiffWriter(sampled_args, conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'tab_diff__cache'").fetchall()
+    mark_diff_table(conn)
+    result = run(conn)
+    assert not is_marked(conn)
+    assert result['modified_row_cnt'] == 1
+
+
+def test_fast_mode_is_refused(conn, build_args):
+    with pytest.raises(ValueError):
+        DiffWriter(build_args(cache=True, fast=True), conn).create_diff_table()
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'tab_diff%'").fetchall()
@@ -0,0 +1,30 @@
+#!/bin/env python
+
+import sqlite3
+
+from modules.create_diff_table import DiffWriter
+from modules.reporting import BasicReport
+
+
+def test_sampled_counts_are_extrapolated(build_args, load_table):
+    conn = sqlite3.connect(':memory:')
+    rows = [(i, f'name_{i}', i, '') for i in range(20000)]
+    load_table(conn, 'tab_initial', rows)
+    load_table(conn, 'tab_secondary', rows)
+    conn.execute("UPDATE tab_secondary SET amount = -1 WHERE id % 20 = 0")
+    writer = DiffWriter(build_args(comp_cols=(), ignore_cols=["note"], sample=10), conn)
+    writer.create_diff_table()
+    sampled_cnt = conn.execute("SELECT COUNT(*) FROM tab_diff").fetchall()[0][0]
+    assert 0 < sampled_cnt < 1000
+    assert conn.execute("SELECT COUNT(*) FROM tab_diff WHERE change_type <> 'modified'").fetchall()[0][0] == 0
+
+    report = BasicReport(conn, 'main', 'tab_initial', 'tab_secondary', 'tab_diff', [], ['note'],
+                         key_cols=['id'], db_type='sqlite',
+                         sample_pct=10, sample_predicate=writer.sample_predicate)
+    report.get_counts()
+    low, high = report.results['confidence_intervals']['modified_row_cnt']
+    assert report.results['modified_row_cnt'] == sampled_cnt * 10
+    assert low <= 1000 <= high
+    assert report.results['confidence_intervals']['only_initial_row_cnt'][0] == 0
+    assert 18000 <= report.results['unchanged_row_cnt'] + report.results['modified_row_cnt'] <= 22000
+    report.write_report()
@@ -0,0 +1,99 @@
+#!/bin/env python
+
+import sqlite3
+
+import pytest
+
+from modules.create_diff_table import DiffWriter
+from modules.viewer import TableViewer, get_viewers
+
+
+TABLE_INFO = {
+    "table_initial": "tab_initial",
+    "table_secondary": "tab_secondary",
+    "table_diff": "tab_diff",
+    "schema_name": "main",
+    "key_cols": ["region", "id"],
+    "comp_cols": ["amount"],
+    "ignore_cols": [],
+    "initial_table_alias": "initial",
+    "secondary_table_alias": "secondary",
+    "except_rows": None}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE tab_initial (region VARCHAR, id INT, amount INT)")
+    conn.execute("CREATE TABLE tab_secondary (region VARCHAR, id INT, amount INT)")
+    rows = [(region, num, num * 10) for region in ('east', 'west') for num in range(1, 8)]
+    conn.executemany("INSERT INTO tab_initial VALUES (?, ?, ?)", rows)
+    conn.executemany("INSERT INTO tab_secondary VALUES (?, ?, ?)",
+                      [(region, num, amount + (num % 2)) for region, num, amount in rows if num != 4])
+    conn.execute("INSERT INTO tab_initial VALUES (NULL, 1, 0)")
+    conn.commit()
+    return conn
+
+
+def test_pages_walk_the_keys_in_order(conn):
+    viewer = TableViewer(conn, 'sqlite', 'main', 'tab_initial', ['region', 'id'], page_size=4)
+    pages = list(viewer.pages())
+    assert [len(page) for page in pages] == [4, 4, 4, 2]
+    keys = [row[:2] for page in pages for row in page]
+    assert keys == sorted(keys) and len(keys) == 14    # the NULL key is not paged
+    assert viewer.columns == ['region', 'id', 'amount']
+
+
+def test_jump_to_key(conn):
+    viewer = TableViewer(conn, 'sqlite', 'main', 'tab_initial', ['region', 'id'], page_size=3)
+    rows, next_key = viewer.get_page(('west', 6), inclusive=True)
+    assert rows == [('west', 6, 60), ('west', 7, 70)]
+    assert next_key is None
+    rows, next_key = viewer.get_page(('east', 2))
+    assert [row[1] for row in rows] == [3, 4, 5]
+    assert next_key == ('east', 5)
+
+
+def test_diff_table_is_paged_on_either_side_key(conn):
+    DiffWriter({"database": {"db_type": "sqlite"}, "table_info": TABLE_INFO, "system": {}},
+               conn).create_diff_table()
+    viewer = get_viewers(conn, 'sqlite', TABLE_INFO, 'main', page_size=5, diff_only=True)[0]
+    keys = [key for page in viewer.pages() for key in
+            [(row[0] or row[1], row[2] or row[3]) for row in page]]
+    assert keys == sorted(keys)
+    assert ('east', 4) in keys and ('west', 4) in keys
+    assert len(keys) == 10    # ids 1, 3, 4, 5, 7 in both regions
+
+
+def test_diff_table_pages_through_the_key_index(conn):
+    DiffWriter({"database": {"db_type": "sqlite"}, "table_info": TABLE_INFO, "system": {}},
+               conn).create_diff_table()
+    viewer = get_viewers(conn, 'sqlite', TABLE_INFO, 'main', page_size=5, diff_only=True)[0]
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {viewer._assemble_page_query(True, False)}",
+                        ('east', 3)).fetchall()
+    details = ' '.join(row[-1] for row in plan)
+    assert 'tab_diff__view_key' in details
+    assert 'TEMP B-TREE' not in details
+    # viewing the same diff table again finds the index in place
+    get_viewers(conn, 'sqlite', TABLE_INFO, 'main', diff_only=True)
+
+
+def test_full_last_page_is_the_last(conn):
+    viewer = TableViewer(conn, 'sqlite', 'main', 'tab_initial', ['region', 'id'], page_size=7)
+    assert [len(page) for page in viewer.pages()] == [7, 7]
+
+
+def test_typed_keys_match_the_key_column_types(conn):
+    DiffWriter({"database": {"db_type": "sqlite"}, "table_info": TABLE_INFO, "system": {}},
+               conn).create_diff_table()
+    viewer = get_viewers(conn, 'sqlite', TABLE_INFO, 'main', page_size=2, diff_only=True)[0]
+    start_key = viewer.parse_key(('west', '5'))
+    assert start_key == ('west', 5)
+    rows, next_key = viewer.get_page(start_key, inclusive=True)
+    assert [(row[0] or row[1], row[2] or row[3]) for row in rows] == [('west', 5), ('west', 7)]
+    assert next_key is None
+
+    with pytest.raises(ValueError):
+        viewer.parse_key(('west', 'five'))
+    with pytest.raises(ValueError):
+        viewer.parse_key(('west',))
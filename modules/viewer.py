@@ -0,0 +1,207 @@
+#! usr/bin/env python
+
+""" viewer pages through the compared tables and the 'diff_table' for --print-tables.
+    Pages are read with keyset pagination over the key columns: every page is a
+    query for the next page_size rows after the last key shown, so each page costs
+    one index range scan and holds only page_size rows in memory, however large
+    the table. The diff table, whose key is on either side of the row, is indexed
+    on the expression picking the side present the first time it is viewed. The viewer can also jump straight to a key, typed in as text and
+    converted to the types of the key columns before it is bound.
+    Rows with a NULL key cannot be ordered against the others and are not paged.
+"""
+
+import logging
+from decimal import Decimal
+
+from rich.console import Console
+from rich.prompt import Prompt
+from rich.table import Table
+
+from modules import db_utils
+
+INTEGER_TYPES = ('int', 'serial')
+DECIMAL_TYPES = ('numeric', 'decimal', 'real', 'float', 'double')
+
+
+def cast_key_value(value: str, col_type: str, db_type: str):
+    """ Returns a key value typed in as text as the Python type of its column,
+        so it compares as a number where the column holds numbers. Raises
+        ValueError when the text is not a value of the column.
+    """
+    col_type = col_type.lower()
+    if col_type.startswith('interval'):
+        return value
+    if any(kind in col_type for kind in INTEGER_TYPES) and not col_type.startswith('point'):
+        return int(value)
+    if any(kind in col_type for kind in DECIMAL_TYPES):
+        return Decimal(value) if db_utils.get_dialect(db_type).binds_decimal else float(value)
+    return value
+
+
+class TableViewer:
+    """Reads one table a page at a time, in key order
+    """
+
+    def __init__(self,
+                 conn,
+                 db_type: str,
+                 schema_name: str,
+                 table_name: str,
+                 key_cols: list[str],
+                 page_size: int = 50,
+                 key_exprs: list[str]|None = None,
+                 key_types: list[str]|None = None):
+
+        self.conn = conn
+        self.db_type = db_type
+        self.table_name = table_name
+        self.schema_name = schema_name
+        self.table_ref = db_utils.table_ref(db_type, schema_name, table_name)
+        self.key_cols = key_cols
+        # the expressions the pages are ordered by, the key columns themselves
+        # unless the table keeps its keys in several columns (ex.: the diff table)
+        self.key_exprs = key_exprs or key_cols
+        # the column types of the key expressions, read from the table when not given
+        self.key_types = key_types
+        self.page_size = page_size
+        self.marker = db_utils.param_marker(db_type)
+        self.columns = []
+
+    def _assemble_page_query(self, after_key: bool, inclusive: bool) -> str:
+        keys = ', '.join(self.key_exprs)
+        markers = ', '.join([self.marker] * len(self.key_exprs))
+        not_null = ' AND '.join([f"{expr} IS NOT NULL" for expr in self.key_exprs])
+        after = f"AND ({keys}) {'>=' if inclusive else '>'} ({markers})" if after_key else ''
+        return f"""
+                SELECT {keys}, page_rows.*
+                FROM {self.table_ref} page_rows
+                WHERE {not_null}
+                    {after}
+                ORDER BY {keys}
+                LIMIT {self.page_size + 1}
+                """
+
+    def get_page(self, after_key: tuple|None = None, inclusive: bool = False) -> tuple[list[tuple], tuple|None]:
+        """ Returns the rows of the page following after_key (starting at it when
+            inclusive) and the key to read the next page after, None on the last page.
+            One row more than a page is read, so a last page that happens to be full
+            is known to be the last.
+        """
+        query = self._assemble_page_query(after_key is not None, inclusive)
+        logging.debug(f"[bold red] Page Query[/]: {query}")
+        cur = self.conn.cursor()
+        cur.execute(query, tuple(after_key or ()))
+        results = cur.fetchall()
+        key_cnt = len(self.key_exprs)
+        self.columns = [desc[0] for desc in cur.description][key_cnt:]
+        rows = [row[key_cnt:] for row in results[:self.page_size]]
+        next_key = tuple(results[self.page_size - 1][:key_cnt]) if len(results) > self.page_size else None
+        return rows, next_key
+
+    def parse_key(self, values) -> tuple:
+        """ Returns a key given as text (ex.: on the CLI) typed like the key columns
+        """
+        if self.key_types is None:
+            col_types = db_utils.DBFacts(self.conn).get_col_types(self.schema_name, self.db_type, self.table_name)
+            self.key_types = [col_types.get(col, 'TEXT') for col in self.key_cols]
+        if len(values) != len(self.key_exprs):
+            raise ValueError(f"expected {len(self.key_exprs)} comma separated key values")
+        return tuple(cast_key_value(value, col_type, self.db_type)
+                     for value, col_type in zip(values, self.key_types))
+
+    def pages(self, start_key: tuple|None = None):
+        """ Yields every page from start_key (or the first key) onwards
+        """
+        rows, next_key = self.get_page(start_key, inclusive=True)
+        yield rows
+        while next_key is not None:
+            rows, next_key = self.get_page(next_key)
+            yield rows
+
+    def write_page(self, rows: list[tuple], page_num: int):
+        page_table = Table(title=f"{self.table_name} (page {page_num})")
+        for column in self.columns:
+            page_table.add_column(column, style="cyan", no_wrap=True)
+        for row in rows:
+            page_table.add_row(*['NULL' if value is None else str(value) for value in row])
+        console = Console()    # rich text output formatting for CLI tables
+        console.print(page_table)
+
+    def browse(self, start_key: tuple|None = None):
+        """ Prints a page at a time, asking whether to show the next page, jump to
+            a key (comma separated for several key columns) or move on. start_key
+            is given as text, like the keys typed in.
+        """
+        page_num = 1
+        rows, next_key = self.get_page(self.parse_key(start_key) if start_key else None, inclusive=True)
+        while True:
+            self.write_page(rows, page_num)
+            if next_key is None:
+                return
+            try:
+                answer = Prompt.ask(f"[bold]{self.table_name}[/]: (n)ext page, (q)uit or a key to jump to",
+                                    default='n')
+            except EOFError:
+                return
+            if answer.lower() in ('q', 'quit'):
+                return
+            if answer.lower() in ('n', 'next', ''):
+                rows, next_key = self.get_page(next_key)
+                page_num += 1
+            else:
+                try:
+                    jump_key = self.parse_key([value.strip() for value in answer.split(',')])
+                except ValueError as e:
+                    print(e)
+                    continue
+                rows, next_key = self.get_page(jump_key, inclusive=True)
+                page_num = 1
+
+
+def index_diff_keys(conn, db_type: str, schema_name: str, table_diff: str, diff_keys: list[str]):
+    """ Indexes the diff table on the expressions its pages are ordered by, so a
+        page is an index range scan rather than a sort of the whole diff table.
+        The index lives as long as the diff table, a rebuilt diff table gets a new one.
+    """
+    dialect = db_utils.get_dialect(db_type)
+    index_query = dialect.expression_index_query(f"{table_diff}__view_key",
+                                                 db_utils.table_ref(db_type, schema_name, table_diff),
+                                                 diff_keys)
+    if index_query is None:
+        return
+    cur = conn.cursor()
+    try:
+        cur.execute(index_query)
+        conn.commit()
+    except dialect.operational_error() as e:
+        # already indexed, or a key type the backend cannot index on an expression
+        conn.rollback()
+        logging.debug(f"[bold red]Diff table not indexed for paging[/]: {e}")
+
+
+def get_viewers(conn,
+                db_type: str,
+                table_info: dict,
+                schema_name: str,
+                page_size: int = 50,
+                diff_only: bool = False) -> list[TableViewer]:
+    """ Returns a viewer for the initial and secondary tables and one for the
+        diff table, whose key is whichever side of the row is present
+    """
+    key_cols = table_info['key_cols']
+    db_facts = db_utils.DBFacts(conn)
+    viewers = []
+    if not diff_only:
+        for table_name in (table_info['table_initial'], table_info['table_secondary']):
+            col_types = db_facts.get_col_types(schema_name, db_type, table_name)
+            viewers.append(TableViewer(conn, db_type, schema_name, table_name, key_cols, page_size,
+                                       key_types=[col_types[key] for key in key_cols]))
+    initial_alias = table_info['initial_table_alias']
+    secondary_alias = table_info['secondary_table_alias']
+    diff_keys = [f"COALESCE({initial_alias}_{key}, {secondary_alias}_{key})" for key in key_cols]
+    index_diff_keys(conn, db_type, schema_name, table_info['table_diff'], diff_keys)
+    diff_types = db_facts.get_col_types(schema_name, db_type, table_info['table_diff'])
+    viewers.append(TableViewer(conn, db_type, schema_name, table_info['table_diff'], key_cols, page_size,
+                               key_exprs=diff_keys,
+                               key_types=[diff_types[f"{initial_alias}_{key}"] for key in key_cols]))
+    return viewers
@@ -37,13 +37,20 @@
 
     # OPTIONAL ARGUMENTS
         -e --except_rows               signals Table Differ to ignore specific rows within
-                                    each table based on the value of their key column(s)
+                                    each table based on the value of their key column(s).
+                                    --ex-rows-file and --ex-rows-query read the keys from a
+                                    csv file or from a query instead
 
         -l --logging_level          sets the logging level of Table Differ (default CRITICAL)
 
-        -p --print_tables           attempts to print both of the tables used in the comparison
-                                    to the CLI. This is only to be used with small tables and will
-                                    certainly cause issues when applied to very large tables
+        -p --print_tables           pages through both of the tables used in the comparison and
+                                    the diff_table in key order, one page (--page-size rows) at a
+                                    time, starting from the first key or from --start-key
+
+        --check                     only tells whether the tables differ, stopping at the first
+                                    difference: exits 0 when identical, 1 when they differ,
+                                    printing up to --check-examples example keys, and 2 when
+                                    the check could not run (ex.: no connection, missing table)
 
 example testing run
 ./table-differ.py -i info --configs y -p y
@@ -51,51 +58,158 @@ example testing run
 
 # BUILT-INS
 import logging
+import sys
 from os.path import expanduser
 
-# THIRD PARTY
-import psycopg2
-
 # PERSONAL
+from modules import daemon
+from modules import dialects
 from modules import get_config
+from modules.batch import BatchRunner
 from modules.create_diff_table import DiffWriter
+from modules.explain import PlanAdvisor
+from modules.merge_diff import MergeDiffer
 from modules.reporting import BasicReport
+from modules.viewer import get_viewers
 
 
 def main():
     args = get_config.get_config()
-    db = args["database"]["db_type"]
-    conn = create_connection(args, db)
+    fast = bool(args["system"]["fast"])
+    if args["system"]["serve"]:
+        daemon.serve(args, lambda: create_connection(args["database"], fast), args["system"]["serve"])
+        return
+    if args["pairs"]:
+        batch = BatchRunner(args, connect=lambda: create_connection(args["database"], fast))
+        batch.run()  # generates a diff_table for every table pair of the config
+        batch.write_report()
+        return
+
+    conn = create_connection(args["database"], fast)
+    schema_name = args['table_info']['schema_name']
+    db_type = args['database']['db_type']
+    sample_pct, sample_predicate = None, None
+    cached_results = None
+    row_cnts = None
+
+    if args["secondary_database"]:
+        if args['system']['sample']:
+            logging.warning("[bold red]--sample is not supported across connections, diffing every key[/]")
+        if args['system']['check']:
+            logging.warning("[bold red]--check is not supported across connections, building the full diff[/]")
+        secondary_conn = create_connection(args["secondary_database"])
+        tables = MergeDiffer(args, conn, secondary_conn)
+        tables.create_diff_table()  # generates initial diff_table across both connections
+        if args['system']['diff_target'] == 'file':
+            return
+        row_cnts = tables.get_row_cnts()
+        if args['system']['diff_target'] == 'secondary':
+            conn = secondary_conn
+            schema_name = args['secondary_database']['schema_name']
+            db_type = args['secondary_database']['db_type']
+    elif args['system']['explain']:
+        explain_plans(args, conn)
+        return
+    elif args['system']['check']:
+        sys.exit(check_tables(args, conn))
+    else:
+        tables = DiffWriter(args, conn, connect=lambda: create_connection(args["database"], fast))
+        tables.create_diff_table()  # generates initial diff_table
+        if args['system']['diff_target'] == 'file':
+            return
+        sample_pct, sample_predicate = tables.sample_pct, tables.sample_predicate
+        cached_results = tables.cached_results
 
-    tables = DiffWriter(args, conn)
-    tables.create_diff_table()  # generates initial diff_table
     basic_report = BasicReport(conn,
-                                args['table_info']['schema_name'],
+                                schema_name,
                                 args['table_info']['table_initial'],
                                 args['table_info']['table_secondary'],
                                 args['table_info']['table_diff'],
                                 args['table_info']['comp_cols'],
-                                args['table_info']['ignore_cols'])
-    basic_report.generate_report()
+                                args['table_info']['ignore_cols'],
+                                key_cols=args['table_info']['key_cols'],
+                                initial_table_alias=args['table_info']['initial_table_alias'],
+                                secondary_table_alias=args['table_info']['secondary_table_alias'],
+                                db_type=db_type,
+                                sample_pct=sample_pct,
+                                sample_predicate=sample_predicate,
+                                row_cnts=row_cnts)
+    if cached_results is not None:
+        basic_report.results = cached_results
+        basic_report.write_report()
+    else:
+        basic_report.generate_report()
+        if not args["secondary_database"]:
+            tables.store_results(basic_report.results)
+
+    if args['system']['print_tables']:
+        # with a secondary connection only the diff table is on this one
+        for viewer in get_viewers(conn, db_type, args['table_info'], schema_name,
+                                  page_size=args['system']['page_size'],
+                                  diff_only=bool(args["secondary_database"])):
+            viewer.browse(tuple(args['system']['start_key'] or ()) or None)
+
+
+def check_tables(args: dict, conn) -> int:
+    """Probes the tables for a first difference without building the diff table
+    and returns the exit code: 0 when identical, 1 when they differ, 2 on error,
+    so a failed check is never mistaken for a difference
+    """
+    try:
+        result = DiffWriter(args, conn).check(args['system']['check_examples'])
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return 2
+    if result is None:
+        print('Tables are identical')
+        return 0
+    kind, keys = result
+    print(f"Tables differ: {kind.replace('_', ' ')} rows, ex.: "
+          f"{', '.join([str(key[0] if len(key) == 1 else key) for key in keys])}")
+    return 1
+
+
+def explain_plans(args: dict, conn):
+    """Saves the plans of the diff query and of the report queries, with advice
+    on the patterns that make them slow, without building the diff table
+    """
+    table_info = args['table_info']
+    writer = DiffWriter(args, conn)
+    report = BasicReport(conn,
+                         table_info['schema_name'],
+                         table_info['table_initial'],
+                         table_info['table_secondary'],
+                         table_info['table_diff'],
+                         table_info['comp_cols'],
+                         table_info['ignore_cols'],
+                         key_cols=table_info['key_cols'],
+                         initial_table_alias=table_info['initial_table_alias'],
+                         secondary_table_alias=table_info['secondary_table_alias'],
+                         db_type=args['database']['db_type'])
+    advisor = PlanAdvisor(conn,
+                          args['database']['db_type'],
+                          table_info['schema_name'],
+                          [table_info['table_initial'], table_info['table_secondary']],
+                          analyze=bool(args['system']['analyze']))
+    try:
+        queries = writer.get_queries()
+        queries.update({f'report_{name}': query for name, query in report.get_queries().items()})
+        results = advisor.capture(queries)
+    finally:
+        writer.drop_except_keys()
+    plan_file = args['system']['plan_file'] or f"{table_info['table_diff']}.plan.json"
+    advisor.write_plans(results, plan_file)
 
 
-def create_connection(args, db: str):
-    """Attempts to connect to database using SQLAlchemy and a URL that is pieced together from
-    components in config.yaml
+def create_connection(db_args: dict, fast: bool = False):
+    """Attempts to connect to the database described by one of the database blocks
+    (database or secondary_database) of the config. A fast connection is tuned
+    for throwaway diff runs.
     """
+    conn = None
     try:
-        if db == "postgres":
-            conn = psycopg2.connect(
-                host=args["database"]["db_host"],
-                database=args["database"]["db_name"],
-                user=args["database"]["db_user"],
-                port=args["database"]["db_port"],
-            )
-        elif db == "sqlite":
-            assert args["database"]["db_path"]
-            conn = sqlite3.connect(args["database"]["db_path"])
-        else:
-            raise ValueError(f'Invalid db value: {db}')
+        # the backend's driver is only imported here, once it is actually needed
+        conn = dialects.get_dialect(db_args["db_type"]).connect(db_args, fast)
         logging.info(f"[bold red]CURRENT CONNECTION:[/]  {conn}")
     except Exception as e:
         print(f"ERROR: {str(e)}")